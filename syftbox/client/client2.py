@@ -17,6 +17,7 @@ from syftbox.client.env import syftbox_env
 from syftbox.client.exceptions import SyftBoxAlreadyRunning, SyftInitializationError, SyftServerError
 from syftbox.client.logger import setup_logger
 from syftbox.client.plugins.apps import AppRunner
+from syftbox.client.plugins.sync.endpoints import raise_for_rate_limit
 from syftbox.client.plugins.sync.manager import SyncManager
 from syftbox.client.utils import error_reporting, file_manager, macos
 from syftbox.lib.client_config import SyftClientConfig
@@ -57,6 +58,7 @@ class SyftClient:
             base_url=str(self.config.server_url),
             follow_redirects=True,
             headers={"email": self.config.email, "Authorization": f"Bearer {self.config.access_token}"},
+            event_hooks={"response": [raise_for_rate_limit]},
         )
 
         # kwargs for making customization/unit testing easier
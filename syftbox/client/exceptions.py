@@ -25,3 +25,9 @@ class SyftAuthenticationError(SyftServerError):
 
 class SyftNotFound(SyftServerError):
     pass
+
+
+class SyftRateLimited(SyftServerError):
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
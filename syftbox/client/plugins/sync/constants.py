@@ -1,2 +1,7 @@
 # TODO move to client config after refactor
 MAX_FILE_SIZE_MB = 10
+
+# new files are uploaded with /sync/upload_bulk if there are at least MIN_BULK_UPLOAD_FILES of them
+MIN_BULK_UPLOAD_FILES = 10
+MAX_BULK_UPLOAD_FILES = 100
+MAX_BULK_UPLOAD_BYTES = 32 * 1024 * 1024
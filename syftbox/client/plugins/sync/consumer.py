@@ -1,7 +1,9 @@
 import enum
 import hashlib
+import shutil
 import threading
 import zipfile
+from collections import defaultdict
 from enum import Enum
 from io import BytesIO
 from pathlib import Path
@@ -12,16 +14,23 @@ from loguru import logger
 from pydantic import BaseModel
 
 from syftbox.client.base import SyftClientInterface
-from syftbox.client.exceptions import SyftServerError
-from syftbox.client.plugins.sync.constants import MAX_FILE_SIZE_MB
+from syftbox.client.exceptions import SyftNotFound, SyftRateLimited, SyftServerError
+from syftbox.client.plugins.sync.constants import (
+    MAX_BULK_UPLOAD_BYTES,
+    MAX_BULK_UPLOAD_FILES,
+    MAX_FILE_SIZE_MB,
+    MIN_BULK_UPLOAD_FILES,
+)
 from syftbox.client.plugins.sync.endpoints import (
     apply_diff,
     create,
     delete,
-    download,
     download_bulk,
+    download_to_file,
+    get_delta,
     get_diff,
     get_metadata,
+    upload_bulk,
 )
 from syftbox.client.plugins.sync.exceptions import FatalSyncError, SyncEnvironmentError
 from syftbox.client.plugins.sync.queue import SyncQueue, SyncQueueItem
@@ -40,7 +49,11 @@ class SyncDecisionType(Enum):
 
 
 def update_local(client: SyftClientInterface, local_syncstate: FileMetadata, remote_syncstate: FileMetadata):
-    diff = get_diff(client.server_client, local_syncstate.path, local_syncstate.signature_bytes)
+    try:
+        # the server may have the local version, then the diff is computed once for all subscribers
+        diff = get_delta(client.server_client, local_syncstate.path, local_syncstate.hash)
+    except SyftNotFound:
+        diff = get_diff(client.server_client, local_syncstate.path, local_syncstate.signature_bytes)
     abs_path = client.workspace.datasites / local_syncstate.path
     local_data = abs_path.read_bytes()
 
@@ -73,17 +86,25 @@ def delete_remote(client: SyftClientInterface, local_syncstate: FileMetadata):
     delete(client.server_client, local_syncstate.path)
 
 
+def _partial_download_path(client: SyftClientInterface, remote_syncstate: FileMetadata) -> Path:
+    # Partial downloads are stored outside the datasites folder, so they are never picked up by the sync
+    return Path(client.workspace.plugins) / "partial_downloads" / f"{remote_syncstate.hash}.part"
+
+
 def create_local(client: SyftClientInterface, remote_syncstate: FileMetadata):
     abs_path = client.workspace.datasites / remote_syncstate.path
-    content_bytes = download(client.server_client, remote_syncstate.path)
+    partial_path = _partial_download_path(client, remote_syncstate)
+    download_to_file(client.server_client, remote_syncstate.path, partial_path, etag=remote_syncstate.hash)
     abs_path.parent.mkdir(parents=True, exist_ok=True)
-    abs_path.write_bytes(content_bytes)
+    shutil.move(partial_path, abs_path)
 
 
 def create_local_batch(client: SyftClientInterface, remote_syncstates: list[Path]) -> list[str]:
     paths = [str(path) for path in remote_syncstates]
     try:
         content_bytes = download_bulk(client.server_client, paths)
+    except SyftRateLimited:
+        raise
     except SyftServerError as e:
         logger.error(e)
         return []
@@ -418,6 +439,25 @@ class LocalState(BaseModel):
                 self.save()
 
 
+def _upload_batches(
+    items: list[tuple[SyncQueueItem, SyncDecisionTuple]],
+) -> list[list[tuple[SyncQueueItem, SyncDecisionTuple]]]:
+    """Split new files into batches of at most MAX_BULK_UPLOAD_FILES files and MAX_BULK_UPLOAD_BYTES bytes."""
+    batches: list[list[tuple[SyncQueueItem, SyncDecisionTuple]]] = []
+    batch: list[tuple[SyncQueueItem, SyncDecisionTuple]] = []
+    batch_size = 0
+    for item, decisions in items:
+        file_size = decisions.remote_decision.local_syncstate.file_size
+        if batch and (len(batch) >= MAX_BULK_UPLOAD_FILES or batch_size + file_size > MAX_BULK_UPLOAD_BYTES):
+            batches.append(batch)
+            batch, batch_size = [], 0
+        batch.append((item, decisions))
+        batch_size += file_size
+    if batch:
+        batches.append(batch)
+    return batches
+
+
 class SyncConsumer:
     def __init__(self, client: SyftClientInterface, queue: SyncQueue):
         self.client = client
@@ -435,13 +475,89 @@ class SyncConsumer:
             raise SyncEnvironmentError("Your previous sync state has been deleted by a different process.")
 
     def consume_all(self):
+        # new local files are not created one by one, but uploaded in batches after all other changes
+        new_remote_files: list[tuple[SyncQueueItem, SyncDecisionTuple]] = []
         while not self.queue.empty():
             self.validate_sync_environment()
             item = self.queue.get(timeout=0.1)
             try:
-                self.process_filechange(item)
-            except FatalSyncError as e:
-                # Fatal error, syncing should be interrupted
+                decisions = self.get_decisions(item)
+                if self.can_create_remote_in_batch(item, decisions):
+                    new_remote_files.append((item, decisions))
+                    continue
+                if not decisions.is_noop():
+                    logger.info(decisions.info_message)
+                self.process_decision(item, decisions)
+            except (FatalSyncError, SyftRateLimited) as e:
+                # Fatal error or the server asks to back off, syncing should be interrupted
+                raise e
+            except Exception as e:
+                logger.error(f"Failed to sync file {item.data.path}, it will be retried in the next sync. Reason: {e}")
+
+        self.create_remote_all(new_remote_files)
+
+    def can_create_remote_in_batch(self, item: SyncQueueItem, decisions: SyncDecisionTuple) -> bool:
+        return (
+            decisions.local_decision.operation == SyncDecisionType.NOOP
+            and decisions.remote_decision.action_type == SyncActionType.CREATE_REMOTE
+            and decisions.remote_decision.is_valid(abs_path=item.data.local_abs_path)
+        )
+
+    def create_remote_all(self, items: list[tuple[SyncQueueItem, SyncDecisionTuple]]):
+        """
+        Create new local files on the server. Many files are uploaded in batches with /sync/upload_bulk,
+        a few files and batches that fail are created one by one.
+        """
+        if len(items) < MIN_BULK_UPLOAD_FILES:
+            self.process_decisions(items)
+            return
+
+        items_per_datasite: dict[str, list[tuple[SyncQueueItem, SyncDecisionTuple]]] = defaultdict(list)
+        for item, decisions in items:
+            items_per_datasite[item.data.path.parts[0]].append((item, decisions))
+
+        for datasite, datasite_items in items_per_datasite.items():
+            for batch in _upload_batches(datasite_items):
+                self.validate_sync_environment()
+                try:
+                    self.create_remote_batch(datasite, batch)
+                except (FatalSyncError, SyftRateLimited) as e:
+                    raise e
+                except Exception as e:
+                    logger.error(
+                        f"Failed to upload {len(batch)} files in batch, files will be uploaded individually instead. "
+                        f"Reason: {e}"
+                    )
+                    self.process_decisions(batch)
+
+    def create_remote_batch(self, datasite: str, batch: list[tuple[SyncQueueItem, SyncDecisionTuple]]):
+        files: list[tuple[Path, bytes]] = []
+        decisions_per_path: dict[Path, SyncDecisionTuple] = {}
+        for item, decisions in batch:
+            try:
+                files.append((item.data.path, item.data.local_abs_path.read_bytes()))
+            except OSError as e:
+                logger.error(f"Failed to sync file {item.data.path}, it will be retried in the next sync. Reason: {e}")
+                continue
+            decisions_per_path[item.data.path] = decisions
+
+        logger.info(f"Uploading {len(files)} new files of {datasite} in batch")
+        response = upload_bulk(self.client.server_client, datasite, files)
+        for path in response.created:
+            decisions = decisions_per_path[path]
+            decisions.local_decision.execute(self.client)
+            decisions.remote_decision.is_executed = True
+            self.previous_state.insert(path=path, state=decisions.result_local_state)
+        for path, reason in response.errors.items():
+            logger.error(f"Failed to sync file {path}, it will be retried in the next sync. Reason: {reason}")
+
+    def process_decisions(self, items: list[tuple[SyncQueueItem, SyncDecisionTuple]]) -> None:
+        for item, decisions in items:
+            self.validate_sync_environment()
+            try:
+                logger.info(decisions.info_message)
+                self.process_decision(item, decisions)
+            except (FatalSyncError, SyftRateLimited) as e:
                 raise e
             except Exception as e:
                 logger.error(f"Failed to sync file {item.data.path}, it will be retried in the next sync. Reason: {e}")
@@ -465,7 +581,7 @@ class SyncConsumer:
                     path=path,
                     state=state,
                 )
-        except FatalSyncError as e:
+        except (FatalSyncError, SyftRateLimited) as e:
             raise e
         except Exception as e:
             logger.error(
@@ -513,5 +629,8 @@ class SyncConsumer:
     def get_current_server_state(self, path: Path) -> Optional[FileMetadata]:
         try:
             return get_metadata(self.client.server_client, path)
+        except SyftRateLimited:
+            # a missing server state would be treated as a deleted file
+            raise
         except SyftServerError:
             return None
@@ -1,11 +1,31 @@
 import base64
+import hashlib
+import json
+import mimetypes
+import zipfile
+from io import BytesIO
 from pathlib import Path
-from typing import Any
+from typing import Any, Optional
+from urllib.parse import quote
 
 import httpx
+from pydantic import TypeAdapter
 
-from syftbox.client.exceptions import SyftAuthenticationError, SyftNotFound, SyftServerError
-from syftbox.server.sync.models import ApplyDiffResponse, DiffResponse, FileMetadata
+from syftbox.client.exceptions import SyftAuthenticationError, SyftNotFound, SyftRateLimited, SyftServerError
+from syftbox.lib import compression
+from syftbox.server.sync.columnar import decode_datasite_states
+from syftbox.server.sync.models import (
+    COLUMNAR_MEDIA_TYPE,
+    DATASITE_ETAGS_HEADER,
+    ApplyDiffResponse,
+    BulkUploadResponse,
+    DiffResponse,
+    DirDigestResponse,
+    FileMetadata,
+)
+
+MIN_COMPRESSED_REQUEST_SIZE = 1000
+DEFAULT_RETRY_AFTER = 1.0
 
 
 def handle_json_response(endpoint: str, response: httpx.Response) -> Any:
@@ -16,6 +36,56 @@ def handle_json_response(endpoint: str, response: httpx.Response) -> Any:
     raise SyftServerError(f"[{endpoint}] call failed: {response.text}")
 
 
+def raise_for_rate_limit(response: httpx.Response) -> None:
+    """
+    httpx response hook, raises SyftRateLimited for 429 responses so the sync loop can back off.
+    """
+    if response.status_code != 429:
+        return
+    try:
+        retry_after = float(response.headers.get("Retry-After", DEFAULT_RETRY_AFTER))
+    except ValueError:
+        retry_after = DEFAULT_RETRY_AFTER
+    raise SyftRateLimited(f"[{response.request.url.path}] rate limited by server", retry_after=retry_after)
+
+
+_metadata_list_adapter = TypeAdapter(list[FileMetadata])
+
+
+def decode_metadata_list(items: list[dict[str, Any]]) -> list[FileMetadata]:
+    """Decode a listing in a single validation call, instead of building a FileMetadata per entry."""
+    return _metadata_list_adapter.validate_python(items)
+
+
+def _update_request_encoding(client: httpx.Client, response: httpx.Response) -> None:
+    """Remember the request encoding supported by the server, advertised in the Accept-Encoding response header."""
+    accept_encoding = response.headers.get("Accept-Encoding")
+    if accept_encoding is not None:
+        client.request_encoding = compression.choose_encoding(accept_encoding)
+
+
+def _is_compressible_path(path: Path) -> bool:
+    return compression.is_compressible(mimetypes.guess_type(path.name)[0])
+
+
+def _post_compressed(client: httpx.Client, url: str, compressible: bool = True, **kwargs) -> httpx.Response:
+    """
+    POST a request with a compressed body, if the server accepts compressed requests.
+    Support is learned from previous responses, so requests are sent uncompressed until the server advertises it.
+    """
+    request = client.build_request("POST", url, **kwargs)
+    encoding = getattr(client, "request_encoding", None)
+    if encoding is not None and compressible:
+        body = request.read()
+        if len(body) >= MIN_COMPRESSED_REQUEST_SIZE:
+            headers = {"Content-Type": request.headers["Content-Type"], "Content-Encoding": encoding}
+            request = client.build_request("POST", url, content=compression.compress(body, encoding), headers=headers)
+
+    response = client.send(request)
+    _update_request_encoding(client, response)
+    return response
+
+
 def get_access_token(client: httpx.Client, email: str) -> str:
     """Only for development purposes, should not be used in production"""
     response = client.post("/auth/request_email_token", json={"email": email})
@@ -31,7 +101,44 @@ def get_datasite_states(client: httpx.Client, email: str) -> dict[str, list[File
 
     data = handle_json_response("/sync/datasite_states", response)
 
-    return {email: [FileMetadata(**item) for item in metadata_list] for email, metadata_list in data.items()}
+    return {email: decode_metadata_list(metadata_list) for email, metadata_list in data.items()}
+
+
+def get_datasite_states_if_changed(
+    client: httpx.Client, etags: dict[str, str], incremental: bool = False
+) -> tuple[dict[str, Optional[list[FileMetadata]]], dict[str, str]]:
+    """
+    Get the datasite states that changed since the given ETags were received.
+
+    Args:
+        client (httpx.Client): Client to use for the request.
+        etags (dict[str, str]): ETags per datasite from a previous call.
+        incremental (bool, optional): If True, changed datasites are returned with a `None` state and a new ETag,
+            so they can be updated with `get_dir_digest`. Defaults to False.
+
+    Returns:
+        tuple[dict[str, Optional[list[FileMetadata]]], dict[str, str]]: The datasite states, where unchanged
+            datasites have a `None` state, and the new ETags of all changed datasites.
+    """
+    headers = {"Accept": f"{COLUMNAR_MEDIA_TYPE}, application/json"}
+    if etags:
+        headers["If-None-Match"] = ", ".join(etags.values())
+    params = {"incremental": True} if incremental else {}
+    response = client.post("/sync/datasite_states", headers=headers, params=params)
+
+    if response.status_code == 304:
+        return {datasite: None for datasite in etags}, {}
+
+    if response.status_code == 200 and response.headers.get("Content-Type") == COLUMNAR_MEDIA_TYPE:
+        data = decode_datasite_states(response.content)
+    else:
+        data = handle_json_response("/sync/datasite_states", response)
+    new_etags = json.loads(response.headers.get(DATASITE_ETAGS_HEADER, "{}"))
+    states = {
+        datasite: None if metadata_list is None else decode_metadata_list(metadata_list)
+        for datasite, metadata_list in data.items()
+    }
+    return states, new_etags
 
 
 def get_remote_state(client: httpx.Client, path: Path) -> list[FileMetadata]:
@@ -43,7 +150,7 @@ def get_remote_state(client: httpx.Client, path: Path) -> list[FileMetadata]:
     )
 
     response_data = handle_json_response("/dir_state", response)
-    metadata_list = [FileMetadata(**item) for item in response_data]
+    metadata_list = decode_metadata_list(response_data)
     for item in metadata_list:
         if not hasattr(client, "metadata_cache"):
             client.metadata_cache = {}
@@ -51,6 +158,18 @@ def get_remote_state(client: httpx.Client, path: Path) -> list[FileMetadata]:
     return metadata_list
 
 
+def get_dir_digest(client: httpx.Client, path: Path) -> DirDigestResponse:
+    response = client.post(
+        "/sync/dir_digest",
+        json={
+            "path": path.as_posix(),
+        },
+    )
+
+    response_data = handle_json_response("/sync/dir_digest", response)
+    return DirDigestResponse(**response_data)
+
+
 def get_metadata(client: httpx.Client, path: Path) -> FileMetadata:
     if hasattr(client, "metadata_cache") and path in client.metadata_cache:
         return client.metadata_cache[path]
@@ -79,9 +198,27 @@ def get_diff(client: httpx.Client, path: Path, signature: bytes) -> DiffResponse
     return DiffResponse(**response_data)
 
 
-def apply_diff(client: httpx.Client, path: Path, diff: bytes, expected_hash: str) -> ApplyDiffResponse:
+def get_delta(client: httpx.Client, path: Path, from_hash: str) -> DiffResponse:
+    """Get the diff from the version of path with from_hash to the current version, if the server retained it."""
     response = client.post(
+        "/sync/get_delta",
+        json={
+            "path": str(path),
+            "from_hash": from_hash,
+        },
+    )
+
+    if response.status_code == 404:
+        raise SyftNotFound(f"[/sync/get_delta] version not found on server: {path}, {response.text}")
+    response_data = handle_json_response("/sync/get_delta", response)
+    return DiffResponse(**response_data)
+
+
+def apply_diff(client: httpx.Client, path: Path, diff: bytes, expected_hash: str) -> ApplyDiffResponse:
+    response = _post_compressed(
+        client,
         "/sync/apply_diff",
+        compressible=_is_compressible_path(path),
         json={
             "path": str(path),
             "diff": base64.b85encode(diff).decode("utf-8"),
@@ -105,11 +242,31 @@ def delete(client: httpx.Client, path: Path) -> None:
 
 
 def create(client: httpx.Client, path: Path, data: bytes) -> None:
-    response = client.post("/sync/create", files={"file": (str(path), data, "text/plain")})
+    response = _post_compressed(
+        client,
+        "/sync/create",
+        compressible=_is_compressible_path(path),
+        files={"file": (str(path), data, "text/plain")},
+    )
     response = handle_json_response("/sync/create", response)
     return
 
 
+def upload_bulk(client: httpx.Client, datasite: str, files: list[tuple[Path, bytes]]) -> BulkUploadResponse:
+    """Create many files of a datasite in a single request. The files are sent as a compressed zip archive."""
+    memory_file = BytesIO()
+    with zipfile.ZipFile(memory_file, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for path, data in files:
+            zf.writestr(path.as_posix(), data)
+    response = client.post(
+        "/sync/upload_bulk",
+        files={"file": (datasite, memory_file.getvalue(), "application/zip")},
+        timeout=120,
+    )
+    response_data = handle_json_response("/sync/upload_bulk", response)
+    return BulkUploadResponse(**response_data)
+
+
 def download(client: httpx.Client, path: Path) -> bytes:
     response = client.post(
         "/sync/download",
@@ -124,6 +281,69 @@ def download(client: httpx.Client, path: Path) -> bytes:
     return response.content
 
 
+def download_to_file(client: httpx.Client, path: Path, dest: Path, etag: Optional[str] = None) -> None:
+    """
+    Download a file to `dest`, resuming from the bytes already present in `dest`.
+
+    The partial download is only resumed if the file on the server still matches `etag`
+    (the content hash of the file), otherwise the server sends the full file and `dest` is overwritten.
+
+    Args:
+        client (httpx.Client): Client to use for the download.
+        path (Path): Path of the file on the server.
+        dest (Path): Local file to write the downloaded content to.
+        etag (Optional[str], optional): Expected content hash of the file. Defaults to None.
+
+    Raises:
+        SyftNotFound: If the file could not be downloaded.
+    """
+    headers = {}
+    offset = dest.stat().st_size if dest.is_file() else 0
+    if offset > 0 and etag is not None:
+        headers["Range"] = f"bytes={offset}-"
+        headers["If-Range"] = f'"{etag}"'
+
+    with client.stream("GET", f"/sync/download/{quote(path.as_posix())}", headers=headers) as response:
+        expected_hash = response.headers.get("ETag", "").strip('"') or etag
+        if response.status_code == 206:
+            mode = "ab"
+        elif response.status_code == 200:
+            mode = "wb"
+        elif response.status_code == 416 and _unsatisfied_range_size(response) == offset:
+            # the partial download is already complete
+            expected_hash, mode = etag, None
+        else:
+            response.read()
+            if response.status_code == 416:
+                # local partial file is invalid, restart the download on the next attempt
+                dest.unlink(missing_ok=True)
+            raise SyftNotFound(f"[/sync/download] not found on server: {path}, {response.text}")
+
+        if mode is not None:
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            with open(dest, mode) as f:
+                for chunk in response.iter_bytes():
+                    f.write(chunk)
+
+    if expected_hash is not None and _sha256_file(dest) != expected_hash:
+        dest.unlink(missing_ok=True)
+        raise SyftNotFound(f"[/sync/download] downloaded file does not match its hash: {path}")
+
+
+def _unsatisfied_range_size(response: httpx.Response) -> Optional[int]:
+    """The file size from the `Content-Range: bytes */<size>` header of a 416 response."""
+    _, _, size = response.headers.get("Content-Range", "").partition("*/")
+    return int(size) if size.isdigit() else None
+
+
+def _sha256_file(path: Path) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
 def download_bulk(client: httpx.Client, paths: list[str]) -> bytes:
     response = client.post(
         "/sync/download_bulk",
@@ -150,6 +370,7 @@ def whoami(client: httpx.Client) -> str:
     """
     try:
         response = client.post("/auth/whoami")
+        _update_request_encoding(client, response)
         if response.status_code == 200:
             email = response.json()["email"]
             return email
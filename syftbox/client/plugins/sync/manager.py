@@ -5,12 +5,13 @@ from typing import Optional
 from loguru import logger
 
 from syftbox.client.base import SyftClientInterface
-from syftbox.client.exceptions import SyftAuthenticationError
+from syftbox.client.exceptions import SyftAuthenticationError, SyftRateLimited
 from syftbox.client.plugins.sync.consumer import SyncConsumer
-from syftbox.client.plugins.sync.endpoints import get_datasite_states, whoami
+from syftbox.client.plugins.sync.endpoints import get_datasite_states_if_changed, whoami
 from syftbox.client.plugins.sync.exceptions import FatalSyncError
 from syftbox.client.plugins.sync.queue import SyncQueue, SyncQueueItem
-from syftbox.client.plugins.sync.sync import DatasiteState, FileChangeInfo
+from syftbox.client.plugins.sync.sync import DatasiteState, FileChangeInfo, patch_remote_state
+from syftbox.server.sync.merkle import DirIndex
 
 
 class SyncManager:
@@ -26,6 +27,12 @@ class SyncManager:
         self.last_health_check = 0
         self.health_check_interval = health_check_interval
 
+        # remote states of the previous sync, only changed datasites are requested from the server
+        self.remote_indexes: dict[str, DirIndex] = {}
+        self.remote_etags: dict[str, str] = {}
+        # local states of the previous sync, only changed local files are hashed into the directory digests
+        self.local_indexes: dict[str, DirIndex] = {}
+
     def is_alive(self) -> bool:
         return self.thread is not None and self.thread.is_alive()
 
@@ -42,6 +49,9 @@ class SyncManager:
                         manager.check_server_sync_status()
                     manager.run_single_thread()
                     time.sleep(manager.sync_interval)
+                except SyftRateLimited as e:
+                    logger.warning(f"{e}, pausing sync for {e.retry_after} seconds")
+                    time.sleep(max(e.retry_after, manager.sync_interval))
                 except FatalSyncError as e:
                     logger.error(f"Syncing encountered a fatal error. {e}")
                     break
@@ -57,21 +67,82 @@ class SyncManager:
 
     def get_datasite_states(self) -> list[DatasiteState]:
         try:
-            remote_datasite_states = get_datasite_states(self.client.server_client, email=self.client.email)
+            remote_datasite_states = self._get_remote_datasite_states()
+        except SyftRateLimited:
+            raise
         except Exception as e:
             logger.error(f"Failed to retrieve datasites from server, only syncing own datasite. Reason: {e}")
             remote_datasite_states = {}
 
         # Ensure we are always syncing own datasite
         if self.client.email not in remote_datasite_states:
-            remote_datasite_states[self.client.email] = []
+            remote_datasite_states[self.client.email] = DirIndex()
 
+        for datasite in set(self.local_indexes) - set(remote_datasite_states):
+            del self.local_indexes[datasite]
         datasite_states = [
-            DatasiteState(self.client, email, remote_state=remote_state)
-            for email, remote_state in remote_datasite_states.items()
+            DatasiteState(
+                self.client,
+                email,
+                remote_index=remote_index,
+                local_index=self.local_indexes.setdefault(email, DirIndex()),
+            )
+            for email, remote_index in remote_datasite_states.items()
         ]
         return datasite_states
 
+    def _get_remote_datasite_states(self) -> dict[str, DirIndex]:
+        server_client = self.client.server_client
+        incremental = len(self.remote_indexes) > 0
+        changed_states, new_etags = get_datasite_states_if_changed(
+            server_client, self.remote_etags, incremental=incremental
+        )
+
+        if incremental:
+            new_datasites = []
+            for datasite in new_etags:
+                if datasite in self.remote_indexes:
+                    # only the changed directories are requested, and only their files are hashed
+                    patch_remote_state(server_client, datasite, self.remote_indexes[datasite])
+                    self.remote_etags[datasite] = new_etags[datasite]
+                else:
+                    new_datasites.append(datasite)
+
+            if new_datasites:
+                # Datasites without a previous state are requested in full
+                known_etags = {
+                    datasite: etag
+                    for datasite, etag in {**self.remote_etags, **new_etags}.items()
+                    if datasite not in new_datasites
+                }
+                full_states, full_etags = get_datasite_states_if_changed(server_client, known_etags)
+                for datasite, state in full_states.items():
+                    if state is not None:
+                        changed_states[datasite] = state
+                        new_etags[datasite] = full_etags[datasite]
+
+        remote_datasite_states = {}
+        for datasite, state in changed_states.items():
+            if state is None:
+                # unchanged since the previous sync, or patched above
+                if datasite not in self.remote_indexes:
+                    continue
+                remote_index = self.remote_indexes[datasite]
+            elif datasite in new_etags:
+                remote_index = self.remote_indexes.setdefault(datasite, DirIndex())
+                remote_index.update(state)
+                self.remote_etags[datasite] = new_etags[datasite]
+            else:
+                remote_index = DirIndex(state)
+            remote_datasite_states[datasite] = remote_index
+
+        # drop datasites that are no longer on the server
+        for datasite in set(self.remote_indexes) - set(remote_datasite_states):
+            self.remote_indexes.pop(datasite, None)
+            self.remote_etags.pop(datasite, None)
+
+        return remote_datasite_states
+
     def _should_perform_health_check(self) -> bool:
         return time.time() - self.last_health_check > self.health_check_interval
 
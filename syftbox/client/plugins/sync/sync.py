@@ -3,14 +3,16 @@ from enum import Enum
 from pathlib import Path
 from typing import Optional
 
+import httpx
 from loguru import logger
 from pydantic import BaseModel
 
 from syftbox.client.base import SyftClientInterface
-from syftbox.client.plugins.sync.endpoints import get_remote_state
+from syftbox.client.plugins.sync.endpoints import get_dir_digest, get_remote_state
 from syftbox.lib.ignore import filter_ignored_paths
 from syftbox.lib.lib import SyftPermission
 from syftbox.server.sync.hash import hash_dir
+from syftbox.server.sync.merkle import DirIndex, get_out_of_sync_paths
 from syftbox.server.sync.models import FileMetadata
 
 
@@ -65,23 +67,34 @@ def format_paths(path_list: list[Path]) -> str:
 
 class DatasiteState:
     def __init__(
-        self, client: SyftClientInterface, email: str, remote_state: Optional[list[FileMetadata]] = None
+        self,
+        client: SyftClientInterface,
+        email: str,
+        remote_index: Optional[DirIndex] = None,
+        local_index: Optional[DirIndex] = None,
     ) -> None:
         """A class to represent the state of a datasite
 
         Args:
             ctx (SyftClientInterface): Context of the syft client
             email (str): Email of the datasite
-            remote_state (Optional[list[FileMetadata]], optional): Remote state of the datasite.
+            remote_index (Optional[DirIndex], optional): Remote files and directory digests of the datasite.
                 If not provided, it will be fetched from the server. Defaults to None.
+            local_index (Optional[DirIndex], optional): Local files and directory digests of the datasite from
+                a previous sync, it is updated with the current local state. Defaults to None.
         """
         self.client: SyftClientInterface = client
         self.email: str = email
-        self.remote_state: Optional[list[FileMetadata]] = remote_state
+        self.remote_index: Optional[DirIndex] = remote_index
+        self.local_index: DirIndex = local_index if local_index is not None else DirIndex()
 
     def __repr__(self) -> str:
         return f"DatasiteState<{self.email}>"
 
+    @property
+    def remote_state(self) -> Optional[list[FileMetadata]]:
+        return None if self.remote_index is None else list(self.remote_index.files.values())
+
     def tree_repr(self) -> str:
         remote_state = self.remote_state or []
         rel_paths = sorted([file.path for file in remote_state])
@@ -98,10 +111,13 @@ class DatasiteState:
     def get_current_local_state(self) -> list[FileMetadata]:
         return hash_dir(self.path, root_dir=self.client.workspace.datasites)
 
+    def get_remote_index(self) -> DirIndex:
+        if self.remote_index is None:
+            self.remote_index = DirIndex(get_remote_state(self.client.server_client, path=Path(self.email)))
+        return self.remote_index
+
     def get_remote_state(self) -> list[FileMetadata]:
-        if self.remote_state is None:
-            self.remote_state = get_remote_state(self.client.server_client, path=Path(self.email))
-        return self.remote_state
+        return list(self.get_remote_index().files.values())
 
     def is_in_sync(self) -> bool:
         permission_changes, file_changes = self.get_out_of_sync_files()
@@ -124,17 +140,18 @@ class DatasiteState:
             return [], []
 
         try:
-            remote_state = self.get_remote_state()
+            remote_index = self.get_remote_index()
         except Exception:
             logger.error(f"Failed to get remote state from server {self.email}")
             return [], []
 
-        local_state_dict = {file.path: file for file in local_state}
-        remote_state_dict = {file.path: file for file in remote_state}
-        all_files = set(local_state_dict.keys()) | set(remote_state_dict.keys())
+        # only the files that changed since the previous sync are hashed into the digests
+        self.local_index.update(local_state)
+        # files can only be out of sync in directories whose digests differ
+        out_of_sync_paths = [Path(path) for path in get_out_of_sync_paths(self.local_index, remote_index, self.email)]
         all_files_filtered = filter_ignored_paths(
             datasites_dir=self.client.workspace.datasites,
-            relative_paths=list(all_files),
+            relative_paths=out_of_sync_paths,
             ignore_hidden_files=True,
             ignore_symlinks=True,
         )
@@ -142,8 +159,8 @@ class DatasiteState:
         all_changes = []
 
         for afile in all_files_filtered:
-            local_info = local_state_dict.get(afile)
-            remote_info = remote_state_dict.get(afile)
+            local_info = self.local_index.files.get(afile.as_posix())
+            remote_info = remote_index.files.get(afile.as_posix())
 
             try:
                 change_info = compare_fileinfo(self.client.workspace.datasites, afile, local_info, remote_info)
@@ -167,6 +184,41 @@ class DatasiteState:
         return permission_changes, file_changes
 
 
+def patch_remote_state(
+    client: httpx.Client,
+    datasite: str,
+    remote_index: DirIndex,
+) -> DirIndex:
+    """
+    Update the remote index of a datasite from a previous sync, by only requesting the directories whose digest
+    has changed.
+
+    Args:
+        client (httpx.Client): Client to use for the requests.
+        datasite (str): Email of the datasite.
+        remote_index (DirIndex): Remote files and directory digests of the datasite, updated in place.
+
+    Returns:
+        DirIndex: The updated remote index.
+    """
+    dirs_to_visit = [datasite]
+    while dirs_to_visit:
+        dir = dirs_to_visit.pop()
+        remote_dir = get_dir_digest(client, Path(dir))
+        if remote_dir.digest == remote_index.digest(dir):
+            continue
+
+        remote_index.set_dir_files(dir, remote_dir.files)
+        # Remove subdirectories that no longer exist on the remote
+        for removed_dir in remote_index.subdirs.get(dir, set()) - remote_dir.dirs.keys():
+            remote_index.remove_dir(removed_dir)
+        for subdir, digest in remote_dir.dirs.items():
+            if digest != remote_index.digest(subdir):
+                dirs_to_visit.append(subdir)
+
+    return remote_index
+
+
 def split_permissions(
     changes: list[FileChangeInfo],
 ) -> tuple[list[FileChangeInfo], list[FileChangeInfo]]:
@@ -0,0 +1,149 @@
+"""
+HTTP content encodings shared by the server and the client.
+
+gzip is always available. zstd is used when the optional `zstandard` package is installed.
+"""
+
+import zlib
+from typing import Optional
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+GZIP = "gzip"
+ZSTD = "zstd"
+IDENTITY = "identity"
+
+GZIP_LEVEL = 5
+ZSTD_LEVEL = 3
+
+# default limit of decompressed request bodies, a small compressed body can expand to gigabytes
+MAX_DECOMPRESSED_SIZE = 128 * 1024 * 1024
+# zstd input is decompressed in slices, so output beyond the limit is detected after a few MB at most
+ZSTD_INPUT_SLICE = 256
+
+# in order of preference
+SUPPORTED_ENCODINGS = [ZSTD, GZIP] if zstandard is not None else [GZIP]
+
+# media types that are already compressed, or not worth compressing
+INCOMPRESSIBLE_MEDIA_TYPES = {
+    "application/zip",
+    "application/gzip",
+    "application/x-gzip",
+    "application/zstd",
+    "application/x-bzip2",
+    "application/x-xz",
+    "application/x-7z-compressed",
+    "application/x-rar-compressed",
+    "application/pdf",
+    "application/vnd.syftbox.columnar",
+}
+INCOMPRESSIBLE_MEDIA_TYPE_PREFIXES = ("image/", "audio/", "video/", "font/woff")
+
+
+def is_compressible(content_type: Optional[str]) -> bool:
+    if not content_type:
+        return True
+    media_type = content_type.split(";")[0].strip().lower()
+    if media_type == "image/svg+xml":
+        return True
+    return media_type not in INCOMPRESSIBLE_MEDIA_TYPES and not media_type.startswith(
+        INCOMPRESSIBLE_MEDIA_TYPE_PREFIXES
+    )
+
+
+def choose_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """
+    Choose the preferred supported encoding from an Accept-Encoding header, or None if there is no match.
+    Encodings with q=0 are not accepted.
+    """
+    if not accept_encoding:
+        return None
+
+    accepted = set()
+    for value in accept_encoding.lower().split(","):
+        encoding, _, params = value.partition(";")
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                if float(params[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(encoding.strip())
+
+    for encoding in SUPPORTED_ENCODINGS:
+        if encoding in accepted or "*" in accepted:
+            return encoding
+    return None
+
+
+class Compressor:
+    """Streaming compressor for a single response body."""
+
+    def __init__(self, encoding: str, gzip_level: int = GZIP_LEVEL, zstd_level: int = ZSTD_LEVEL) -> None:
+        if encoding == ZSTD and zstandard is not None:
+            self._compressor = zstandard.ZstdCompressor(level=zstd_level).compressobj()
+        elif encoding == GZIP:
+            self._compressor = zlib.compressobj(gzip_level, zlib.DEFLATED, 31)
+        else:
+            raise ValueError(f"Unsupported encoding: {encoding}")
+        self.encoding = encoding
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush()
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    compressor = Compressor(encoding)
+    return compressor.compress(data) + compressor.flush()
+
+
+class DecompressedSizeExceeded(ValueError):
+    pass
+
+
+class Decompressor:
+    """Streaming decompressor for a single request body, with an optional limit on the decompressed size."""
+
+    def __init__(self, encoding: str, max_size: Optional[int] = None) -> None:
+        if encoding == ZSTD and zstandard is not None:
+            self._decompressor = zstandard.ZstdDecompressor().decompressobj()
+        elif encoding == GZIP:
+            self._decompressor = zlib.decompressobj(31)
+        else:
+            raise ValueError(f"Unsupported encoding: {encoding}")
+        self.encoding = encoding
+        self.max_size = max_size
+        self.size = 0
+
+    def _check_size(self, output: bytes) -> bytes:
+        self.size += len(output)
+        if self.max_size is not None and self.size > self.max_size:
+            raise DecompressedSizeExceeded(f"decompressed body is larger than {self.max_size} bytes")
+        return output
+
+    def _remaining(self) -> int:
+        # one byte more than allowed, to detect that the limit is exceeded
+        return self.max_size - self.size + 1
+
+    def decompress(self, data: bytes) -> bytes:
+        if self.max_size is None:
+            return self._check_size(self._decompressor.decompress(data))
+        if self.encoding == GZIP:
+            # the rest of the input is not decompressed if the output is over the limit
+            return self._check_size(self._decompressor.decompress(data, self._remaining()))
+        output = []
+        for start in range(0, len(data), ZSTD_INPUT_SLICE):
+            output.append(self._check_size(self._decompressor.decompress(data[start : start + ZSTD_INPUT_SLICE])))
+        return b"".join(output)
+
+    def flush(self) -> bytes:
+        if self.encoding == GZIP and self.max_size is not None:
+            return self._check_size(self._decompressor.flush(self._remaining()))
+        return self._check_size(self._decompressor.flush())
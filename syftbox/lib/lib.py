@@ -248,6 +248,7 @@ class PermissionTree(Jsonable):
     root_perm: Optional[SyftPermission]
 
     corrupted_permission_files: list[str] = field(default_factory=list)
+    _tries: dict[Path, PermissionTrie] = field(default_factory=dict, init=False, repr=False, compare=False)
 
     @classmethod
     def from_path(cls, parent_path, raise_on_corrupted_files: bool = False) -> Self:
@@ -301,6 +302,10 @@ class PermissionTree(Jsonable):
         if parent_path not in path:
             return current_perm
 
+        # a terminal root permission applies to everything below it
+        if current_perm.terminal:
+            return current_perm
+
         sub_path = path.replace(parent_path, "")
         current_perm_level = parent_path
         for part in sub_path.split("/"):
@@ -318,23 +323,151 @@ class PermissionTree(Jsonable):
 
         return current_perm
 
+    def can_read_all(self, user_email: str, path: str) -> bool:
+        """
+        Returns True if user_email can read every file below the directory at path.
+        This is conservative, it returns False if any permission file below path does not grant read access.
+        """
+        current_perm = self.permission_for_path(path)
+        if not can_read(user_email, current_perm):
+            return False
+        if current_perm.terminal:
+            return True
+
+        prefix = path.rstrip("/") + "/"
+        for perm_path, perm in self.tree.items():
+            if perm_path.startswith(prefix) and not can_read(user_email, perm):
+                return False
+        return True
+
+    def get_trie(self, snapshot_folder: Path) -> PermissionTrie:
+        """Returns a PermissionTrie for this tree, with paths relative to snapshot_folder."""
+        if snapshot_folder not in self._tries:
+            self._tries[snapshot_folder] = PermissionTrie.from_tree(self, snapshot_folder)
+        return self._tries[snapshot_folder]
+
     def __repr__(self) -> str:
         return f"PermissionTree: {self.parent_path}\n" + build_tree_string(self.tree)
 
 
+class _PermissionNode:
+    """Effective permission of a directory, with the readers precomputed for fast lookups."""
+
+    __slots__ = ("children", "readers", "is_public", "is_final")
+
+    def __init__(self, perm: SyftPermission, is_final: bool) -> None:
+        self.children: dict[str, _PermissionNode] = {}
+        self.readers: frozenset[str] = frozenset(perm.read) | frozenset(perm.admin)
+        self.is_public: bool = USER_GROUP_GLOBAL in perm.read
+        self.is_final: bool = is_final
+
+    def can_read(self, user_email: str) -> bool:
+        return self.is_public or user_email in self.readers
+
+    def inherit(self) -> _PermissionNode:
+        node = _PermissionNode.__new__(_PermissionNode)
+        node.children = {}
+        node.readers = self.readers
+        node.is_public = self.is_public
+        node.is_final = self.is_final
+        return node
+
+
+class PermissionTrie:
+    """
+    Path trie over the permission files of a PermissionTree, with paths relative to the snapshot folder.
+
+    Each node holds the effective permission of its directory. A node is final if its permission is terminal,
+    in which case everything below it shares the same permission.
+    """
+
+    def __init__(self, root: _PermissionNode, root_dir: str) -> None:
+        self.root = root
+        self.root_dir = root_dir
+
+    @classmethod
+    def from_tree(cls, perm_tree: PermissionTree, snapshot_folder: Path) -> PermissionTrie:
+        parent_path = Path(os.path.normpath(perm_tree.parent_path))
+        root_perm = perm_tree.root_or_default
+        root = _PermissionNode(root_perm, is_final=root_perm.terminal)
+
+        dir_perms: dict[tuple[str, ...], SyftPermission] = {}
+        for perm_path, perm in perm_tree.tree.items():
+            perm_path = Path(perm_path)
+            if perm_path.name != PERM_FILE or not perm_path.parent.is_relative_to(parent_path):
+                continue
+            parts = perm_path.parent.relative_to(parent_path).parts
+            if parts:
+                dir_perms[parts] = perm
+
+        # Insert parents before children, so each node inherits from its final parent permission
+        for parts in sorted(dir_perms, key=len):
+            parent = root
+            for part in parts[:-1]:
+                if parent.is_final:
+                    break
+                if part not in parent.children:
+                    # intermediate directory without a permission file
+                    parent.children[part] = parent.inherit()
+                parent = parent.children[part]
+
+            if not parent.is_final:
+                perm = dir_perms[parts]
+                parent.children[parts[-1]] = _PermissionNode(perm, is_final=perm.terminal)
+
+        root_dir = parent_path.relative_to(snapshot_folder).as_posix() if parent_path != snapshot_folder else ""
+        return cls(root=root, root_dir=root_dir)
+
+    def _node_for_dir(self, dir: str) -> _PermissionNode:
+        if self.root_dir:
+            if dir == self.root_dir:
+                return self.root
+            if not dir.startswith(self.root_dir + "/"):
+                return self.root
+            dir = dir[len(self.root_dir) + 1 :]
+        elif not dir:
+            return self.root
+
+        node = self.root
+        for part in dir.split("/"):
+            if node.is_final:
+                break
+            child = node.children.get(part)
+            if child is None:
+                break
+            node = child
+        return node
+
+    def can_read(self, user_email: str, path: str) -> bool:
+        """Returns True if user_email can read the file at path, relative to the snapshot folder."""
+        return self._node_for_dir(path.rpartition("/")[0]).can_read(user_email)
+
+    def filter_readable(self, user_email: str, metadata_list: list[FileMetadata]) -> list[FileMetadata]:
+        """
+        Returns the files in metadata_list that user_email can read, in a single pass.
+        The permission of each directory is resolved once, so the cost is linear in the number of files.
+        """
+        readable_dirs: dict[str, bool] = {}
+        filtered_metadata = []
+        for metadata in metadata_list:
+            dir = metadata.path.as_posix().rpartition("/")[0]
+            is_readable = readable_dirs.get(dir)
+            if is_readable is None:
+                is_readable = self._node_for_dir(dir).can_read(user_email)
+                readable_dirs[dir] = is_readable
+            if is_readable:
+                filtered_metadata.append(metadata)
+        return filtered_metadata
+
+
+def can_read(user_email: str, perm: SyftPermission) -> bool:
+    return user_email in perm.read or USER_GROUP_GLOBAL in perm.read or user_email in perm.admin
+
+
 def filter_metadata(
     user_email: str,
     metadata_list: list[FileMetadata],
     perm_tree: PermissionTree,
     snapshot_folder: Path,
 ) -> list[FileMetadata]:
-    filtered_metadata = []
-    for metadata in metadata_list:
-        perm_file_at_path = perm_tree.permission_for_path((snapshot_folder / metadata.path).as_posix())
-        if (
-            user_email in perm_file_at_path.read
-            or "GLOBAL" in perm_file_at_path.read
-            or user_email in perm_file_at_path.admin
-        ):
-            filtered_metadata.append(metadata)
-    return filtered_metadata
+    return perm_tree.get_trie(snapshot_folder).filter_readable(user_email, metadata_list)
@@ -0,0 +1,13 @@
+from pydantic import BaseModel, Field
+
+
+class StatementStatsResponse(BaseModel):
+    sql: str = Field(description="Statement, with placeholder lists collapsed")
+    calls: int
+    time_total: float = Field(description="Seconds spent in SQLite, until the last row was fetched")
+    time_max: float
+    rows: int = Field(description="Rows returned, or changed by an INSERT, UPDATE or DELETE")
+    vm_steps: int = Field(description="Approximate number of SQLite VM steps, a measure of the rows scanned")
+    lock_wait_total: float = Field(description="Seconds spent waiting for the write lock, for BEGIN statements")
+    slow_calls: int
+    query_plan: list[str] = Field(default_factory=list, description="EXPLAIN QUERY PLAN of the statement")
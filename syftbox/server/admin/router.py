@@ -0,0 +1,56 @@
+import contextlib
+import sqlite3
+
+from fastapi import APIRouter, Depends, HTTPException, Request
+from loguru import logger
+
+from syftbox.server.admin.models import StatementStatsResponse
+from syftbox.server.settings import ServerSettings, get_server_settings
+from syftbox.server.sync.query_stats import QueryStats, explain_query_plan
+from syftbox.server.users.auth import get_current_user
+
+EXPLAINABLE_STATEMENTS = ("SELECT", "INSERT", "UPDATE", "DELETE", "REPLACE", "WITH")
+
+
+async def get_admin_user(
+    email: str = Depends(get_current_user),
+    server_settings: ServerSettings = Depends(get_server_settings),
+) -> str:
+    if email not in server_settings.admin_emails:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return email
+
+
+async def get_query_stats(request: Request) -> QueryStats:
+    return request.state.query_stats
+
+
+router = APIRouter(prefix="/admin", tags=["admin"], dependencies=[Depends(get_admin_user)])
+
+
+@router.get("/db/queries")
+def get_db_queries(
+    limit: int = 20,
+    explain: bool = True,
+    query_stats: QueryStats = Depends(get_query_stats),
+    server_settings: ServerSettings = Depends(get_server_settings),
+) -> list[StatementStatsResponse]:
+    """
+    Statistics of the statements on the file metadata database since the server started, by descending total time.
+    With `explain`, each statement comes with its query plan, computed with NULL parameters.
+    """
+    statements = query_stats.statements()[:limit]
+    response = [StatementStatsResponse.model_validate(stats, from_attributes=True) for stats in statements]
+    if not explain:
+        return response
+
+    with contextlib.closing(sqlite3.connect(server_settings.file_db_path)) as conn:
+        for stats, item in zip(statements, response):
+            if not stats.example.lstrip().upper().startswith(EXPLAINABLE_STATEMENTS):
+                continue
+            try:
+                item.query_plan = explain_query_plan(conn, stats.example)
+            except sqlite3.Error as e:
+                logger.debug(f"Failed to explain {stats.sql}: {e}")
+                item.query_plan = [f"error: {e}"]
+    return response
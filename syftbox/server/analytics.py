@@ -1,14 +1,36 @@
+"""
+Analytics events, written as JSON lines to analytics.log by the analytics logger.
+
+Request handlers submit events to an `AnalyticsQueue`, which only timestamps and queues them. A background thread
+serializes and writes the events in batches, so request threads don't pay for formatting and file I/O.
+High-volume event types, like the `/auth/whoami` health checks, can be sampled with `analytics_sample_rates`.
+Sampled events record their `sample_rate`, so counts can be scaled back up.
+
+The worker also writes the events to an `AnalyticsStore`, an indexed SQLite database with daily rollups.
+The log files stay the raw record, and can be read as a single time-ordered stream with `iter_analytics_logs`.
+"""
+
+import contextlib
+import heapq
+import io
+import itertools
 import json
+import queue
+import random
+import threading
 import zipfile
+from dataclasses import dataclass
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import Any, Optional
+from typing import Any, Iterator, Optional
 
+from fastapi import Request
 from loguru import logger
 from pydantic import BaseModel
 
+from syftbox.server.analytics_store import AnalyticsStore
 from syftbox.server.logger import analytics_logger
-from syftbox.server.sync.file_store import FileStore
+from syftbox.server.sync.models import FileMetadata
 
 
 def to_jsonable_dict(obj: dict) -> dict:
@@ -40,74 +62,226 @@ def log_analytics_event(
     **kwargs: Any,
 ) -> None:
     """
-    Log an event to the analytics logger.
+    Log an event to the analytics logger. Request handlers should use `AnalyticsQueue.submit` instead.
     """
-    email = email or "anonymous"
-
     try:
-        extra = {
-            "email": email,
-            "endpoint": endpoint,
-            "timestamp": datetime.now(timezone.utc),
-            **kwargs,
-        }
-        extra = to_jsonable_dict(extra)
-        analytics_logger.bind(**extra).info(message)
+        analytics_logger.bind(**_event_record(endpoint, email, **kwargs)).info(message)
     except Exception as e:
         logger.error(f"Failed to log event: {e}")
 
 
-def log_file_change_event(
-    endpoint: str,
-    email: Optional[str],
-    relative_path: Path,
-    file_store: FileStore,
-) -> None:
+def _event_record(endpoint: str, email: Optional[str], **kwargs: Any) -> dict[str, Any]:
+    """The JSON-serializable record of an event, as written to the analytics log and store."""
+    extra = {
+        "email": email or "anonymous",
+        "endpoint": endpoint,
+        "timestamp": datetime.now(timezone.utc),
+        **kwargs,
+    }
+    return to_jsonable_dict(extra)
+
+
+# fields set by the server, submitted fields with these names are renamed with the RESERVED_PREFIX
+RESERVED_FIELDS = frozenset({"email", "endpoint", "timestamp", "sample_rate", "event_type", "serialized"})
+RESERVED_PREFIX = "event_"
+
+
+def _namespace_reserved(fields: dict[str, Any]) -> dict[str, Any]:
+    return {RESERVED_PREFIX + key if key in RESERVED_FIELDS else key: value for key, value in fields.items()}
+
+
+@dataclass
+class AnalyticsEvent:
+    endpoint: str
+    email: Optional[str]
+    timestamp: datetime
+    message: str
+    extra: dict[str, Any]
+
+
+@dataclass
+class AnalyticsStats:
+    submitted: int = 0
+    sampled_out: int = 0
+    dropped: int = 0
+    written: int = 0
+
+
+class AnalyticsQueue:
     """
-    Log a file change event to the analytics logger.
+    Bounded queue of analytics events, written by a background thread in batches of up to `batch_size` events.
+    Events are dropped when the queue is full, so a slow disk never blocks requests.
     """
-    try:
-        metadata = file_store.get_metadata(relative_path)
-        log_analytics_event(
+
+    def __init__(
+        self,
+        max_size: int = 10_000,
+        batch_size: int = 500,
+        sample_rates: Optional[dict[str, float]] = None,
+        store: Optional[AnalyticsStore] = None,
+    ) -> None:
+        self.batch_size = batch_size
+        self.store = store
+        self.sample_rates = sample_rates or {}
+        self.stats = AnalyticsStats()
+        self._stats_lock = threading.Lock()
+        self._queue: queue.Queue[Optional[AnalyticsEvent]] = queue.Queue(maxsize=max_size)
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="syftbox-analytics", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Write the queued events and stop the worker."""
+        if self._thread is None:
+            return
+        # the stop marker may wait for space in the queue, it is never dropped
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+
+    def submit(self, endpoint: str, email: Optional[str], message: str = "", /, **kwargs: Any) -> bool:
+        """
+        Queue an event. Returns False if the event was sampled out or dropped.
+        Fields in kwargs that clash with the fields set by the server are prefixed with RESERVED_PREFIX.
+        """
+        kwargs = _namespace_reserved(kwargs)
+        sample_rate = self.sample_rates.get(endpoint, 1.0)
+        if sample_rate < 1.0:
+            if random.random() >= sample_rate:
+                with self._stats_lock:
+                    self.stats.sampled_out += 1
+                return False
+            kwargs["sample_rate"] = sample_rate
+
+        event = AnalyticsEvent(
             endpoint=endpoint,
             email=email,
-            file_metadata=metadata,
+            timestamp=datetime.now(timezone.utc),
+            message=message,
+            extra=kwargs,
         )
-    except Exception as e:
-        logger.error(f"Failed to log file change event: {e}")
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            with self._stats_lock:
+                self.stats.dropped += 1
+            return False
+        with self._stats_lock:
+            self.stats.submitted += 1
+        return True
 
+    def log_file_change(self, endpoint: str, email: Optional[str], metadata: FileMetadata) -> bool:
+        """Queue a file change event, with the metadata of the written file."""
+        return self.submit(endpoint, email, file_metadata=metadata)
 
-def _parse_analytics_file(file_path: Path) -> list[dict]:
-    if file_path.suffix == ".zip":
-        with zipfile.ZipFile(file_path, "r") as zfile:
-            with zfile.open(zfile.namelist()[0]) as f:
-                content = f.read().decode("utf-8")
-    else:
-        with open(file_path, "r") as f:
-            content = f.read()
+    def _run(self) -> None:
+        stopped = False
+        while not stopped:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if None in batch:
+                stopped = True
+                batch = [event for event in batch if event is not None]
+            # the worker must keep draining the queue, or it fills up and stop() blocks
+            try:
+                self._write(batch)
+            except Exception as e:
+                logger.error(f"Failed to write {len(batch)} analytics events: {e}")
 
-    events = []
-    for line in content.split("\n"):
-        if not line:
-            continue
+    def _write(self, batch: list[AnalyticsEvent]) -> None:
+        records = []
+        for event in batch:
+            try:
+                record = _event_record(event.endpoint, event.email, timestamp=event.timestamp, **event.extra)
+                analytics_logger.bind(**record).info(event.message)
+                records.append(record)
+            except Exception as e:
+                logger.error(f"Failed to log event: {e}")
 
-        try:
-            event = json.loads(line)
-            event["timestamp"] = datetime.fromisoformat(event["timestamp"])
-            events.append(event)
-        except Exception as e:
-            logger.error(f"Failed to parse event: {e}")
+        if self.store is not None:
+            try:
+                self.store.add_events(records)
+            except Exception as e:
+                logger.error(f"Failed to store {len(records)} analytics events: {e}")
 
-    return events
+        with self._stats_lock:
+            self.stats.written += len(batch)
 
 
-def parse_analytics_logs(logs_dir: Path) -> list[dict]:
-    # Load current log and all archived logs
-    log_files = list(logs_dir.glob("analytics.log")) + list(logs_dir.glob("analytics*.zip"))
+async def get_analytics_queue(request: Request) -> AnalyticsQueue:
+    return request.state.analytics_queue
+
+
+@contextlib.contextmanager
+def _open_segment(file_path: Path) -> Iterator[io.TextIOBase]:
+    if file_path.suffix != ".zip":
+        with open(file_path, "r", encoding="utf-8") as f:
+            yield f
+        return
+    with zipfile.ZipFile(file_path, "r") as zfile:
+        with zfile.open(zfile.namelist()[0]) as f:
+            yield io.TextIOWrapper(f, encoding="utf-8")
+
+
+def iter_analytics_file(file_path: Path) -> Iterator[dict]:
+    """Iterate over the events of a single log segment, one line at a time."""
+    with _open_segment(file_path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                event = json.loads(line)
+                event["timestamp"] = datetime.fromisoformat(event["timestamp"])
+            except Exception as e:
+                logger.error(f"Failed to parse event: {e}")
+                continue
+            yield event
+
+
+def _analytics_log_files(logs_dir: Path) -> list[Path]:
+    # current log and all rotated logs
+    return list(logs_dir.glob("analytics.log")) + sorted(logs_dir.glob("analytics*.zip"))
+
+
+def iter_analytics_logs(logs_dir: Path) -> Iterator[dict]:
+    """
+    Iterate over the events of all analytics logs in time order.
+    Each segment is written in time order, so the segments are merged lazily instead of loaded and sorted.
+    """
+    log_files = _analytics_log_files(logs_dir)
     logger.info(f"Loading logs from: {[f.as_posix() for f in log_files]}")
-    events = []
-    for log_file in log_files:
-        events.extend(_parse_analytics_file(log_file))
+    segments = [iter_analytics_file(log_file) for log_file in log_files]
+    return heapq.merge(*segments, key=lambda event: event["timestamp"])
+
+
+def parse_analytics_logs(logs_dir: Path) -> list[dict]:
+    return list(iter_analytics_logs(logs_dir))
 
-    events = sorted(events, key=lambda x: x["timestamp"])
-    return events
+
+def import_rotated_logs(logs_dir: Path, store: AnalyticsStore, chunk_size: int = 10_000) -> int:
+    """
+    Import the events of rotated log segments that were logged before the store existed.
+    Segments are imported once. Returns the number of imported events.
+    """
+    live_since = store.live_since
+    imported = 0
+    for segment in sorted(logs_dir.glob("analytics*.zip")):
+        if store.is_imported(segment.name):
+            continue
+        events = (
+            {**event, "timestamp": event["timestamp"].isoformat()}
+            for event in iter_analytics_file(segment)
+            if event["timestamp"].timestamp() < live_since
+        )
+        while chunk := list(itertools.islice(events, chunk_size)):
+            imported += store.add_events(chunk)
+        store.mark_imported(segment.name)
+    if imported:
+        logger.info(f"> Imported {imported} analytics events into {store.path}")
+    return imported
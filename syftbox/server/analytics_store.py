@@ -0,0 +1,191 @@
+"""
+SQLite store of analytics events, indexed for time-range, per-user and per-endpoint queries.
+
+Events are written by the `AnalyticsQueue` worker as they arrive, together with incremental daily rollups:
+- daily_active_users: the users that sent at least one event on a day
+- daily_usage: the number of events and the bytes of written files per endpoint per day
+
+Events from analytics logs of older server versions can be imported with `analytics.import_rotated_logs`.
+Rollups count stored events, events that were sampled out are not counted.
+"""
+
+import contextlib
+import json
+import sqlite3
+import time
+from datetime import date, datetime, timezone
+from pathlib import Path
+from typing import Any, Iterable, Iterator, Optional
+
+# endpoints of events with the metadata of a written file
+WRITE_ENDPOINTS = ("/sync/create", "/sync/apply_diff", "/sync/upload_bulk")
+
+
+def _to_unix(timestamp: Any) -> float:
+    if isinstance(timestamp, str):
+        timestamp = datetime.fromisoformat(timestamp)
+    if isinstance(timestamp, datetime):
+        if timestamp.tzinfo is None:
+            timestamp = timestamp.replace(tzinfo=timezone.utc)
+        return timestamp.timestamp()
+    return float(timestamp)
+
+
+def _day(unix_time: float) -> str:
+    return datetime.fromtimestamp(unix_time, tz=timezone.utc).date().isoformat()
+
+
+def _bytes_written(event: dict[str, Any]) -> int:
+    if event.get("endpoint") not in WRITE_ENDPOINTS:
+        return 0
+    metadata = event.get("file_metadata")
+    return metadata.get("file_size", 0) if isinstance(metadata, dict) else 0
+
+
+class AnalyticsStore:
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        with contextlib.closing(self._connect()) as conn, conn:
+            conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS events (
+                    id INTEGER PRIMARY KEY,
+                    timestamp REAL NOT NULL,
+                    endpoint TEXT NOT NULL,
+                    email TEXT NOT NULL,
+                    data TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_events_timestamp ON events (timestamp);
+                CREATE INDEX IF NOT EXISTS idx_events_email ON events (email, timestamp);
+                CREATE INDEX IF NOT EXISTS idx_events_endpoint ON events (endpoint, timestamp);
+
+                CREATE TABLE IF NOT EXISTS daily_active_users (
+                    day TEXT NOT NULL,
+                    email TEXT NOT NULL,
+                    PRIMARY KEY (day, email)
+                ) WITHOUT ROWID;
+
+                CREATE TABLE IF NOT EXISTS daily_usage (
+                    day TEXT NOT NULL,
+                    endpoint TEXT NOT NULL,
+                    events INTEGER NOT NULL,
+                    bytes INTEGER NOT NULL,
+                    PRIMARY KEY (day, endpoint)
+                ) WITHOUT ROWID;
+
+                CREATE TABLE IF NOT EXISTS imported_segments (
+                    name TEXT PRIMARY KEY
+                );
+
+                CREATE TABLE IF NOT EXISTS store_meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL
+                );
+                """
+            )
+            # events logged before this time are only in the log files, and can be imported
+            conn.execute("INSERT OR IGNORE INTO store_meta (key, value) VALUES ('live_since', ?)", (str(time.time()),))
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path)
+        conn.execute("PRAGMA journal_mode=WAL;")
+        conn.execute("PRAGMA busy_timeout=5000;")
+        return conn
+
+    @property
+    def live_since(self) -> float:
+        with contextlib.closing(self._connect()) as conn:
+            return float(conn.execute("SELECT value FROM store_meta WHERE key = 'live_since'").fetchone()[0])
+
+    def add_events(self, events: Iterable[dict[str, Any]]) -> int:
+        """
+        Store JSON-serializable events, and update the rollups in the same transaction.
+        Events need an endpoint and a timestamp. Returns the number of stored events.
+        """
+        rows = []
+        for event in events:
+            unix_time = _to_unix(event["timestamp"])
+            rows.append((unix_time, event["endpoint"], event.get("email") or "anonymous", event))
+        if not rows:
+            return 0
+
+        with contextlib.closing(self._connect()) as conn, conn:
+            conn.executemany(
+                "INSERT INTO events (timestamp, endpoint, email, data) VALUES (?, ?, ?, ?)",
+                [(unix_time, endpoint, email, json.dumps(event)) for unix_time, endpoint, email, event in rows],
+            )
+            conn.executemany(
+                "INSERT OR IGNORE INTO daily_active_users (day, email) VALUES (?, ?)",
+                [(_day(unix_time), email) for unix_time, _, email, _ in rows],
+            )
+            conn.executemany(
+                """
+                INSERT INTO daily_usage (day, endpoint, events, bytes) VALUES (?, ?, 1, ?)
+                ON CONFLICT (day, endpoint) DO UPDATE SET events = events + 1, bytes = bytes + excluded.bytes
+                """,
+                [(_day(unix_time), endpoint, _bytes_written(event)) for unix_time, endpoint, _, event in rows],
+            )
+        return len(rows)
+
+    def is_imported(self, segment_name: str) -> bool:
+        with contextlib.closing(self._connect()) as conn:
+            return (
+                conn.execute("SELECT 1 FROM imported_segments WHERE name = ?", (segment_name,)).fetchone() is not None
+            )
+
+    def mark_imported(self, segment_name: str) -> None:
+        with contextlib.closing(self._connect()) as conn, conn:
+            conn.execute("INSERT OR IGNORE INTO imported_segments (name) VALUES (?)", (segment_name,))
+
+    def events(
+        self,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        email: Optional[str] = None,
+        endpoint: Optional[str] = None,
+    ) -> Iterator[dict[str, Any]]:
+        """
+        Iterate over the events in [start, end), optionally of a single user or endpoint, ordered by time.
+        Events are read lazily, timestamps are returned as datetimes.
+        """
+        query = "SELECT data FROM events WHERE timestamp >= ? AND timestamp < ?"
+        params: list[Any] = [
+            _to_unix(start) if start is not None else float("-inf"),
+            _to_unix(end) if end is not None else float("inf"),
+        ]
+        if email is not None:
+            query += " AND email = ?"
+            params.append(email)
+        if endpoint is not None:
+            query += " AND endpoint = ?"
+            params.append(endpoint)
+        query += " ORDER BY timestamp"
+
+        with contextlib.closing(self._connect()) as conn:
+            for (data,) in conn.execute(query, params):
+                event = json.loads(data)
+                event["timestamp"] = datetime.fromisoformat(event["timestamp"])
+                yield event
+
+    def daily_active_users(self, start: Optional[date] = None, end: Optional[date] = None) -> dict[str, int]:
+        """Number of active users per day in [start, end)."""
+        with contextlib.closing(self._connect()) as conn:
+            cursor = conn.execute(
+                "SELECT day, COUNT(*) FROM daily_active_users WHERE day >= ? AND day < ? GROUP BY day ORDER BY day",
+                (start.isoformat() if start else "", end.isoformat() if end else "~"),
+            )
+            return dict(cursor.fetchall())
+
+    def daily_usage(
+        self, start: Optional[date] = None, end: Optional[date] = None
+    ) -> dict[str, dict[str, tuple[int, int]]]:
+        """(events, bytes written) per endpoint per day in [start, end)."""
+        usage: dict[str, dict[str, tuple[int, int]]] = {}
+        with contextlib.closing(self._connect()) as conn:
+            cursor = conn.execute(
+                "SELECT day, endpoint, events, bytes FROM daily_usage WHERE day >= ? AND day < ? ORDER BY day",
+                (start.isoformat() if start else "", end.isoformat() if end else "~"),
+            )
+            for day, endpoint, events, n_bytes in cursor:
+                usage.setdefault(day, {})[endpoint] = (events, n_bytes)
+        return usage
@@ -0,0 +1,150 @@
+"""
+Public datasite browser, served at /datasites.
+
+The browser is crawled heavily, so it avoids repeating work between requests:
+- templates are compiled once, when the server is imported
+- rendered directory listings are cached by `ListingCache`, keyed by the datasite version. Every write through the
+  FileStore bumps the version of its datasite in the database, so cached listings are never served after a write,
+  also when the write was made by another worker
+- listings and files are served with an ETag, and conditional requests are answered with a 304 Not Modified
+- files are sent with FileResponse, without reading them into Python strings
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+from typing import Any, Optional, Union
+
+from fastapi import Request, Response
+from fastapi.responses import FileResponse
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+from starlette.datastructures import Headers
+
+from syftbox.server.sync import db
+
+TEMPLATES = Environment(
+    loader=FileSystemLoader(Path(__file__).parent / "templates"),
+    autoescape=select_autoescape(["html"]),
+)
+DATASITES_TEMPLATE = TEMPLATES.get_template("datasites.html")
+FOLDER_TEMPLATE = TEMPLATES.get_template("folder.html")
+
+# listings may change with every write, clients revalidate them with their ETag
+LISTING_CACHE_CONTROL = "no-cache"
+
+
+def get_file_list(directory: Union[str, Path] = ".") -> list[dict[str, Any]]:
+    file_list = []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            is_dir = entry.is_dir()
+            stat = entry.stat()
+            file_list.append(
+                {
+                    "name": entry.name,
+                    "is_dir": is_dir,
+                    "size": stat.st_size if not is_dir else "-",
+                    "mod_time": datetime.fromtimestamp(stat.st_mtime).strftime("%Y-%m-%d %H:%M:%S"),
+                }
+            )
+
+    return sorted(file_list, key=lambda x: (not x["is_dir"], x["name"].lower()))
+
+
+def listing_version(conn: sqlite3.Connection, snapshot_folder: Path, datasite: Optional[str] = None) -> str:
+    """
+    Version of the listings of a datasite, or of the list of datasites if datasite is None.
+    The server epoch changes when the database is recreated, and restarts all versions.
+    """
+    epoch = db.get_server_epoch(conn)
+    if datasite is not None:
+        return f"{epoch}:{db.get_datasite_version(conn, datasite)}"
+    # new datasite folders are created on registration, before they have files
+    versions = sorted(db.get_datasite_versions(conn).items())
+    versions_hash = hashlib.sha256(repr(versions).encode()).hexdigest()[:16]
+    return f"{epoch}:{snapshot_folder.stat().st_mtime_ns}:{versions_hash}"
+
+
+def listing_etag(path: str, version: str) -> str:
+    return '"' + hashlib.sha256(f"{path}:{version}".encode()).hexdigest()[:32] + '"'
+
+
+def is_not_modified(request_headers: Headers, etag: str, last_modified: Optional[str] = None) -> bool:
+    """If the client has the current version of a response, according to its conditional request headers."""
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match is not None:
+        # weak comparison, the W/ prefix is ignored
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags
+
+    if_modified_since = request_headers.get("if-modified-since")
+    if if_modified_since is not None and last_modified is not None:
+        try:
+            return parsedate_to_datetime(last_modified) <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def not_modified_response(headers: dict[str, str]) -> Response:
+    return Response(status_code=304, headers=headers)
+
+
+def file_response(request: Request, path: Union[str, Path], media_type: Optional[str] = None) -> Response:
+    """A file with ETag and Last-Modified headers, or a 304 if the client has the current version."""
+    response = FileResponse(path, media_type=media_type, stat_result=os.stat(path))
+    etag = response.headers["etag"]
+    last_modified = response.headers["last-modified"]
+    if is_not_modified(request.headers, etag, last_modified):
+        return not_modified_response({"ETag": etag, "Last-Modified": last_modified})
+    return response
+
+
+@dataclass
+class ListingCacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+
+class ListingCache:
+    """LRU cache of rendered listings, keyed by request path and `listing_version`."""
+
+    def __init__(self, max_entries: int) -> None:
+        self.max_entries = max_entries
+        self.stats = ListingCacheStats()
+        self._listings: OrderedDict[tuple[str, str], bytes] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._listings)
+
+    def get(self, path: str, version: str) -> Optional[bytes]:
+        with self._lock:
+            html = self._listings.get((path, version))
+            if html is None:
+                self.stats.misses += 1
+                return None
+            self._listings.move_to_end((path, version))
+            self.stats.hits += 1
+            return html
+
+    def put(self, path: str, version: str, html: bytes) -> None:
+        if self.max_entries == 0:
+            return
+        with self._lock:
+            self._listings[(path, version)] = html
+            self._listings.move_to_end((path, version))
+            while len(self._listings) > self.max_entries:
+                self._listings.popitem(last=False)
+                self.stats.evictions += 1
+
+
+async def get_listing_cache(request: Request) -> ListingCache:
+    return request.state.listing_cache
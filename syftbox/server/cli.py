@@ -48,6 +48,16 @@ SSL_KEY_OPTS = Option(
     rich_help_panel=SSL_PANEL,
     help="Path to SSL key file",
 )
+SHARD_OPTS = Option(
+    "-s", "--shard",
+    rich_help_panel=SERVER_PANEL,
+    help="Base URL of a shard server, repeat for each shard",
+)
+MIRROR_OPTS = Option(
+    "--mirror",
+    rich_help_panel=SERVER_PANEL,
+    help="Run as a read-only mirror of the server at this URL",
+)
 SSL_CERT_OPTS = Option(
     "--cert", "--ssl-certfile",
     exists=True, file_okay=True, readable=True,
@@ -63,6 +73,7 @@ def server(
     port: Annotated[int, PORT_OPTS] = 5001,
     workers: Annotated[int, WORKERS_OPTS] = 1,
     verbose: Annotated[bool, VERBOSE_OPTS] = False,
+    mirror: Annotated[Optional[str], MIRROR_OPTS] = None,
     ssl_key: Annotated[Optional[Path], SSL_KEY_OPTS] = None,
     ssl_cert: Annotated[Optional[Path], SSL_CERT_OPTS] = None,
 ):
@@ -72,9 +83,24 @@ def server(
         return
 
     # lazy import to improve CLI startup performance
+    import os
+    import uuid
+
     import uvicorn
 
-    from syftbox.server.server import app as fastapi_app
+    from syftbox.server.startup import RUN_ID_ENV
+
+    # inherited by all workers, so startup tasks run once per run (see syftbox.server.startup)
+    os.environ[RUN_ID_ENV] = uuid.uuid4().hex
+    if mirror is not None:
+        # read by the ServerSettings of all workers, see syftbox.server.mirror
+        os.environ["SYFTBOX_MIRROR_UPSTREAM"] = mirror
+
+    if workers > 1:
+        # uvicorn needs an import string to start multiple workers
+        fastapi_app = "syftbox.server.server:app"
+    else:
+        from syftbox.server.server import app as fastapi_app
 
     uvicorn.run(
         app=fastapi_app,
@@ -87,6 +113,30 @@ def server(
     )
 
 
+@app.command()
+def shard_router(
+    shards: Annotated[list[str], SHARD_OPTS],
+    port: Annotated[int, PORT_OPTS] = 5001,
+    verbose: Annotated[bool, VERBOSE_OPTS] = False,
+    ssl_key: Annotated[Optional[Path], SSL_KEY_OPTS] = None,
+    ssl_cert: Annotated[Optional[Path], SSL_CERT_OPTS] = None,
+):
+    """Run a front-end that shards datasites over several SyftBox servers"""
+
+    import uvicorn
+
+    from syftbox.server.shard_router import create_shard_router_app
+
+    uvicorn.run(
+        app=create_shard_router_app(shards),
+        host="0.0.0.0",
+        port=port,
+        log_level="debug" if verbose else "info",
+        ssl_keyfile=ssl_key,
+        ssl_certfile=ssl_cert,
+    )
+
+
 def main():
     app()
 
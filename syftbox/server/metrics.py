@@ -0,0 +1,262 @@
+"""
+Server metrics, exposed at `/metrics` in the Prometheus text format.
+
+`middleware.MetricsMiddleware` records the latency of every request per route and status, the requests in flight,
+and the bytes received and sent. The sync routes record the time of their database and file store calls. The stats of
+server components (CPU executor, caches, rate limiter, analytics queue, ...) are read when the metrics are scraped.
+
+prometheus_client is not a dependency of the server, this module implements the subset of it that is needed:
+counters, gauges and histograms with labels, in a registry per server.
+"""
+
+import bisect
+import dataclasses
+import math
+import threading
+from typing import Any, Callable, Iterable, Optional
+
+from fastapi import Request
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# seconds
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+LabelValues = tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str]) -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: LabelValues = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+
+    def _check_labels(self, labels: LabelValues) -> None:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {labels}")
+
+    def _header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+
+    def render(self) -> list[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: LabelValues = ()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, labels: LabelValues = ()) -> None:
+        self._check_labels(labels)
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def get(self, labels: LabelValues = ()) -> float:
+        return self._values.get(labels, 0.0)
+
+    def render(self) -> list[str]:
+        with self._lock:
+            values = list(self._values.items())
+        lines = self._header()
+        for labels, value in values:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def dec(self, amount: float = 1.0, labels: LabelValues = ()) -> None:
+        self.inc(-amount, labels)
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: LabelValues = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # per label values: counts per bucket (not cumulative, the last one is +Inf), sum
+        self._values: dict[LabelValues, tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, labels: LabelValues = ()) -> None:
+        self._check_labels(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.setdefault(labels, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[index] += 1
+            total[0] += value
+
+    def count(self, labels: LabelValues = ()) -> int:
+        counts, _ = self._values.get(labels, ([0], [0.0]))
+        return sum(counts)
+
+    def render(self) -> list[str]:
+        with self._lock:
+            values = [(labels, list(counts), total[0]) for labels, (counts, total) in self._values.items()]
+        lines = self._header()
+        bucket_labelnames = self.labelnames + ("le",)
+        for labels, counts, total in values:
+            cumulative = 0
+            for upper_bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                bucket_labels = _format_labels(bucket_labelnames, labels + (_format_value(upper_bound),))
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            formatted_labels = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{formatted_labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{formatted_labels} {cumulative}")
+        return lines
+
+
+@dataclasses.dataclass
+class _StatsCollector:
+    component: str
+    stats: Callable[[], Any]
+    gauges: dict[str, Callable[[], float]]
+
+    def render(self) -> list[str]:
+        stats = self.stats()
+        fields = dataclasses.asdict(stats) if dataclasses.is_dataclass(stats) else dict(stats)
+        lines = []
+        for field, value in fields.items():
+            if field.endswith("_max"):
+                lines += self._render_one(field, "gauge", value)
+            else:
+                name = field if field.endswith("_total") else f"{field}_total"
+                lines += self._render_one(name, "counter", value)
+        for field, get_value in self.gauges.items():
+            lines += self._render_one(field, "gauge", get_value())
+        return lines
+
+    def _render_one(self, field: str, metric_type: str, value: float) -> list[str]:
+        name = f"syftbox_{self.component}_{field}"
+        return [
+            f"# HELP {name} {field.replace('_', ' ')} of the {self.component.replace('_', ' ')}",
+            f"# TYPE {name} {metric_type}",
+            f"{name} {_format_value(value)}",
+        ]
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self._metrics: list[Any] = []
+
+    def counter(self, name: str, documentation: str, labelnames: LabelValues = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: LabelValues = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: LabelValues = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def add_stats(
+        self,
+        component: str,
+        stats: Callable[[], Any],
+        gauges: Optional[dict[str, Callable[[], float]]] = None,
+    ) -> None:
+        """
+        Expose the stats of a component, read at scrape time.
+
+        Args:
+            component: name of the component, used as metric name prefix.
+            stats: returns a stats dataclass or dict. Fields ending in `_max` are gauges, others are counters.
+            gauges: extra gauges, e.g. the size of a cache.
+        """
+        self._register(_StatsCollector(component, stats, gauges or {}))
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+class ServerMetrics:
+    """The metrics of a server, and the registry they are exposed with."""
+
+    def __init__(self) -> None:
+        self.registry = MetricsRegistry()
+        self.request_duration = self.registry.histogram(
+            "syftbox_http_request_duration_seconds",
+            "Latency of HTTP requests",
+            ("method", "route", "status"),
+        )
+        self.requests_in_flight = self.registry.gauge(
+            "syftbox_http_requests_in_flight", "HTTP requests being served", ("method",)
+        )
+        self.request_bytes = self.registry.counter(
+            "syftbox_http_request_bytes_total", "Bytes of HTTP request bodies", ("route",)
+        )
+        self.response_bytes = self.registry.counter(
+            "syftbox_http_response_bytes_total", "Bytes of HTTP response bodies, after compression", ("route",)
+        )
+        self.db_duration = self.registry.histogram(
+            "syftbox_db_duration_seconds", "Time of database calls of the sync routes", ("operation",)
+        )
+        self.file_store_duration = self.registry.histogram(
+            "syftbox_file_store_duration_seconds", "Time of file store calls of the sync routes", ("operation",)
+        )
+        self.compression_bytes = self.registry.counter(
+            "syftbox_compression_bytes_total",
+            "Bytes of compressed responses, before (uncompressed) and after (compressed) compression",
+            ("encoding", "stage"),
+        )
+        self.compression_cpu_seconds = self.registry.counter(
+            "syftbox_compression_cpu_seconds_total", "CPU time spent compressing responses", ("encoding",)
+        )
+
+    def add_stats(
+        self,
+        component: str,
+        stats: Callable[[], Any],
+        gauges: Optional[dict[str, Callable[[], float]]] = None,
+    ) -> None:
+        self.registry.add_stats(component, stats, gauges)
+
+    def render(self) -> str:
+        return self.registry.render()
+
+
+async def get_metrics(request: Request) -> ServerMetrics:
+    return request.state.metrics
@@ -1,8 +1,16 @@
 import time
+from typing import Optional
 
-from fastapi import Request
+from fastapi import HTTPException, Request
 from loguru import logger
+from starlette.datastructures import Headers, MutableHeaders
 from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.responses import PlainTextResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from syftbox.lib import compression
+from syftbox.server.metrics import ServerMetrics
+from syftbox.server.rate_limit import RATE_LIMIT_SCOPE_KEY
 
 
 class LoguruMiddleware(BaseHTTPMiddleware):
@@ -13,3 +21,290 @@ class LoguruMiddleware(BaseHTTPMiddleware):
         logger.info(f"{request.method} {request.url.path} {response.status_code} {duration:.2f}s")
 
         return response
+
+
+class CompressionMiddleware:
+    """
+    Content-type-aware compression of responses, and decompression of request bodies.
+
+    The response encoding is negotiated with the Accept-Encoding header of the request, preferring zstd when the
+    `zstandard` package is installed, then gzip. Responses are not compressed if they are small, already encoded,
+    partial, or have an incompressible media type (e.g. the zip archives of `/sync/download_bulk`).
+
+    Request bodies with a supported Content-Encoding are decompressed before they reach the app. Bodies larger than
+    `max_decompressed_request_size` of the server settings after decompression are rejected with a 413.
+    The supported request encodings are advertised in the Accept-Encoding header of every response (RFC 7694).
+
+    The compression ratio and CPU time of each compressed response are logged, and sent in a Server-Timing header
+    when the body is not streamed.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        minimum_size: int = 1000,
+        gzip_level: int = compression.GZIP_LEVEL,
+        zstd_level: int = compression.ZSTD_LEVEL,
+        max_decompressed_size: int = compression.MAX_DECOMPRESSED_SIZE,
+    ) -> None:
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.zstd_level = zstd_level
+        self.max_decompressed_size = max_decompressed_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        request_encoding = headers.get("content-encoding", "").strip().lower()
+        if request_encoding and request_encoding != compression.IDENTITY:
+            if request_encoding not in compression.SUPPORTED_ENCODINGS:
+                response = PlainTextResponse(f"Unsupported Content-Encoding: {request_encoding}", status_code=415)
+                await response(scope, receive, send)
+                return
+            # the scope is changed in place, outer middlewares read the route that is set on it by the router
+            scope["headers"] = [
+                (k, v) for k, v in scope["headers"] if k not in (b"content-encoding", b"content-length")
+            ]
+            settings = scope.get("state", {}).get("server_settings")
+            max_size = settings.max_decompressed_request_size if settings is not None else self.max_decompressed_size
+            receive = _decompressing_receive(receive, compression.Decompressor(request_encoding, max_size))
+
+        responder = _CompressionResponder(
+            send,
+            encoding=compression.choose_encoding(headers.get("accept-encoding")),
+            path=scope["path"],
+            minimum_size=self.minimum_size,
+            gzip_level=self.gzip_level,
+            zstd_level=self.zstd_level,
+            metrics=scope.get("state", {}).get("metrics"),
+        )
+        await self.app(scope, receive, responder.send)
+
+
+def _decompressing_receive(receive: Receive, decompressor: compression.Decompressor) -> Receive:
+    async def receive_decompressed() -> Message:
+        message = await receive()
+        if message["type"] != "http.request":
+            return message
+        try:
+            body = decompressor.decompress(message.get("body", b""))
+            if not message.get("more_body", False):
+                body += decompressor.flush()
+        except compression.DecompressedSizeExceeded as e:
+            # raised while the app reads the body, FastAPI turns it into the response
+            raise HTTPException(status_code=413, detail=str(e))
+        return {**message, "body": body}
+
+    return receive_decompressed
+
+
+class _CompressionResponder:
+    def __init__(
+        self,
+        send: Send,
+        encoding: Optional[str],
+        path: str,
+        minimum_size: int,
+        gzip_level: int,
+        zstd_level: int,
+        metrics: Optional[ServerMetrics] = None,
+    ) -> None:
+        self._send = send
+        self.encoding = encoding
+        self.path = path
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.zstd_level = zstd_level
+        self.metrics = metrics
+
+        self.start_message: Optional[Message] = None
+        self.compressor: Optional[compression.Compressor] = None
+        self.started = False
+        self.uncompressed_size = 0
+        self.compressed_size = 0
+        self.cpu_time = 0.0
+
+    def _should_compress(self, headers: MutableHeaders, status: int, body: bytes, more_body: bool) -> bool:
+        if self.encoding is None or status < 200 or status in (204, 206, 304):
+            return False
+        if "content-encoding" in headers or "content-range" in headers:
+            return False
+        if not compression.is_compressible(headers.get("content-type")):
+            return False
+        if more_body:
+            content_length = headers.get("content-length")
+            return content_length is None or int(content_length) >= self.minimum_size
+        return len(body) >= self.minimum_size
+
+    def _compress(self, data: bytes, flush: bool) -> bytes:
+        cpu_start = time.thread_time()
+        compressed = self.compressor.compress(data)
+        if flush:
+            compressed += self.compressor.flush()
+        self.cpu_time += time.thread_time() - cpu_start
+        self.uncompressed_size += len(data)
+        self.compressed_size += len(compressed)
+        return compressed
+
+    def _report(self) -> str:
+        """Log and record the compression ratio and CPU time, and return them as a Server-Timing metric."""
+        if self.metrics is not None:
+            self.metrics.compression_bytes.inc(self.uncompressed_size, (self.encoding, "uncompressed"))
+            self.metrics.compression_bytes.inc(self.compressed_size, (self.encoding, "compressed"))
+            self.metrics.compression_cpu_seconds.inc(self.cpu_time, (self.encoding,))
+        ratio = self.uncompressed_size / self.compressed_size if self.compressed_size else 0.0
+        logger.debug(
+            f"Compressed {self.path} with {self.encoding}: {self.uncompressed_size} -> {self.compressed_size} bytes "
+            f"({ratio:.2f}x) in {self.cpu_time * 1000:.2f}ms CPU"
+        )
+        return f'compress;dur={self.cpu_time * 1000:.2f};desc="{self.encoding} {ratio:.2f}x"'
+
+    async def send(self, message: Message) -> None:
+        if message["type"] == "http.response.start":
+            # the start message is sent with the first body, when the encoding is known
+            self.start_message = message
+            return
+
+        if message["type"] != "http.response.body":
+            if not self.started:
+                # e.g. a pathsend response, which is sent as is
+                self.started = True
+                await self._send(self.start_message)
+            await self._send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if not self.started:
+            self.started = True
+            start_message = self.start_message
+            headers = MutableHeaders(raw=start_message["headers"])
+            headers["Accept-Encoding"] = ", ".join(compression.SUPPORTED_ENCODINGS)
+
+            if self._should_compress(headers, start_message["status"], body, more_body):
+                self.compressor = compression.Compressor(
+                    self.encoding, gzip_level=self.gzip_level, zstd_level=self.zstd_level
+                )
+                headers["Content-Encoding"] = self.encoding
+                headers.add_vary_header("Accept-Encoding")
+                body = self._compress(body, flush=not more_body)
+                if more_body:
+                    del headers["Content-Length"]
+                else:
+                    headers["Content-Length"] = str(len(body))
+                    headers.append("Server-Timing", self._report())
+
+            await self._send(start_message)
+            await self._send({**message, "body": body})
+            return
+
+        if self.compressor is not None:
+            body = self._compress(body, flush=not more_body)
+            if not more_body:
+                self._report()
+        await self._send({**message, "body": body})
+
+
+class RateLimitMiddleware:
+    """
+    Charges response bodies to the byte bucket of the user, see `syftbox.server.rate_limit`.
+
+    The bucket is set in the scope by the `rate_limit` dependency, after the user is authenticated.
+    This middleware should be added after CompressionMiddleware, so the compressed size is charged.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        async def send_wrapper(message: Message) -> None:
+            if message["type"] == "http.response.body" and RATE_LIMIT_SCOPE_KEY in scope:
+                rate_limiter, bucket = scope[RATE_LIMIT_SCOPE_KEY]
+                rate_limiter.charge(bucket, len(message.get("body", b"")))
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+
+class MirrorMiddleware:
+    """
+    Proxies the requests that a mirror server does not serve from its own copy to the upstream server,
+    see `syftbox.server.mirror`. Requests are passed through when the server is not a mirror.
+
+    This middleware should be added first, so proxied request bodies are already decompressed.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        mirror = scope.get("state", {}).get("mirror") if scope["type"] == "http" else None
+        if mirror is None or mirror.serves_locally(scope["method"], scope["path"]):
+            await self.app(scope, receive, send)
+            return
+
+        response = await mirror.proxy(Request(scope, receive))
+        await response(scope, receive, send)
+
+
+def _route_of(scope: Scope) -> str:
+    # the path template of the matched route, raw paths would give a time series per file
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+
+class MetricsMiddleware:
+    """
+    Records the latency, status and body sizes of requests, see `syftbox.server.metrics`.
+    A pure ASGI middleware, so it does not wrap requests and responses in extra tasks like `BaseHTTPMiddleware`.
+    It should be added last, so it measures the whole middleware stack and the bytes sent on the wire.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        metrics: Optional[ServerMetrics] = scope.get("state", {}).get("metrics") if scope["type"] == "http" else None
+        if metrics is None:
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        status = 500
+        request_bytes = 0
+        response_bytes = 0
+
+        async def receive_wrapper() -> Message:
+            nonlocal request_bytes
+            message = await receive()
+            if message["type"] == "http.request":
+                request_bytes += len(message.get("body", b""))
+            return message
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status, response_bytes
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                response_bytes += len(message.get("body", b""))
+            await send(message)
+
+        start = time.perf_counter()
+        metrics.requests_in_flight.inc(labels=(method,))
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            metrics.requests_in_flight.dec(labels=(method,))
+            route = _route_of(scope)
+            metrics.request_duration.observe(time.perf_counter() - start, (method, route, str(status)))
+            metrics.request_bytes.inc(request_bytes, (route,))
+            metrics.response_bytes.inc(response_bytes, (route,))
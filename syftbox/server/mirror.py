@@ -0,0 +1,280 @@
+"""
+Read-only mirror mode: a server that follows an upstream server, and serves reads from its own copy.
+
+Started with `syftbox server --mirror <upstream>`. The mirror polls `/sync/datasite_states` of the upstream with
+the per-datasite ETags of its previous poll, and downloads the changed files with `/sync/download_bulk` into its
+own snapshot folder and database. Listings and downloads are served from this copy, using the replicated
+permission files. All other requests, including writes and auth, are proxied to the upstream by `MirrorMiddleware`.
+
+The mirror polls with its own account (`mirror_token`), which should be in the `mirror_emails` of the upstream
+so all files are replicated, not only the files readable by the mirror, and the mirror is not rate limited.
+The mirror and the upstream should share the same `jwt_secret`, so the mirror accepts the access tokens of the
+upstream.
+
+After a proxied write, the mirror copies the written files from the upstream before responding, so a client reads
+its own writes. Other changes are visible on the mirror after the next poll.
+"""
+
+import contextlib
+import json
+import threading
+import zipfile
+from dataclasses import dataclass
+from io import BytesIO
+from pathlib import Path
+from typing import Optional
+from urllib.parse import quote
+
+import anyio.to_thread
+import httpx
+from fastapi import Request, Response
+from loguru import logger
+
+from syftbox.client.plugins.sync import endpoints
+from syftbox.server import proxy
+from syftbox.server.settings import ServerSettings
+from syftbox.server.startup import file_lock
+from syftbox.server.sync import db
+from syftbox.server.sync.content_cache import ContentCache
+from syftbox.server.sync.file_store import FileStore
+from syftbox.server.sync.models import FileMetadata
+
+# sync endpoints that only read, and are served from the local copy
+LOCAL_SYNC_PATHS = {
+    "/sync/datasite_states",
+    "/sync/datasites",
+    "/sync/dir_state",
+    "/sync/dir_digest",
+    "/sync/download",
+    "/sync/download_bulk",
+    "/sync/get_diff",
+    "/sync/get_delta",
+    "/sync/get_metadata",
+}
+
+# sync endpoints that change files on the upstream
+WRITE_PATHS = {"/sync/create", "/sync/apply_diff", "/sync/delete", "/sync/upload_bulk"}
+
+# the request of a bulk upload only names the datasite, the created files are listed in its response
+BULK_UPLOAD_PATH = "/sync/upload_bulk"
+
+# limits of a single `/sync/download_bulk` request
+MAX_BULK_FILES = 100
+MAX_BULK_BYTES = 64 * 1024 * 1024
+
+
+@dataclass
+class MirrorStats:
+    polls: int = 0
+    downloaded: int = 0
+    deleted: int = 0
+    errors: int = 0
+
+
+def _bulk_batches(files: list[FileMetadata]) -> list[list[FileMetadata]]:
+    batches: list[list[FileMetadata]] = []
+    batch: list[FileMetadata] = []
+    batch_size = 0
+    for metadata in files:
+        if batch and (len(batch) >= MAX_BULK_FILES or batch_size + metadata.file_size > MAX_BULK_BYTES):
+            batches.append(batch)
+            batch, batch_size = [], 0
+        batch.append(metadata)
+        batch_size += metadata.file_size
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+class Mirror:
+    def __init__(
+        self,
+        file_store: FileStore,
+        upstream: httpx.Client,
+        async_upstream: httpx.AsyncClient,
+        interval: float = 5.0,
+    ) -> None:
+        """
+        Args:
+            file_store: local copy of the upstream.
+            upstream: client for the upstream, authenticated with the mirror account.
+            async_upstream: client for proxied requests, which are sent with the credentials of the caller.
+            interval: seconds between polls of the upstream.
+        """
+        self.file_store = file_store
+        self.upstream = upstream
+        self.async_upstream = async_upstream
+        self.interval = interval
+        self.etags: dict[str, str] = {}
+        self.stats = MirrorStats()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @classmethod
+    def from_settings(cls, settings: ServerSettings, content_cache: Optional[ContentCache] = None) -> "Mirror":
+        headers = {}
+        if settings.mirror_token is not None:
+            headers["Authorization"] = f"Bearer {settings.mirror_token.get_secret_value()}"
+        return cls(
+            file_store=FileStore(settings, content_cache=content_cache),
+            upstream=httpx.Client(base_url=settings.mirror_upstream, headers=headers, timeout=60),
+            async_upstream=httpx.AsyncClient(base_url=settings.mirror_upstream, timeout=60),
+            interval=settings.mirror_interval,
+        )
+
+    @staticmethod
+    def serves_locally(method: str, path: str) -> bool:
+        return method in ("GET", "HEAD") or path in LOCAL_SYNC_PATHS
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="syftbox-mirror", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self) -> None:
+        lock_path = self.file_store.server_settings.mirror_lock_path
+        while not self._stopped.is_set():
+            # with multiple workers, one of them polls the upstream
+            with file_lock(lock_path, blocking=False) as acquired:
+                while acquired and not self._stopped.is_set():
+                    self._poll()
+                    self._stopped.wait(self.interval)
+            self._stopped.wait(self.interval)
+
+    def _poll(self) -> None:
+        try:
+            self.sync()
+        except Exception as e:
+            self.stats.errors += 1
+            logger.error(f"Failed to sync mirror with upstream {self.upstream.base_url}: {e}")
+
+    def sync(self) -> None:
+        """Copy all changes of the upstream since the previous call."""
+        self.stats.polls += 1
+        states, new_etags = endpoints.get_datasite_states_if_changed(self.upstream, self.etags)
+        if states.keys() == self.etags.keys() and all(state is None for state in states.values()):
+            return
+
+        # datasite states skip datasites that fail to load, only datasites that are gone are deleted
+        response = self.upstream.post("/sync/datasites")
+        response.raise_for_status()
+        upstream_datasites = set(response.json())
+        for datasite in set(self._local_datasites()) - upstream_datasites:
+            self._sync_datasite(datasite, [])
+
+        for datasite, state in states.items():
+            if state is None:
+                continue
+            self._sync_datasite(datasite, state)
+            if datasite in new_etags:
+                self.etags[datasite] = new_etags[datasite]
+        self.etags = {datasite: etag for datasite, etag in self.etags.items() if datasite in states}
+
+    def _local_datasites(self) -> list[str]:
+        with contextlib.closing(db.get_db(self.file_store.db_path)) as conn:
+            return db.get_all_datasites(conn)
+
+    def _sync_datasite(self, datasite: str, remote_state: list[FileMetadata]) -> None:
+        with contextlib.closing(db.get_db(self.file_store.db_path)) as conn:
+            local_hashes = {row["path"]: row["hash"] for row in db.get_all_metadata_dicts(conn, datasite)}
+        remote_files = {metadata.path.as_posix(): metadata for metadata in remote_state}
+
+        changed = [metadata for path, metadata in remote_files.items() if local_hashes.get(path) != metadata.hash]
+        self._download(changed)
+
+        for path in local_hashes.keys() - remote_files.keys():
+            self.file_store.delete(Path(path))
+            self.stats.deleted += 1
+
+    def _download(self, files: list[FileMetadata]) -> None:
+        """Copy files from the upstream, with `/sync/download_bulk` requests of at most MAX_BULK_FILES/BYTES."""
+        for batch in _bulk_batches(files):
+            data = endpoints.download_bulk(self.upstream, [metadata.path.as_posix() for metadata in batch])
+            with zipfile.ZipFile(BytesIO(data)) as zf:
+                for name in zf.namelist():
+                    self.file_store.put(Path(name), zf.read(name))
+                    self.stats.downloaded += 1
+
+    def _list_datasite(self, datasite: str) -> list[FileMetadata]:
+        # not endpoints.get_remote_state, which keeps the metadata of every listed file on the client
+        response = self.upstream.post("/sync/dir_state", params={"dir": datasite})
+        return endpoints.decode_metadata_list(endpoints.handle_json_response("/sync/dir_state", response))
+
+    def refresh(self, path: str) -> None:
+        """
+        Copy a single file from the upstream, or delete it if it no longer exists.
+
+        Raises:
+            httpx.HTTPStatusError: if the upstream fails, or rate limits the mirror with a 429.
+        """
+        response = self.upstream.get(f"/sync/download/{quote(path)}")
+        if response.status_code == 404:
+            self.file_store.delete(Path(path))
+            return
+        response.raise_for_status()
+        self.file_store.put(Path(path), response.content)
+
+    def refresh_all(self, paths: list[str]) -> None:
+        """Refresh each of paths. Failures are logged, and retried by the next poll."""
+        for path in paths:
+            try:
+                self.refresh(path)
+            except Exception as e:
+                self.stats.errors += 1
+                logger.error(f"Failed to refresh {path} from upstream: {e}")
+
+    def refresh_bulk(self, paths: list[str]) -> None:
+        """
+        Refresh the files created by a bulk upload, in `/sync/download_bulk` batches like `sync`.
+        The sizes of the files are read from a listing of their datasite. Failures are logged, and retried by the
+        next poll.
+        """
+        for datasite in sorted({Path(path).parts[0] for path in paths}):
+            try:
+                remote_files = {metadata.path.as_posix(): metadata for metadata in self._list_datasite(datasite)}
+                created = [path for path in paths if Path(path).parts[0] == datasite]
+                self._download([remote_files[path] for path in created if path in remote_files])
+                # deleted on the upstream since they were uploaded
+                for path in created:
+                    if path not in remote_files:
+                        self.file_store.delete(Path(path))
+            except Exception as e:
+                self.stats.errors += 1
+                logger.error(f"Failed to refresh the bulk upload of {datasite} from upstream: {e}")
+
+    async def proxy(self, request: Request) -> Response:
+        """Send a request to the upstream. Files changed by the request are refreshed before the response is sent."""
+        body = await request.body()
+        upstream_response = await proxy.send(self.async_upstream, request, body)
+        if upstream_response.status_code != 200 or request.url.path not in WRITE_PATHS:
+            return proxy.stream_response(upstream_response)
+
+        if request.url.path == BULK_UPLOAD_PATH:
+            response, paths = await self._read_bulk_upload(upstream_response)
+            await anyio.to_thread.run_sync(self.refresh_bulk, paths)
+            return response
+
+        path = await proxy.path_of_request(request, body)
+        await anyio.to_thread.run_sync(self.refresh_all, [path] if path else [])
+        return proxy.stream_response(upstream_response)
+
+    async def _read_bulk_upload(self, upstream_response: httpx.Response) -> tuple[Response, list[str]]:
+        """Returns the response of a bulk upload, and the paths of the created files."""
+        try:
+            # raw bytes keep the content encoding of the upstream server
+            raw = b"".join([chunk async for chunk in upstream_response.aiter_raw()])
+        finally:
+            await upstream_response.aclose()
+        response = Response(
+            raw, status_code=upstream_response.status_code, headers=proxy.forward_headers(upstream_response.headers)
+        )
+        try:
+            data = json.loads(proxy.decode_body(raw, upstream_response.headers.get("content-encoding")))
+            return response, [str(path) for path in data["created"]]
+        except Exception as e:
+            logger.error(f"Failed to read the created files of a bulk upload: {e}")
+            return response, []
@@ -0,0 +1,123 @@
+"""
+Forwarding of requests to another SyftBox server, used by the shard router and by mirror servers.
+"""
+
+import json
+from pathlib import PurePosixPath
+from typing import Optional
+
+import httpx
+from fastapi import HTTPException, Request
+from starlette.background import BackgroundTask
+from starlette.responses import StreamingResponse
+
+from syftbox.lib import compression
+
+# not forwarded in either direction
+HOP_BY_HOP_HEADERS = {
+    "connection",
+    "keep-alive",
+    "proxy-authenticate",
+    "proxy-authorization",
+    "te",
+    "trailers",
+    "transfer-encoding",
+    "upgrade",
+    "host",
+}
+
+# sync endpoints about a single path, with the JSON field that holds the path
+PATH_FIELDS = {
+    "/sync/get_diff": "path",
+    "/sync/get_delta": "path",
+    "/sync/apply_diff": "path",
+    "/sync/delete": "path",
+    "/sync/download": "path",
+    "/sync/dir_digest": "path",
+    "/sync/get_metadata": "path_like",
+}
+
+
+def datasite_of(path: str) -> str:
+    parts = PurePosixPath(path).parts
+    if not parts:
+        raise HTTPException(status_code=400, detail="path should be inside a datasite")
+    return parts[0]
+
+
+def forward_headers(headers: httpx.Headers) -> dict[str, str]:
+    return {key: value for key, value in headers.items() if key.lower() not in HOP_BY_HOP_HEADERS}
+
+
+def decode_body(
+    body: bytes, content_encoding: Optional[str], max_size: int = compression.MAX_DECOMPRESSED_SIZE
+) -> bytes:
+    encoding = (content_encoding or "").strip().lower()
+    if not encoding or encoding == compression.IDENTITY:
+        return body
+    try:
+        decompressor = compression.Decompressor(encoding, max_size)
+    except ValueError:
+        raise HTTPException(status_code=415, detail=f"Unsupported Content-Encoding: {encoding}")
+    try:
+        return decompressor.decompress(body) + decompressor.flush()
+    except compression.DecompressedSizeExceeded as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+
+async def path_of_request(
+    request: Request, body: bytes, max_size: int = compression.MAX_DECOMPRESSED_SIZE
+) -> Optional[str]:
+    """
+    The path a sync request is about, or None if the request is not about a single path.
+    Invalid requests also return None, they are validated by the server that handles them.
+    """
+    path = request.url.path
+    if path in PATH_FIELDS:
+        try:
+            data = json.loads(decode_body(body, request.headers.get("content-encoding"), max_size))
+            return str(data[PATH_FIELDS[path]])
+        except (ValueError, KeyError, TypeError):
+            return None
+    if path == "/sync/dir_state":
+        return request.query_params.get("dir")
+    if path in ("/sync/create", "/sync/upload_bulk"):
+        return await _path_of_upload(request, body, max_size)
+    for prefix in ("/sync/download/", "/datasites/"):
+        if path.startswith(prefix) and len(path) > len(prefix):
+            return path[len(prefix) :]
+    return None
+
+
+async def _path_of_upload(request: Request, body: bytes, max_size: int) -> Optional[str]:
+    decoded = decode_body(body, request.headers.get("content-encoding"), max_size)
+
+    async def receive() -> dict:
+        return {"type": "http.request", "body": decoded, "more_body": False}
+
+    form = await Request(request.scope, receive).form()
+    upload = form.get("file")
+    return getattr(upload, "filename", None) or None
+
+
+async def send(client: httpx.AsyncClient, request: Request, body: bytes) -> httpx.Response:
+    """Send request to the server of client. The response is streamed, and should be closed by the caller."""
+    upstream_request = client.build_request(
+        request.method,
+        request.url.path,
+        params=request.query_params,
+        headers=forward_headers(httpx.Headers(request.headers.raw)),
+        content=body,
+    )
+    return await client.send(upstream_request, stream=True)
+
+
+def stream_response(response: httpx.Response) -> StreamingResponse:
+    """Stream a response of `send` back to the client."""
+    # raw bytes keep the content encoding of the upstream server
+    return StreamingResponse(
+        response.aiter_raw(),
+        status_code=response.status_code,
+        headers=forward_headers(response.headers),
+        background=BackgroundTask(response.aclose),
+    )
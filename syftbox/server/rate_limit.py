@@ -0,0 +1,185 @@
+"""
+Per-user rate limiting with token buckets.
+
+Rate limiting is off by default. Operators enable it by setting `rate_limit_requests_per_second` and/or
+`rate_limit_bytes_per_second` above 0.
+
+Each authenticated user has two buckets: one for the number of requests, and one for the bytes transferred
+in request and response bodies. Requests are rejected with a 429 and a Retry-After header when a bucket is empty.
+
+Request bodies are charged up front from their Content-Length. Response bodies are charged by
+`RateLimitMiddleware` as they are sent, so a large download puts the byte bucket in debt and
+delays the next request of that user instead of failing halfway.
+"""
+
+import math
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Optional
+
+from fastapi import Depends, HTTPException, Request
+
+from syftbox.server.settings import ServerSettings, get_server_settings
+from syftbox.server.users.auth import get_current_user
+
+# key in the ASGI scope of the bucket that is charged for the response body
+RATE_LIMIT_SCOPE_KEY = "syftbox.rate_limit"
+
+# idle buckets are dropped when there are more than this many users
+MAX_IDLE_BUCKETS = 10_000
+
+
+@dataclass
+class TokenBucket:
+    rate: float
+    capacity: float
+    tokens: float = field(init=False)
+    updated_at: float = field(default_factory=time.monotonic)
+
+    def __post_init__(self) -> None:
+        self.tokens = self.capacity
+
+    def refill(self, now: float) -> None:
+        # `now` can be read before the bucket was created
+        elapsed = max(now - self.updated_at, 0.0)
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+        self.updated_at = max(now, self.updated_at)
+
+    def is_full(self, now: float) -> bool:
+        self.refill(now)
+        return self.tokens >= self.capacity
+
+    def retry_after(self, amount: float) -> float:
+        """Seconds until the bucket has `amount` tokens."""
+        return max(amount - self.tokens, 0) / self.rate
+
+
+@dataclass
+class UserBuckets:
+    requests: Optional[TokenBucket]
+    bytes: Optional[TokenBucket]
+
+
+class RateLimitExceeded(Exception):
+    def __init__(self, retry_after: float) -> None:
+        super().__init__(f"rate limit exceeded, retry after {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+class RateLimiter:
+    """
+    Token bucket rate limiter keyed by user.
+    A rate of 0 disables the corresponding limit.
+    """
+
+    def __init__(
+        self,
+        requests_per_second: float,
+        request_burst: int,
+        bytes_per_second: float,
+        bytes_burst: int,
+    ) -> None:
+        self.requests_per_second = requests_per_second
+        self.request_burst = request_burst
+        self.bytes_per_second = bytes_per_second
+        self.bytes_burst = bytes_burst
+        self.rejected = 0
+        self._buckets: dict[str, UserBuckets] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.requests_per_second > 0 or self.bytes_per_second > 0
+
+    def _new_buckets(self) -> UserBuckets:
+        requests_bucket, bytes_bucket = None, None
+        if self.requests_per_second > 0:
+            requests_bucket = TokenBucket(self.requests_per_second, self.request_burst)
+        if self.bytes_per_second > 0:
+            bytes_bucket = TokenBucket(self.bytes_per_second, self.bytes_burst)
+        return UserBuckets(requests=requests_bucket, bytes=bytes_bucket)
+
+    def _get_buckets(self, user: str, now: float) -> UserBuckets:
+        buckets = self._buckets.get(user)
+        if buckets is None:
+            if len(self._buckets) >= MAX_IDLE_BUCKETS:
+                self._drop_idle_buckets(now)
+            buckets = self._buckets[user] = self._new_buckets()
+        return buckets
+
+    def _drop_idle_buckets(self, now: float) -> None:
+        # a full bucket has the same state as a new one
+        for user, buckets in list(self._buckets.items()):
+            if all(bucket is None or bucket.is_full(now) for bucket in (buckets.requests, buckets.bytes)):
+                del self._buckets[user]
+
+    def acquire(self, user: str, n_bytes: int = 0) -> Optional[TokenBucket]:
+        """
+        Take a request token and n_bytes byte tokens from the buckets of user.
+        Returns the byte bucket, to charge the response body to.
+
+        A request is admitted as long as the byte bucket is not in debt, so requests larger than the burst can pass.
+
+        Raises:
+            RateLimitExceeded: if the user has no tokens left.
+        """
+        now = time.monotonic()
+        with self._lock:
+            buckets = self._get_buckets(user, now)
+            retry_after = 0.0
+            if buckets.requests is not None:
+                buckets.requests.refill(now)
+                retry_after = buckets.requests.retry_after(1)
+            if buckets.bytes is not None:
+                buckets.bytes.refill(now)
+                retry_after = max(retry_after, buckets.bytes.retry_after(0))
+            if retry_after > 0:
+                self.rejected += 1
+                raise RateLimitExceeded(retry_after)
+
+            if buckets.requests is not None:
+                buckets.requests.tokens -= 1
+            if buckets.bytes is not None:
+                buckets.bytes.tokens -= n_bytes
+            return buckets.bytes
+
+    def charge(self, bucket: TokenBucket, n_bytes: int) -> None:
+        with self._lock:
+            bucket.tokens -= n_bytes
+
+
+async def get_rate_limiter(request: Request) -> RateLimiter:
+    return request.state.rate_limiter
+
+
+async def rate_limit(
+    request: Request,
+    email: str = Depends(get_current_user),
+    rate_limiter: RateLimiter = Depends(get_rate_limiter),
+    server_settings: ServerSettings = Depends(get_server_settings),
+) -> None:
+    """
+    Dependency that applies the rate limits of the current user to a route.
+
+    Mirror accounts are not rate limited, a mirror polls and refreshes on behalf of all of its users.
+    """
+    if not rate_limiter.enabled or email in server_settings.mirror_emails:
+        return
+
+    try:
+        content_length = int(request.headers.get("content-length", 0))
+    except ValueError:
+        content_length = 0
+
+    try:
+        bytes_bucket = rate_limiter.acquire(email, content_length)
+    except RateLimitExceeded as e:
+        raise HTTPException(
+            status_code=429,
+            detail=str(e),
+            headers={"Retry-After": str(math.ceil(e.retry_after))},
+        )
+
+    if bytes_bucket is not None:
+        request.scope[RATE_LIMIT_SCOPE_KEY] = (rate_limiter, bytes_bucket)
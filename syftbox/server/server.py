@@ -3,38 +3,60 @@ import json
 import os
 import platform
 import random
+import sqlite3
 import sys
 from dataclasses import dataclass
-from datetime import datetime
 from pathlib import Path
 
+import anyio
 from fastapi import Depends, FastAPI, Header, Request
-from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.responses import (
     FileResponse,
     HTMLResponse,
     JSONResponse,
     PlainTextResponse,
     RedirectResponse,
+    Response,
 )
-from jinja2 import Template
 from loguru import logger
-from typing_extensions import Any, Optional, Union
+from typing_extensions import Any, Optional
 
 from syftbox.__version__ import __version__
 from syftbox.lib.lib import (
     Jsonable,
-    get_datasites,
 )
-from syftbox.server.analytics import log_analytics_event
+from syftbox.server import browser
+from syftbox.server.analytics import AnalyticsQueue, get_analytics_queue, import_rotated_logs
+from syftbox.server.analytics_store import AnalyticsStore
+from syftbox.server.browser import ListingCache, get_listing_cache
 from syftbox.server.logger import setup_logger
-from syftbox.server.middleware import LoguruMiddleware
+from syftbox.server.metrics import CONTENT_TYPE, ServerMetrics, get_metrics
+from syftbox.server.middleware import (
+    CompressionMiddleware,
+    LoguruMiddleware,
+    MetricsMiddleware,
+    MirrorMiddleware,
+    RateLimitMiddleware,
+)
+from syftbox.server.mirror import Mirror
+from syftbox.server.rate_limit import RateLimiter
 from syftbox.server.settings import ServerSettings, get_server_settings
+from syftbox.server.startup import run_once
 
+from .admin.router import router as admin_router
 from .emails.router import router as emails_router
 from .sync import db, hash
+from .sync.content_cache import ContentCache
+from .sync.delta import DeltaCache
+from .sync.executor import CPUExecutor
+from .sync.file_store import AsyncFileStore
+from .sync.permissions import PermissionCache
+from .sync.query_stats import QUERY_STATS
+from .sync.router import get_file_store
 from .sync.router import router as sync_router
+from .sync.single_flight import SingleFlight
 from .users.router import router as users_router
+from .users.token_cache import TokenCache
 
 current_dir = Path(__file__).parent
 
@@ -53,15 +75,6 @@ def load_dict(cls, filepath: str) -> Optional[dict[str, Any]]:
     return None
 
 
-def save_dict(obj: Any, filepath: str) -> None:
-    dicts = {}
-    for key, value in obj.items():
-        dicts[key] = value.to_dict()
-
-    with open(filepath, "w") as f:
-        f.write(json.dumps(dicts))
-
-
 @dataclass
 class User(Jsonable):
     email: str
@@ -69,43 +82,58 @@ class User(Jsonable):
 
 
 class Users:
+    """
+    Registered users, stored in a SQLite database that is shared by all server workers.
+    """
+
     def __init__(self, path: Path) -> None:
         self.path = path
-        self.users = {}
-        self.load()
-
-    def load(self):
-        if os.path.exists(str(self.path)):
-            users = load_dict(User, str(self.path))
-        else:
-            users = None
-        if users:
-            self.users = users
-
-    def save(self):
-        save_dict(self.users, str(self.path))
+        with contextlib.closing(self._connect()) as conn, conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS users (email TEXT PRIMARY KEY, token INTEGER NOT NULL)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path)
+        conn.execute("PRAGMA journal_mode=WAL;")
+        conn.execute("PRAGMA busy_timeout=5000;")
+        return conn
+
+    def migrate_from_json(self, json_path: Path) -> int:
+        """
+        Import the users of a users.json file from a previous server version, and rename the file.
+        Returns the number of imported users.
+        """
+        if not json_path.exists():
+            return 0
+        users = load_dict(User, str(json_path)) or {}
+        with contextlib.closing(self._connect()) as conn, conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO users (email, token) VALUES (?, ?)",
+                [(user.email, user.token) for user in users.values()],
+            )
+        json_path.rename(json_path.with_name(json_path.name + ".migrated"))
+        logger.info(f"> Migrated {len(users)} users from {json_path} to {self.path}")
+        return len(users)
 
     def get_user(self, email: str) -> Optional[User]:
-        if email not in self.users:
-            return None
-        return self.users[email]
+        with contextlib.closing(self._connect()) as conn:
+            row = conn.execute("SELECT email, token FROM users WHERE email = ?", (email,)).fetchone()
+        return User(email=row[0], token=row[1]) if row else None
 
     def create_user(self, email: str) -> int:
-        if email in self.users:
-            # for now just return the token
-            return self.users[email].token
-            # raise Exception(f"User already registered: {email}")
+        # for now just return the token if the user already exists
         token = random.randint(0, sys.maxsize)
-        user = User(email=email, token=token)
-        self.users[email] = user
-        self.save()
-        return token
+        with contextlib.closing(self._connect()) as conn, conn:
+            # another worker may register the same user concurrently, the first token wins
+            conn.execute("INSERT OR IGNORE INTO users (email, token) VALUES (?, ?)", (email, token))
+            row = conn.execute("SELECT token FROM users WHERE email = ?", (email,)).fetchone()
+        return row[0]
+
+    def __len__(self) -> int:
+        with contextlib.closing(self._connect()) as conn:
+            return conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
 
     def __repr__(self) -> str:
-        string = ""
-        for email, user in self.users.items():
-            string += f"{email}: {user}"
-        return string
+        return f"Users(path={self.path}, count={len(self)})"
 
 
 def get_users(request: Request) -> Users:
@@ -129,6 +157,8 @@ def init_db(settings: ServerSettings) -> None:
     cur = con.cursor()
     for m in metadata:
         db.save_file_metadata(cur, m)
+    logger.info("> Indexing permission files")
+    db.rebuild_acl(cur, settings.snapshot_folder)
 
     cur.close()
     con.commit()
@@ -150,26 +180,109 @@ async def lifespan(app: FastAPI, settings: Optional[ServerSettings] = None):
 
     create_folders(settings.folders)
 
-    users = Users(path=settings.user_file_path)
-    logger.info("> Loading Users")
-    logger.info(users)
+    users = Users(path=settings.user_db_path)
+    analytics_store = AnalyticsStore(settings.analytics_db_path)
 
-    init_db(settings)
+    def startup_tasks():
+        init_db(settings)
+        users.migrate_from_json(settings.user_file_path)
+        import_rotated_logs(settings.logs_folder, analytics_store)
+
+    run_once(settings.data_folder, startup_tasks)
+    logger.info(f"> Loaded {users}")
+
+    cpu_executor = CPUExecutor(
+        max_workers=settings.cpu_workers,
+        max_queue_size=settings.cpu_queue_size,
+        use_processes=settings.cpu_use_processes,
+    )
+
+    content_cache = ContentCache(settings.content_cache_size, settings.content_cache_max_object_size)
+
+    analytics_queue = AnalyticsQueue(
+        max_size=settings.analytics_queue_size,
+        batch_size=settings.analytics_batch_size,
+        sample_rates=settings.analytics_sample_rates,
+        store=analytics_store,
+    )
+    analytics_queue.start()
+
+    delta_cache = DeltaCache(settings.delta_cache_size)
+    single_flight = SingleFlight(ttl=settings.read_cache_ttl)
+    rate_limiter = RateLimiter(
+        requests_per_second=settings.rate_limit_requests_per_second,
+        request_burst=settings.rate_limit_request_burst,
+        bytes_per_second=settings.rate_limit_bytes_per_second,
+        bytes_burst=settings.rate_limit_bytes_burst,
+    )
+
+    mirror = None
+    if settings.mirror_upstream:
+        logger.info(f"> Mirroring {settings.mirror_upstream}")
+        mirror = Mirror.from_settings(settings, content_cache)
+        mirror.start()
+
+    QUERY_STATS.configure(
+        enabled=settings.db_query_stats,
+        slow_query_seconds=settings.db_slow_query_ms / 1000 if settings.db_slow_query_ms else None,
+    )
+
+    token_cache = TokenCache(settings.jwt_cache_size)
+    listing_cache = ListingCache(settings.browser_cache_size)
+
+    metrics = ServerMetrics()
+    metrics.add_stats("db", QUERY_STATS.totals)
+    metrics.add_stats("cpu_executor", lambda: cpu_executor.stats)
+    metrics.add_stats(
+        "content_cache",
+        lambda: content_cache.stats,
+        gauges={"bytes": lambda: content_cache.size, "entries": lambda: len(content_cache)},
+    )
+    metrics.add_stats("delta_cache", lambda: delta_cache.stats, gauges={"entries": lambda: len(delta_cache)})
+    metrics.add_stats("single_flight", lambda: single_flight.stats, gauges={"entries": lambda: len(single_flight)})
+    metrics.add_stats("rate_limiter", lambda: {"rejected": rate_limiter.rejected})
+    metrics.add_stats("analytics_queue", lambda: analytics_queue.stats)
+    metrics.add_stats("token_cache", lambda: token_cache.stats, gauges={"entries": lambda: len(token_cache)})
+    metrics.add_stats("listing_cache", lambda: listing_cache.stats, gauges={"entries": lambda: len(listing_cache)})
+    if mirror is not None:
+        metrics.add_stats("mirror", lambda: mirror.stats, gauges={"datasites": lambda: len(mirror.etags)})
 
     yield {
         "server_settings": settings,
         "users": users,
+        "permission_cache": PermissionCache(settings.snapshot_folder),
+        "cpu_executor": cpu_executor,
+        "delta_cache": delta_cache,
+        "content_cache": content_cache,
+        "single_flight": single_flight,
+        "io_limiter": anyio.CapacityLimiter(settings.io_threads),
+        "rate_limiter": rate_limiter,
+        "mirror": mirror,
+        "metrics": metrics,
+        "query_stats": QUERY_STATS,
+        "token_cache": token_cache,
+        "listing_cache": listing_cache,
+        "analytics_queue": analytics_queue,
+        "analytics_store": analytics_store,
     }
 
     logger.info("> Shutting down server")
+    if mirror is not None:
+        mirror.stop()
+    analytics_queue.stop()
+    cpu_executor.stop()
 
 
 app = FastAPI(lifespan=lifespan)
+app.include_router(admin_router)
 app.include_router(emails_router)
 app.include_router(sync_router)
 app.include_router(users_router)
-app.add_middleware(GZipMiddleware, minimum_size=1000, compresslevel=5)
+app.add_middleware(MirrorMiddleware)
+app.add_middleware(CompressionMiddleware, minimum_size=1000)
+app.add_middleware(RateLimitMiddleware)
 app.add_middleware(LoguruMiddleware)
+app.add_middleware(MetricsMiddleware)
 
 # Define the ASCII art
 ascii_art = rf"""
@@ -209,80 +322,89 @@ async def get_wheel(path: str):
     return filename
 
 
-def get_file_list(directory: Union[str, Path] = ".") -> list[dict[str, Any]]:
-    # TODO rewrite with pathlib
-    directory = str(directory)
-
-    file_list = []
-    for item in os.listdir(directory):
-        item_path = os.path.join(directory, item)
-        is_dir = os.path.isdir(item_path)
-        size = os.path.getsize(item_path) if not is_dir else "-"
-        mod_time = datetime.fromtimestamp(os.path.getmtime(item_path)).strftime("%Y-%m-%d %H:%M:%S")
-
-        file_list.append({"name": item, "is_dir": is_dir, "size": size, "mod_time": mod_time})
-
-    return sorted(file_list, key=lambda x: (not x["is_dir"], x["name"].lower()))
+async def render_listing(
+    request: Request,
+    file_store: AsyncFileStore,
+    listing_cache: ListingCache,
+    directory: Path,
+    datasite: Optional[str],
+    context: dict[str, Any],
+) -> Response:
+    """Render a directory listing of the datasite browser, from the listing cache if the directory is unchanged."""
+    path = request.url.path
+    version = await file_store.run_db(browser.listing_version, file_store.server_settings.snapshot_folder, datasite)
+    headers = {"ETag": browser.listing_etag(path, version), "Cache-Control": browser.LISTING_CACHE_CONTROL}
+    if browser.is_not_modified(request.headers, headers["ETag"]):
+        return browser.not_modified_response(headers)
+
+    html = listing_cache.get(path, version)
+    if html is None:
+        files = await file_store.run(browser.get_file_list, directory)
+        template = browser.FOLDER_TEMPLATE if datasite is not None else browser.DATASITES_TEMPLATE
+        html = template.render({**context, "files": files}).encode()
+        listing_cache.put(path, version, html)
+    return HTMLResponse(html, headers=headers)
 
 
 @app.get("/datasites", response_class=HTMLResponse)
-async def list_datasites(request: Request, server_settings: ServerSettings = Depends(get_server_settings)):
-    files = get_file_list(server_settings.snapshot_folder)
-    template_path = current_dir / "templates" / "datasites.html"
-    html = ""
-    with open(template_path) as f:
-        html = f.read()
-    template = Template(html)
-
-    html_content = template.render(
-        {
-            "request": request,
-            "files": files,
-            "current_path": "/",
-        }
+async def list_datasites(
+    request: Request,
+    file_store: AsyncFileStore = Depends(get_file_store),
+    listing_cache: ListingCache = Depends(get_listing_cache),
+):
+    return await render_listing(
+        request,
+        file_store,
+        listing_cache,
+        directory=file_store.server_settings.snapshot_folder,
+        datasite=None,
+        context={"request": request, "current_path": "/"},
     )
-    return html_content
+
+
+# media types of files in the datasite browser, other files are downloaded
+BROWSER_MEDIA_TYPES = {
+    ".html": "text/html",
+    ".htm": "text/html",
+    ".md": "text/plain",
+    ".json": "application/json",
+    ".jsonl": "application/json",
+    ".yaml": "application/x-yaml",
+    ".yml": "application/x-yaml",
+    ".log": "text/plain",
+    ".txt": "text/plain",
+    ".py": "text/plain",
+}
 
 
 @app.get("/datasites/{path:path}", response_class=HTMLResponse)
 async def browse_datasite(
     request: Request,
     path: str,
-    server_settings: ServerSettings = Depends(get_server_settings),
+    file_store: AsyncFileStore = Depends(get_file_store),
+    listing_cache: ListingCache = Depends(get_listing_cache),
 ):
     if path == "":  # Check if path is empty (meaning "/datasites/")
         return RedirectResponse(url="/datasites")
 
-    snapshot_folder = str(server_settings.snapshot_folder)
+    snapshot_folder = str(file_store.server_settings.snapshot_folder)
     datasite_part = path.split("/")[0]
-    datasites = get_datasites(snapshot_folder)
-    if datasite_part in datasites:
+    datasite_path = os.path.join(snapshot_folder, datasite_part)
+    if "@" in datasite_part and os.path.isdir(datasite_path):
         slug = path[len(datasite_part) :]
         if slug == "":
             slug = "/"
-        datasite_path = os.path.join(snapshot_folder, datasite_part)
         datasite_public = datasite_path + "/public"
         if not os.path.exists(datasite_public):
             return "No public datasite"
 
         slug_path = os.path.abspath(datasite_public + slug)
-        if os.path.exists(slug_path) and os.path.isfile(slug_path):
-            if slug_path.endswith(".html") or slug_path.endswith(".htm"):
-                return FileResponse(slug_path)
-            elif slug_path.endswith(".md"):
-                with open(slug_path, "r") as file:
-                    content = file.read()
-                return PlainTextResponse(content)
-            elif slug_path.endswith(".json") or slug_path.endswith(".jsonl"):
-                return FileResponse(slug_path, media_type="application/json")
-            elif slug_path.endswith(".yaml") or slug_path.endswith(".yml"):
-                return FileResponse(slug_path, media_type="application/x-yaml")
-            elif slug_path.endswith(".log") or slug_path.endswith(".txt"):
-                return FileResponse(slug_path, media_type="text/plain")
-            elif slug_path.endswith(".py"):
-                return FileResponse(slug_path, media_type="text/plain")
-            else:
-                return FileResponse(slug_path, media_type="application/octet-stream")
+        if slug_path != datasite_public and not slug_path.startswith(datasite_public + "/"):
+            return HTMLResponse(content=f"No file or directory found at /datasites/{path}", status_code=404)
+
+        if os.path.isfile(slug_path):
+            media_type = BROWSER_MEDIA_TYPES.get(os.path.splitext(slug_path)[1], "application/octet-stream")
+            return browser.file_response(request, slug_path, media_type=media_type)
 
         # show directory
         if not path.endswith("/") and os.path.exists(path + "/") and os.path.isdir(path + "/"):
@@ -290,26 +412,17 @@ async def browse_datasite(
 
         index_file = os.path.abspath(slug_path + "/" + "index.html")
         if os.path.exists(index_file):
-            with open(index_file, "r") as file:
-                html_content = file.read()
-            return HTMLResponse(content=html_content, status_code=200)
+            return browser.file_response(request, index_file, media_type="text/html")
 
         if os.path.isdir(slug_path):
-            files = get_file_list(slug_path)
-            template_path = current_dir / "templates" / "folder.html"
-            html = ""
-            with open(template_path) as f:
-                html = f.read()
-            template = Template(html)
-            html_content = template.render(
-                {
-                    "datasite": datasite_part,
-                    "request": request,
-                    "files": files,
-                    "current_path": path,
-                }
+            return await render_listing(
+                request,
+                file_store,
+                listing_cache,
+                directory=Path(slug_path),
+                datasite=datasite_part,
+                context={"datasite": datasite_part, "request": request, "current_path": path},
             )
-            return html_content
         else:
             # return 404
             message_404 = f"No file or directory found at /datasites/{datasite_part}{slug}"
@@ -323,6 +436,7 @@ async def register(
     request: Request,
     users: Users = Depends(get_users),
     server_settings: ServerSettings = Depends(get_server_settings),
+    analytics_queue: AnalyticsQueue = Depends(get_analytics_queue),
 ):
     data = await request.json()
     email = data["email"]
@@ -333,15 +447,19 @@ async def register(
     os.makedirs(datasite_folder, exist_ok=True)
 
     logger.info(f"> {email} registering: {token}, snapshot folder: {datasite_folder}")
-    log_analytics_event("/register", email)
+    analytics_queue.submit("/register", email)
 
     return JSONResponse({"status": "success", "token": token}, status_code=200)
 
 
 @app.post("/log_event")
-async def log_event(request: Request, email: Optional[str] = Header(default=None)):
+async def log_event(
+    request: Request,
+    email: Optional[str] = Header(default=None),
+    analytics_queue: AnalyticsQueue = Depends(get_analytics_queue),
+):
     data = await request.json()
-    log_analytics_event("/log_event", email, **data)
+    analytics_queue.submit("/log_event", email, **data)
     return JSONResponse({"status": "success"}, status_code=200)
 
 
@@ -362,3 +480,8 @@ async def info():
     return {
         "version": __version__,
     }
+
+
+@app.get("/metrics")
+async def metrics(server_metrics: ServerMetrics = Depends(get_metrics)):
+    return Response(server_metrics.render(), media_type=CONTENT_TYPE)
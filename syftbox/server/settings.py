@@ -38,6 +38,87 @@ class ServerSettings(BaseSettings):
     jwt_algorithm: str = "HS256"
     auth_enabled: bool = False
 
+    jwt_cache_size: int = Field(default=10_000, ge=0)
+    """Number of validated access tokens that are cached, so their signature is verified once. 0 disables the cache"""
+
+    cpu_workers: int = Field(default=4, ge=1)
+    """Number of workers for CPU-heavy sync operations, like rsync diffs"""
+
+    cpu_queue_size: int = Field(default=32, ge=0)
+    """Number of CPU-heavy operations that can wait for a worker, before requests are rejected with a 503"""
+
+    cpu_use_processes: bool = False
+    """Run CPU-heavy sync operations in a process pool instead of a thread pool"""
+
+    io_threads: int = Field(default=64, ge=1)
+    """Number of threads for blocking database and file I/O of the async sync routes"""
+
+    version_history_size: int = Field(default=3, ge=0)
+    """Number of previous versions kept per file, to serve deltas between versions. 0 disables the history"""
+
+    version_max_file_size: int = Field(default=16 * 1024 * 1024, ge=0)
+    """Maximum size in bytes of a previous version to keep in the history, versions of larger files are dropped"""
+
+    delta_cache_size: int = Field(default=64 * 1024 * 1024, ge=0)
+    """Maximum size in bytes of the cache of computed deltas between versions"""
+
+    content_cache_size: int = Field(default=256 * 1024 * 1024, ge=0)
+    """Maximum size in bytes of the in-memory cache of file contents. 0 disables the cache"""
+
+    content_cache_max_object_size: int = Field(default=16 * 1024 * 1024, ge=0)
+    """Files larger than this are always read from disk"""
+
+    read_cache_ttl: float = Field(default=1.0, ge=0)
+    """Seconds that listings are shared between identical requests, to absorb bursts of polling clients"""
+
+    browser_cache_size: int = Field(default=1000, ge=0)
+    """Number of rendered directory listings of the datasite browser that are cached. 0 disables the cache"""
+
+    max_decompressed_request_size: int = Field(default=128 * 1024 * 1024, ge=0)
+    """Maximum size in bytes of a compressed request body after decompression, larger requests get a 413"""
+
+    rate_limit_requests_per_second: float = Field(default=0.0, ge=0)
+    """Sustained number of sync requests per second per user, e.g. 20. 0 disables the request limit"""
+
+    rate_limit_request_burst: int = Field(default=200, ge=1)
+    """Number of sync requests a user can make at once before being rate limited"""
+
+    rate_limit_bytes_per_second: float = Field(default=0.0, ge=0)
+    """Sustained sync bytes per second per user, e.g. 20 MiB. 0 disables the byte limit"""
+
+    rate_limit_bytes_burst: int = Field(default=200 * 1024 * 1024, ge=1)
+    """Number of bytes a user can transfer at once before being rate limited"""
+
+    analytics_queue_size: int = Field(default=10_000, ge=1)
+    """Maximum number of analytics events waiting to be written, further events are dropped"""
+
+    analytics_batch_size: int = Field(default=500, ge=1)
+    """Maximum number of analytics events written at once by the analytics worker"""
+
+    analytics_sample_rates: dict[str, float] = Field(default_factory=lambda: {"/auth/whoami": 0.1})
+    """Fraction of events that is logged per endpoint, for high-volume events. Other endpoints are always logged"""
+
+    mirror_emails: list[str] = Field(default_factory=list)
+    """Accounts of mirror servers. They can list all files, to replicate them, and are not rate limited"""
+
+    mirror_upstream: Optional[str] = None
+    """URL of the upstream server. If set, this server runs as a read-only mirror of the upstream"""
+
+    mirror_token: Optional[SecretStr] = None
+    """Access token of the mirror account on the upstream server, which should be in its mirror_emails"""
+
+    mirror_interval: float = Field(default=5.0, gt=0)
+    """Seconds between polls of the upstream server for changes"""
+
+    admin_emails: list[str] = Field(default_factory=list)
+    """Accounts that can use the admin routes, e.g. the database query statistics"""
+
+    db_query_stats: bool = False
+    """Record the time, rows and VM steps of every statement on the file metadata database, slows down queries"""
+
+    db_slow_query_ms: float = Field(default=100.0, ge=0)
+    """With db_query_stats, statements that take longer are logged. 0 disables the slow query log"""
+
     @field_validator("data_folder", mode="after")
     def data_folder_abs(cls, v):
         return Path(v).expanduser().resolve()
@@ -65,7 +146,7 @@ class ServerSettings(BaseSettings):
 
     @property
     def folders(self) -> list[Path]:
-        return [self.data_folder, self.snapshot_folder]
+        return [self.data_folder, self.snapshot_folder, self.versions_folder]
 
     @property
     def snapshot_folder(self) -> Path:
@@ -75,10 +156,19 @@ class ServerSettings(BaseSettings):
     def logs_folder(self) -> Path:
         return self.data_folder / "logs"
 
+    @property
+    def versions_folder(self) -> Path:
+        return self.data_folder / "versions"
+
     @property
     def user_file_path(self) -> Path:
+        """users.json of previous server versions, migrated to user_db_path on startup"""
         return self.data_folder / "users.json"
 
+    @property
+    def user_db_path(self) -> Path:
+        return self.data_folder / "users.db"
+
     @classmethod
     def from_data_folder(cls, data_folder: Union[Path, str]) -> Self:
         data_folder = Path(data_folder)
@@ -86,6 +176,14 @@ class ServerSettings(BaseSettings):
             data_folder=data_folder,
         )
 
+    @property
+    def analytics_db_path(self) -> Path:
+        return self.data_folder / "analytics.db"
+
+    @property
+    def mirror_lock_path(self) -> Path:
+        return self.data_folder / "mirror.lock"
+
     @property
     def file_db_path(self) -> Path:
         return self.data_folder / "file.db"
@@ -95,5 +193,5 @@ class ServerSettings(BaseSettings):
             return f.read()
 
 
-def get_server_settings(request: Request) -> ServerSettings:
+async def get_server_settings(request: Request) -> ServerSettings:
     return request.state.server_settings
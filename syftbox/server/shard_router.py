@@ -0,0 +1,221 @@
+"""
+Sharded deployment: datasites are spread over several server processes by consistent hashing.
+
+Each shard is a regular SyftBox server with its own data folder, and therefore its own snapshot folder and
+database. The shard router is a thin front-end that forwards each `/sync/*` request to the shard that owns
+the datasite of the request, and fans out requests that span datasites:
+
+- `/sync/datasite_states` and `/sync/datasites` are sent to all shards, and the results are merged
+- `/sync/download_bulk` is split by shard, and the zip archives are merged
+
+Other requests (registration, auth, emails, ...) are sent to the first shard. Access tokens are JWTs,
+so all shards should share the same `jwt_secret` to accept each other's tokens.
+
+Shards are assigned with a hash ring of virtual nodes, so adding a shard only moves the datasites of its
+neighbours on the ring. Moving existing datasites between shards is not handled by the router.
+
+Running locally with two shards:
+
+    SYFTBOX_DATA_FOLDER=data/shard0 syftbox server -p 5002
+    SYFTBOX_DATA_FOLDER=data/shard1 syftbox server -p 5003
+    syftbox server shard-router -p 5001 --shard http://localhost:5002 --shard http://localhost:5003
+"""
+
+import asyncio
+import bisect
+import hashlib
+import json
+import zipfile
+from io import BytesIO
+from typing import Any, Optional
+
+import httpx
+from fastapi import FastAPI, HTTPException, Request, Response
+from loguru import logger
+
+from syftbox.lib import compression
+from syftbox.server import proxy
+from syftbox.server.sync import columnar
+from syftbox.server.sync.models import COLUMNAR_MEDIA_TYPE, DATASITE_ETAGS_HEADER
+
+VIRTUAL_NODES = 128
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.sha256(key.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    """Consistent hash ring that assigns keys to shards."""
+
+    def __init__(self, shards: list[str], virtual_nodes: int = VIRTUAL_NODES) -> None:
+        if not shards:
+            raise ValueError("at least one shard is required")
+        self.shards = shards
+        points = sorted((_hash(f"{shard}#{i}"), shard) for shard in shards for i in range(virtual_nodes))
+        self._points = [point for point, _ in points]
+        self._shards = [shard for _, shard in points]
+
+    def get_shard(self, key: str) -> str:
+        index = bisect.bisect(self._points, _hash(key)) % len(self._points)
+        return self._shards[index]
+
+
+class ShardRouter:
+    def __init__(
+        self,
+        shards: list[str],
+        clients: dict[str, httpx.AsyncClient],
+        max_decompressed_size: int = compression.MAX_DECOMPRESSED_SIZE,
+    ) -> None:
+        self.ring = HashRing(shards)
+        self.shards = shards
+        self.clients = clients
+        self.max_decompressed_size = max_decompressed_size
+
+    @property
+    def primary(self) -> str:
+        return self.shards[0]
+
+    async def aclose(self) -> None:
+        await asyncio.gather(*(client.aclose() for client in self.clients.values()))
+
+    async def _datasite_of_request(self, request: Request, body: bytes) -> Optional[str]:
+        """The datasite a request is about, or None if it should go to the primary shard."""
+        path = await proxy.path_of_request(request, body, self.max_decompressed_size)
+        return proxy.datasite_of(path) if path is not None else None
+
+    async def forward(self, request: Request) -> Response:
+        body = await request.body()
+        datasite = await self._datasite_of_request(request, body)
+        shard = self.ring.get_shard(datasite) if datasite is not None else self.primary
+        return proxy.stream_response(await proxy.send(self.clients[shard], request, body))
+
+    async def _post_all(self, request: Request, path: str, **kwargs) -> dict[str, httpx.Response]:
+        headers = {"Authorization": request.headers.get("authorization", "")}
+        headers.update(kwargs.pop("headers", {}))
+        responses = await asyncio.gather(
+            *(
+                self.clients[shard].post(path, params=request.query_params, headers=headers, **kwargs)
+                for shard in self.shards
+            )
+        )
+        return dict(zip(self.shards, responses))
+
+    @staticmethod
+    def _raise_for_status(responses: dict[str, httpx.Response]) -> None:
+        for shard, response in responses.items():
+            if response.status_code not in (200, 304):
+                logger.error(f"Shard {shard} returned {response.status_code}: {response.text}")
+                raise HTTPException(status_code=response.status_code, detail=response.text)
+
+    async def datasite_states(self, request: Request) -> Response:
+        headers = {}
+        if "if-none-match" in request.headers:
+            headers["If-None-Match"] = request.headers["if-none-match"]
+        # shards always respond with JSON, the merged result is encoded here
+        responses = await self._post_all(request, "/sync/datasite_states", headers=headers)
+        self._raise_for_status(responses)
+
+        datasite_states: dict[str, Optional[list[dict[str, Any]]]] = {}
+        changed_etags: dict[str, str] = {}
+        for response in responses.values():
+            if response.status_code == 304:
+                continue
+            datasite_states.update(response.json())
+            changed_etags.update(json.loads(response.headers.get(DATASITE_ETAGS_HEADER, "{}")))
+
+        if not changed_etags and all(state is None for state in datasite_states.values()):
+            return Response(status_code=304)
+
+        response_headers = {DATASITE_ETAGS_HEADER: json.dumps(changed_etags), "Vary": "Accept"}
+        if COLUMNAR_MEDIA_TYPE in request.headers.get("accept", ""):
+            try:
+                content = columnar.encode_datasite_states(datasite_states)
+                return Response(content=content, media_type=COLUMNAR_MEDIA_TYPE, headers=response_headers)
+            except columnar.ColumnarEncodeError as e:
+                logger.warning(f"Falling back to JSON for datasite states: {e}")
+        content = json.dumps(datasite_states, separators=(",", ":")).encode()
+        return Response(content=content, media_type="application/json", headers=response_headers)
+
+    async def datasites(self, request: Request) -> Response:
+        responses = await self._post_all(request, "/sync/datasites")
+        self._raise_for_status(responses)
+        datasites = sorted({datasite for response in responses.values() for datasite in response.json()})
+        return Response(content=json.dumps(datasites), media_type="application/json")
+
+    async def download_bulk(self, request: Request) -> Response:
+        body = proxy.decode_body(
+            await request.body(), request.headers.get("content-encoding"), self.max_decompressed_size
+        )
+        try:
+            paths = json.loads(body)["paths"]
+            paths_by_shard: dict[str, list[str]] = {}
+            for path in paths:
+                paths_by_shard.setdefault(self.ring.get_shard(proxy.datasite_of(path)), []).append(path)
+        except (ValueError, KeyError, TypeError):
+            raise HTTPException(status_code=422, detail="invalid request")
+
+        headers = {"Authorization": request.headers.get("authorization", "")}
+        shards = list(paths_by_shard)
+        responses = await asyncio.gather(
+            *(
+                self.clients[shard].post("/sync/download_bulk", json={"paths": paths_by_shard[shard]}, headers=headers)
+                for shard in shards
+            )
+        )
+        self._raise_for_status(dict(zip(shards, responses)))
+
+        memory_file = BytesIO()
+        with zipfile.ZipFile(memory_file, "w") as merged:
+            for response in responses:
+                with zipfile.ZipFile(BytesIO(response.content)) as zf:
+                    for name in zf.namelist():
+                        merged.writestr(name, zf.read(name))
+        return Response(content=memory_file.getvalue(), media_type="application/zip")
+
+
+def create_shard_router_app(
+    shards: list[str],
+    transports: Optional[dict[str, httpx.AsyncBaseTransport]] = None,
+    timeout: float = 60.0,
+    max_decompressed_size: int = compression.MAX_DECOMPRESSED_SIZE,
+) -> FastAPI:
+    """
+    Create the front-end app for a sharded deployment.
+
+    Args:
+        shards: base URLs of the shard servers. The order matters, the first shard also serves non-sync requests.
+        transports: optional httpx transport per shard URL, e.g. an ASGI transport for testing.
+        timeout: timeout in seconds for requests to the shards.
+        max_decompressed_size: maximum size in bytes of a compressed request body after decompression.
+    """
+    transports = transports or {}
+    clients = {
+        shard: httpx.AsyncClient(base_url=shard, transport=transports.get(shard), timeout=timeout) for shard in shards
+    }
+    shard_router = ShardRouter(shards, clients, max_decompressed_size)
+
+    async def lifespan(app: FastAPI):
+        yield {"shard_router": shard_router}
+        await shard_router.aclose()
+
+    app = FastAPI(lifespan=lifespan)
+
+    @app.post("/sync/datasite_states")
+    async def datasite_states(request: Request) -> Response:
+        return await shard_router.datasite_states(request)
+
+    @app.post("/sync/datasites")
+    async def datasites(request: Request) -> Response:
+        return await shard_router.datasites(request)
+
+    @app.post("/sync/download_bulk")
+    async def download_bulk(request: Request) -> Response:
+        return await shard_router.download_bulk(request)
+
+    @app.api_route("/{path:path}", methods=["GET", "POST", "PUT", "PATCH", "DELETE", "HEAD", "OPTIONS"])
+    async def forward(request: Request) -> Response:
+        return await shard_router.forward(request)
+
+    return app
@@ -0,0 +1,81 @@
+"""
+Startup tasks that should run once per server run, when the server is started with multiple workers.
+
+`syftbox server --workers N` starts N uvicorn workers, and each one runs the lifespan of the app.
+Reconciling the database with the snapshot folder is slow and writes to the database, so it should run once.
+The CLI sets a run id in the environment, which is inherited by all workers. The first worker to take the
+startup lock runs the startup tasks and writes the run id to a marker file, the other workers wait for the lock
+and skip the tasks.
+
+Without a run id (e.g. when the app is started directly with uvicorn), the startup tasks run in every worker,
+one worker at a time.
+"""
+
+import contextlib
+import json
+import os
+import time
+from pathlib import Path
+from typing import Callable, Iterator, Optional
+
+from loguru import logger
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    # Windows
+    fcntl = None
+
+RUN_ID_ENV = "SYFTBOX_SERVER_RUN_ID"
+STARTUP_LOCK_FILE = "startup.lock"
+STARTUP_MARKER_FILE = "startup.json"
+
+
+@contextlib.contextmanager
+def file_lock(path: Path, blocking: bool = True) -> Iterator[bool]:
+    """
+    Exclusive lock on path between processes. Yields whether the lock was acquired.
+    If blocking is set, waits until the lock is acquired, otherwise yields False if another process holds it.
+    """
+    with open(path, "a") as f:
+        if fcntl is None:
+            logger.warning("File locks are not supported on this platform, startup is not multi-worker safe")
+            yield True
+            return
+        flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+        try:
+            fcntl.flock(f.fileno(), flags)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def _read_run_id(marker_path: Path) -> Optional[str]:
+    try:
+        return json.loads(marker_path.read_text())["run_id"]
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def run_once(data_folder: Path, fn: Callable[[], None]) -> bool:
+    """
+    Run fn once for all workers of this server run. Returns True if fn was run by this process.
+    """
+    run_id = os.environ.get(RUN_ID_ENV)
+    marker_path = data_folder / STARTUP_MARKER_FILE
+
+    with file_lock(data_folder / STARTUP_LOCK_FILE):
+        if run_id is not None and _read_run_id(marker_path) == run_id:
+            logger.info(f"> Startup tasks already completed by another worker (run {run_id})")
+            return False
+
+        fn()
+
+        if run_id is not None:
+            marker = {"run_id": run_id, "pid": os.getpid(), "completed_at": time.time()}
+            marker_path.write_text(json.dumps(marker))
+        return True
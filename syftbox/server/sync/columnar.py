@@ -0,0 +1,198 @@
+"""
+Compact columnar encoding for datasite listings, negotiated with `Accept: application/vnd.syftbox.columnar`.
+
+A response maps datasites to an optional list of file metadata, like the JSON response of `/sync/datasite_states`.
+Each list is sorted by path and stored as parallel columns:
+
+- path: front-coded against the previous path, as (shared prefix length, suffix length, suffix)
+- hash: raw 32-byte sha256 digests
+- signature: length-prefixed utf-8 strings
+- file_size: unsigned varints
+- last_modified: zigzag varints of the difference in microseconds with the previous row
+
+All integers are LEB128 varints. Strings are utf-8 and length-prefixed.
+"""
+
+from datetime import datetime, timedelta, timezone
+from typing import Any, Optional
+
+MAGIC = b"SBC1"
+HASH_SIZE = 32
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+class ColumnarEncodeError(ValueError):
+    pass
+
+
+def _write_varint(buf: bytearray, value: int) -> None:
+    while value > 0x7F:
+        buf.append((value & 0x7F) | 0x80)
+        value >>= 7
+    buf.append(value)
+
+
+def _read_varint(data: bytes, pos: int) -> tuple[int, int]:
+    result = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def _write_bytes(buf: bytearray, value: bytes) -> None:
+    _write_varint(buf, len(value))
+    buf += value
+
+
+def _read_bytes(data: bytes, pos: int) -> tuple[bytes, int]:
+    length, pos = _read_varint(data, pos)
+    return data[pos : pos + length], pos + length
+
+
+def _zigzag(value: int) -> int:
+    return value * 2 if value >= 0 else -value * 2 - 1
+
+
+def _unzigzag(value: int) -> int:
+    return value >> 1 if value % 2 == 0 else -((value + 1) >> 1)
+
+
+def _common_prefix_length(a: bytes, b: bytes) -> int:
+    # binary search on slices, which compares in C instead of byte by byte in Python
+    low, high = 0, min(len(a), len(b))
+    while low < high:
+        mid = (low + high + 1) // 2
+        if a[:mid] == b[:mid]:
+            low = mid
+        else:
+            high = mid - 1
+    return low
+
+
+def _to_micros(last_modified: Any) -> int:
+    if isinstance(last_modified, str):
+        last_modified = datetime.fromisoformat(last_modified)
+    if last_modified.tzinfo is None:
+        last_modified = last_modified.replace(tzinfo=timezone.utc)
+    delta = last_modified - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1_000_000 + delta.microseconds
+
+
+def _encode_metadata_list(buf: bytearray, rows: list[dict[str, Any]]) -> None:
+    rows = sorted(rows, key=lambda row: row["path"])
+    _write_varint(buf, len(rows))
+
+    previous_path = b""
+    for row in rows:
+        path = row["path"].encode()
+        prefix_length = _common_prefix_length(previous_path, path)
+        _write_varint(buf, prefix_length)
+        _write_bytes(buf, path[prefix_length:])
+        previous_path = path
+
+    for row in rows:
+        try:
+            digest = bytes.fromhex(row["hash"])
+        except ValueError:
+            digest = b""
+        if len(digest) != HASH_SIZE:
+            raise ColumnarEncodeError(f"hash of {row['path']} is not a sha256 hex digest")
+        buf += digest
+
+    for row in rows:
+        _write_bytes(buf, row["signature"].encode())
+
+    for row in rows:
+        _write_varint(buf, row["file_size"])
+
+    previous_micros = 0
+    for row in rows:
+        micros = _to_micros(row["last_modified"])
+        _write_varint(buf, _zigzag(micros - previous_micros))
+        previous_micros = micros
+
+
+def encode_datasite_states(datasite_states: dict[str, Optional[list[dict[str, Any]]]]) -> bytes:
+    """
+    Encode datasite states, where each file is a dict with the fields of FileMetadata in their JSON representation.
+
+    Raises:
+        ColumnarEncodeError: if a file cannot be represented, e.g. its hash is not a sha256 digest.
+            The caller should fall back to JSON.
+    """
+    buf = bytearray(MAGIC)
+    _write_varint(buf, len(datasite_states))
+    for datasite, rows in datasite_states.items():
+        _write_bytes(buf, datasite.encode())
+        if rows is None:
+            buf.append(0)
+            continue
+        buf.append(1)
+        _encode_metadata_list(buf, rows)
+    return bytes(buf)
+
+
+def _decode_metadata_list(data: bytes, pos: int) -> tuple[list[dict[str, Any]], int]:
+    n_rows, pos = _read_varint(data, pos)
+
+    paths = []
+    previous_path = b""
+    for _ in range(n_rows):
+        prefix_length, pos = _read_varint(data, pos)
+        suffix, pos = _read_bytes(data, pos)
+        previous_path = previous_path[:prefix_length] + suffix
+        paths.append(previous_path.decode())
+
+    hashes_hex = data[pos : pos + n_rows * HASH_SIZE].hex()
+    pos += n_rows * HASH_SIZE
+    step = HASH_SIZE * 2
+
+    signatures = []
+    for _ in range(n_rows):
+        signature, pos = _read_bytes(data, pos)
+        signatures.append(signature.decode())
+
+    file_sizes = []
+    for _ in range(n_rows):
+        file_size, pos = _read_varint(data, pos)
+        file_sizes.append(file_size)
+
+    rows = []
+    micros = 0
+    for i in range(n_rows):
+        delta, pos = _read_varint(data, pos)
+        micros += _unzigzag(delta)
+        rows.append(
+            {
+                "path": paths[i],
+                "hash": hashes_hex[i * step : (i + 1) * step],
+                "signature": signatures[i],
+                "file_size": file_sizes[i],
+                "last_modified": EPOCH + timedelta(microseconds=micros),
+            }
+        )
+    return rows, pos
+
+
+def decode_datasite_states(data: bytes) -> dict[str, Optional[list[dict[str, Any]]]]:
+    """Decode datasite states encoded with `encode_datasite_states`, files are returned as dicts."""
+    if not data.startswith(MAGIC):
+        raise ValueError("not a columnar datasite listing")
+
+    pos = len(MAGIC)
+    n_datasites, pos = _read_varint(data, pos)
+    datasite_states: dict[str, Optional[list[dict[str, Any]]]] = {}
+    for _ in range(n_datasites):
+        datasite, pos = _read_bytes(data, pos)
+        has_rows = data[pos]
+        pos += 1
+        if has_rows:
+            datasite_states[datasite.decode()], pos = _decode_metadata_list(data, pos)
+        else:
+            datasite_states[datasite.decode()] = None
+    return datasite_states
@@ -0,0 +1,79 @@
+"""
+In-memory cache of file contents, keyed by sha256 content hash.
+
+Popular files are downloaded by every client that subscribes to them. The FileStore keeps the
+contents of recently read or written files in memory, so they are only read from disk once.
+Entries are keyed by content hash, so a cached entry can never be stale: a changed file has a new hash.
+"""
+
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+from fastapi import Request
+
+
+@dataclass
+class ContentCacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+    @property
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class ContentCache:
+    def __init__(self, max_bytes: int, max_object_size: int) -> None:
+        self.max_bytes = max_bytes
+        self.max_object_size = min(max_object_size, max_bytes)
+        self.size = 0
+        self.stats = ContentCacheStats()
+        self._contents: OrderedDict[str, bytes] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._contents)
+
+    def __contains__(self, file_hash: str) -> bool:
+        return file_hash in self._contents
+
+    def fits(self, file_size: int) -> bool:
+        return file_size <= self.max_object_size
+
+    def get(self, file_hash: str) -> Optional[bytes]:
+        with self._lock:
+            data = self._contents.get(file_hash)
+            if data is None:
+                self.stats.misses += 1
+                return None
+            self._contents.move_to_end(file_hash)
+            self.stats.hits += 1
+            return data
+
+    def put(self, file_hash: str, data: bytes) -> None:
+        if not self.fits(len(data)):
+            return
+        with self._lock:
+            previous = self._contents.pop(file_hash, None)
+            if previous is not None:
+                self.size -= len(previous)
+            self._contents[file_hash] = data
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                _, evicted = self._contents.popitem(last=False)
+                self.size -= len(evicted)
+                self.stats.evictions += 1
+
+    def invalidate(self, file_hash: str) -> None:
+        with self._lock:
+            data = self._contents.pop(file_hash, None)
+            if data is not None:
+                self.size -= len(data)
+
+
+async def get_content_cache(request: Request) -> ContentCache:
+    return request.state.content_cache
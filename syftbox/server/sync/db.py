@@ -3,15 +3,20 @@ import shutil
 import sqlite3
 import tempfile
 from pathlib import Path
-from typing import Optional
+from typing import Any, Optional
 
+from syftbox.lib.constants import PERM_FILE
+from syftbox.lib.lib import USER_GROUP_GLOBAL, SyftPermission
 from syftbox.server.settings import ServerSettings
+from syftbox.server.sync import merkle
 from syftbox.server.sync.models import FileMetadata
+from syftbox.server.sync.query_stats import QUERY_STATS, InstrumentedConnection
 
 
 # @contextlib.contextmanager
 def get_db(path: str):
-    conn = sqlite3.connect(path, check_same_thread=False)
+    factory = InstrumentedConnection if QUERY_STATS.enabled else sqlite3.Connection
+    conn = sqlite3.connect(path, check_same_thread=False, factory=factory)
 
     with conn:
         conn.execute("PRAGMA cache_size=10000;")
@@ -28,10 +33,252 @@ def get_db(path: str):
             file_size INTEGER NOT NULL,
             last_modified TEXT NOT NULL        )
         """)
+        existing_tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+        if "datasite_state" not in existing_tables:
+            _create_datasite_state(conn)
+        if "server_meta" not in existing_tables:
+            _create_server_meta(conn)
+        if "dir_digest" not in existing_tables:
+            _create_dir_digest(conn)
+        if "permission_state" not in existing_tables:
+            _create_permission_state(conn)
+        if "acl_scope" not in existing_tables:
+            _create_acl(conn)
+        elif "parent" not in {row[1] for row in conn.execute("PRAGMA table_info(acl_scope)")}:
+            _add_acl_scope_tree(conn)
+        if "file_version" not in existing_tables:
+            _create_file_version(conn)
     return conn
 
 
+def _create_datasite_state(conn: sqlite3.Connection):
+    """
+    datasite_state keeps a version per datasite, which is bumped by triggers on every write to file_metadata.
+    This allows checking if a datasite has changed without querying file_metadata.
+    """
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS datasite_state (
+        datasite TEXT PRIMARY KEY,
+        version INTEGER NOT NULL DEFAULT 0,
+        file_count INTEGER NOT NULL DEFAULT 0
+    )
+    """)
+    conn.execute("""
+    CREATE TRIGGER IF NOT EXISTS file_metadata_after_insert AFTER INSERT ON file_metadata
+    WHEN INSTR(NEW.path, '/') > 0
+    BEGIN
+        INSERT INTO datasite_state (datasite, version, file_count)
+        VALUES (SUBSTR(NEW.path, 1, INSTR(NEW.path, '/') - 1), 1, 1)
+        ON CONFLICT(datasite) DO UPDATE SET version = version + 1, file_count = file_count + 1;
+    END
+    """)
+    conn.execute("""
+    CREATE TRIGGER IF NOT EXISTS file_metadata_after_update AFTER UPDATE ON file_metadata
+    WHEN INSTR(NEW.path, '/') > 0 AND (
+        OLD.hash IS NOT NEW.hash
+        OR OLD.file_size IS NOT NEW.file_size
+        OR OLD.last_modified IS NOT NEW.last_modified
+    )
+    BEGIN
+        UPDATE datasite_state SET version = version + 1
+        WHERE datasite = SUBSTR(NEW.path, 1, INSTR(NEW.path, '/') - 1);
+    END
+    """)
+    conn.execute("""
+    CREATE TRIGGER IF NOT EXISTS file_metadata_after_delete AFTER DELETE ON file_metadata
+    WHEN INSTR(OLD.path, '/') > 0
+    BEGIN
+        UPDATE datasite_state SET version = version + 1, file_count = file_count - 1
+        WHERE datasite = SUBSTR(OLD.path, 1, INSTR(OLD.path, '/') - 1);
+    END
+    """)
+    # backfill for databases created before datasite_state existed
+    conn.execute("""
+    INSERT OR IGNORE INTO datasite_state (datasite, version, file_count)
+    SELECT SUBSTR(path, 1, INSTR(path, '/') - 1), 1, COUNT(*)
+    FROM file_metadata
+    WHERE INSTR(path, '/') > 0
+    GROUP BY SUBSTR(path, 1, INSTR(path, '/') - 1)
+    """)
+
+
+def _create_permission_state(conn: sqlite3.Connection):
+    """
+    permission_state keeps a version per datasite, which is bumped by triggers on every write to a permission file.
+    This is used to invalidate cached permission trees, see `syftbox.server.sync.permissions`.
+    """
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS permission_state (
+        datasite TEXT PRIMARY KEY,
+        version INTEGER NOT NULL DEFAULT 0
+    )
+    """)
+    bump_version = """
+        INSERT INTO permission_state (datasite, version)
+        VALUES (SUBSTR({row}.path, 1, INSTR({row}.path, '/') - 1), 1)
+        ON CONFLICT(datasite) DO UPDATE SET version = version + 1;
+    """
+    conn.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS permission_file_after_insert AFTER INSERT ON file_metadata
+    WHEN INSTR(NEW.path, '/') > 0 AND NEW.path GLOB '*.syftperm'
+    BEGIN {bump_version.format(row="NEW")} END
+    """)
+    conn.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS permission_file_after_update AFTER UPDATE ON file_metadata
+    WHEN INSTR(NEW.path, '/') > 0 AND NEW.path GLOB '*.syftperm' AND OLD.hash IS NOT NEW.hash
+    BEGIN {bump_version.format(row="NEW")} END
+    """)
+    conn.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS permission_file_after_delete AFTER DELETE ON file_metadata
+    WHEN INSTR(OLD.path, '/') > 0 AND OLD.path GLOB '*.syftperm'
+    BEGIN {bump_version.format(row="OLD")} END
+    """)
+
+
+def _create_acl(conn: sqlite3.Connection):
+    """
+    acl_scope and acl_reader materialize the read permissions of all permission files, so listings can be
+    filtered in the query instead of in Python, see `get_readable_metadata`.
+
+    Every permission file defines a scope, the directory it is in with a trailing slash (e.g. "user@x.org/public/").
+    path_end is the exclusive upper bound of all paths starting with the scope, for range queries on the path index.
+    Readers include admins, and the GLOBAL group for public scopes.
+    parent is the nearest enclosing scope, and shadowed is set for scopes below a terminal scope, see
+    `_update_scope_tree`.
+    Rows are written in the same transaction as the permission file metadata, see `save_acl` and `delete_acl`.
+    Existing permission files are indexed on server startup with `rebuild_acl`.
+    """
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS acl_scope (
+        path TEXT PRIMARY KEY,
+        path_end TEXT NOT NULL,
+        datasite TEXT NOT NULL,
+        terminal INTEGER NOT NULL DEFAULT 0,
+        corrupted INTEGER NOT NULL DEFAULT 0,
+        parent TEXT,
+        shadowed INTEGER NOT NULL DEFAULT 0
+    )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS acl_scope_datasite ON acl_scope(datasite)")
+    conn.execute("CREATE INDEX IF NOT EXISTS acl_scope_parent ON acl_scope(parent, path)")
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS acl_reader (
+        principal TEXT NOT NULL,
+        scope TEXT NOT NULL,
+        PRIMARY KEY (principal, scope)
+    )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS acl_reader_scope ON acl_reader(scope)")
+
+
+def _add_acl_scope_tree(conn: sqlite3.Connection):
+    """Add the parent and shadowed columns to acl_scope tables created before they existed."""
+    conn.execute("ALTER TABLE acl_scope ADD COLUMN parent TEXT")
+    conn.execute("ALTER TABLE acl_scope ADD COLUMN shadowed INTEGER NOT NULL DEFAULT 0")
+    conn.execute("CREATE INDEX IF NOT EXISTS acl_scope_parent ON acl_scope(parent, path)")
+    _update_scope_tree(conn)
+
+
+def _create_file_version(conn: sqlite3.Connection):
+    """
+    file_version keeps the hashes of the previous versions of each file, newest last.
+    The contents are stored once per hash in the versions folder, see `FileStore.put`.
+    """
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS file_version (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        path TEXT NOT NULL,
+        hash TEXT NOT NULL
+    )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS file_version_path ON file_version(path)")
+    conn.execute("CREATE INDEX IF NOT EXISTS file_version_hash ON file_version(hash)")
+
+
+def _create_server_meta(conn: sqlite3.Connection):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS server_meta (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL
+    )
+    """)
+    # The epoch identifies this database, so versions are never reused if the database is recreated
+    conn.execute("INSERT OR IGNORE INTO server_meta (key, value) VALUES ('epoch', LOWER(HEX(RANDOMBLOB(8))))")
+
+
+def _create_dir_digest(conn: sqlite3.Connection):
+    """
+    dir_digest stores the digest of every directory that contains files, see `syftbox.server.sync.merkle`.
+    Digests are updated in save_file_metadata and delete_file_metadata.
+    """
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS dir_digest (
+        path TEXT PRIMARY KEY,
+        parent TEXT NOT NULL,
+        digest TEXT NOT NULL,
+        file_count INTEGER NOT NULL
+    )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS dir_digest_parent ON dir_digest(parent)")
+    # index on the parent directory of each file (including trailing slash), to list a single directory
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS file_metadata_parent_dir ON file_metadata(RTRIM(path, REPLACE(path, '/', '')))"
+    )
+
+    # backfill for databases created before dir_digest existed
+    digests: dict[str, int] = {}
+    file_counts: dict[str, int] = {}
+    for path, file_hash in conn.execute("SELECT path, hash FROM file_metadata"):
+        leaf = merkle.leaf_digest(path, file_hash)
+        for dir in merkle.ancestor_dirs(path):
+            digests[dir] = digests.get(dir, merkle.EMPTY_DIGEST) ^ leaf
+            file_counts[dir] = file_counts.get(dir, 0) + 1
+    conn.executemany(
+        "INSERT OR IGNORE INTO dir_digest (path, parent, digest, file_count) VALUES (?, ?, ?, ?)",
+        [
+            (dir, merkle.parent_dir(dir), merkle.digest_to_hex(digest), file_counts[dir])
+            for dir, digest in digests.items()
+        ],
+    )
+
+
+def _get_file_hash(conn: sqlite3.Connection, path: str) -> Optional[str]:
+    row = conn.execute("SELECT hash FROM file_metadata WHERE path = ?", (path,)).fetchone()
+    return row[0] if row else None
+
+
+def _update_dir_digests(conn: sqlite3.Connection, path: str, old_hash: Optional[str], new_hash: Optional[str]):
+    if old_hash == new_hash:
+        return
+
+    delta = merkle.EMPTY_DIGEST
+    if old_hash is not None:
+        delta ^= merkle.leaf_digest(path, old_hash)
+    if new_hash is not None:
+        delta ^= merkle.leaf_digest(path, new_hash)
+    count_delta = (new_hash is not None) - (old_hash is not None)
+
+    for dir in merkle.ancestor_dirs(path):
+        row = conn.execute("SELECT digest, file_count FROM dir_digest WHERE path = ?", (dir,)).fetchone()
+        digest, file_count = row if row else (None, 0)
+        file_count += count_delta
+        if file_count <= 0:
+            conn.execute("DELETE FROM dir_digest WHERE path = ?", (dir,))
+            continue
+        conn.execute(
+            """
+        INSERT INTO dir_digest (path, parent, digest, file_count)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(path) DO UPDATE SET
+            digest = excluded.digest,
+            file_count = excluded.file_count
+        """,
+            (dir, merkle.parent_dir(dir), merkle.update_digest(digest, delta), file_count),
+        )
+
+
 def save_file_metadata(conn: sqlite3.Connection, metadata: FileMetadata):
+    old_hash = _get_file_hash(conn, str(metadata.path))
     # Insert the metadata into the database or update if a conflict on 'path' occurs
     conn.execute(
         """
@@ -51,13 +298,239 @@ def save_file_metadata(conn: sqlite3.Connection, metadata: FileMetadata):
             metadata.last_modified.isoformat(),
         ),
     )
+    _update_dir_digests(conn, metadata.path.as_posix(), old_hash, metadata.hash)
 
 
 def delete_file_metadata(conn: sqlite3.Connection, path: str):
+    old_hash = _get_file_hash(conn, path)
     cur = conn.execute("DELETE FROM file_metadata WHERE path = ?", (path,))
     # get number of changes
     if cur.rowcount != 1:
         raise ValueError(f"Failed to delete metadata for {path}.")
+    _update_dir_digests(conn, path, old_hash, None)
+
+
+def _prefix_end(prefix: str) -> str:
+    """Exclusive upper bound of all strings starting with prefix, where prefix ends with a slash."""
+    # "0" is the character after "/"
+    return prefix[:-1] + "0"
+
+
+def _acl_scope(perm_file: str) -> str:
+    return merkle.parent_dir(perm_file) + "/"
+
+
+def _ancestor_scopes(scope: str) -> list[str]:
+    """All scopes that contain scope, outermost first."""
+    parts = scope.rstrip("/").split("/")
+    return ["/".join(parts[:i]) + "/" for i in range(1, len(parts))]
+
+
+def _update_scope_tree(conn: sqlite3.Connection, scope: Optional[str] = None):
+    """
+    Update the parent and shadowed columns of scope and all scopes below it, or of all scopes if scope is None.
+
+    Scopes are visited in path order, where every scope comes right after the scopes that contain it,
+    so the enclosing scopes of each scope are kept on a stack.
+    """
+    if scope is None:
+        stack = []
+        cursor = conn.execute("SELECT path, terminal FROM acl_scope ORDER BY path")
+    else:
+        stack = [
+            row
+            for ancestor in _ancestor_scopes(scope)
+            if (row := conn.execute("SELECT path, terminal FROM acl_scope WHERE path = ?", (ancestor,)).fetchone())
+        ]
+        cursor = conn.execute(
+            "SELECT path, terminal FROM acl_scope WHERE path >= ? AND path < ? ORDER BY path",
+            (scope, _prefix_end(scope)),
+        )
+
+    updates = []
+    for path, terminal in cursor.fetchall():
+        while stack and not path.startswith(stack[-1][0]):
+            stack.pop()
+        parent = stack[-1][0] if stack else None
+        shadowed = any(ancestor_terminal for _, ancestor_terminal in stack)
+        updates.append((parent, shadowed, path))
+        stack.append((path, terminal))
+    conn.executemany("UPDATE acl_scope SET parent = ?, shadowed = ? WHERE path = ?", updates)
+
+
+def _insert_acl(conn: sqlite3.Connection, perm_file: str, perm: Optional[SyftPermission]) -> str:
+    scope = _acl_scope(perm_file)
+    conn.execute("DELETE FROM acl_reader WHERE scope = ?", (scope,))
+    conn.execute(
+        """
+    INSERT INTO acl_scope (path, path_end, datasite, terminal, corrupted)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(path) DO UPDATE SET
+        terminal = excluded.terminal,
+        corrupted = excluded.corrupted
+    """,
+        (scope, _prefix_end(scope), scope.split("/")[0], perm is not None and perm.terminal, perm is None),
+    )
+    if perm is not None:
+        readers = set(perm.read) | set(perm.admin)
+        conn.executemany(
+            "INSERT INTO acl_reader (principal, scope) VALUES (?, ?)",
+            [(reader, scope) for reader in readers],
+        )
+    return scope
+
+
+def save_acl(conn: sqlite3.Connection, perm_file: str, perm: Optional[SyftPermission]):
+    """
+    Save the read permissions of the permission file at perm_file, relative to the snapshot folder.
+    If perm is None, the permission file could not be parsed and its scope is marked as corrupted.
+    """
+    scope = _insert_acl(conn, perm_file, perm)
+    _update_scope_tree(conn, scope)
+
+
+def delete_acl(conn: sqlite3.Connection, perm_file: str):
+    scope = _acl_scope(perm_file)
+    conn.execute("DELETE FROM acl_reader WHERE scope = ?", (scope,))
+    conn.execute("DELETE FROM acl_scope WHERE path = ?", (scope,))
+    _update_scope_tree(conn, scope)
+
+
+def load_permission(path_or_bytes) -> Optional[SyftPermission]:
+    try:
+        return SyftPermission.load(path_or_bytes)
+    except Exception:
+        return None
+
+
+def rebuild_acl(conn: sqlite3.Connection, snapshot_folder: Path):
+    """Rebuild the ACL tables from all permission files in file_metadata."""
+    conn.execute("DELETE FROM acl_reader")
+    conn.execute("DELETE FROM acl_scope")
+    cursor = conn.execute("SELECT path FROM file_metadata WHERE path GLOB ?", (f"*/{PERM_FILE}",))
+    perm_files = [row[0] for row in cursor]
+    for perm_file in perm_files:
+        _insert_acl(conn, perm_file, load_permission(snapshot_folder / perm_file))
+    _update_scope_tree(conn)
+
+
+def get_corrupted_permission_files(conn: sqlite3.Connection, datasite: str) -> list[str]:
+    cursor = conn.execute("SELECT path FROM acl_scope WHERE datasite = ? AND corrupted = 1", (datasite,))
+    return [row[0] + PERM_FILE for row in cursor]
+
+
+def _get_unreferenced_versions(conn: sqlite3.Connection, hashes: set[str]) -> list[str]:
+    return [
+        file_hash
+        for file_hash in hashes
+        if conn.execute("SELECT 1 FROM file_version WHERE hash = ? LIMIT 1", (file_hash,)).fetchone() is None
+    ]
+
+
+def add_file_version(conn: sqlite3.Connection, path: str, file_hash: str, max_versions: int) -> list[str]:
+    """
+    Add a previous version of path, and drop the oldest versions beyond max_versions.
+    Returns the hashes that are no longer referenced by any path, so their contents can be removed.
+    """
+    conn.execute("DELETE FROM file_version WHERE path = ? AND hash = ?", (path, file_hash))
+    conn.execute("INSERT INTO file_version (path, hash) VALUES (?, ?)", (path, file_hash))
+    cursor = conn.execute(
+        "SELECT id, hash FROM file_version WHERE path = ? ORDER BY id DESC LIMIT -1 OFFSET ?",
+        (path, max_versions),
+    )
+    dropped = cursor.fetchall()
+    conn.executemany("DELETE FROM file_version WHERE id = ?", [(row[0],) for row in dropped])
+    return _get_unreferenced_versions(conn, {row[1] for row in dropped})
+
+
+def delete_file_versions(conn: sqlite3.Connection, path: str) -> list[str]:
+    """Delete all previous versions of path, returns the hashes that are no longer referenced."""
+    hashes = {row[0] for row in conn.execute("SELECT hash FROM file_version WHERE path = ?", (path,))}
+    conn.execute("DELETE FROM file_version WHERE path = ?", (path,))
+    return _get_unreferenced_versions(conn, hashes)
+
+
+def has_file_version(conn: sqlite3.Connection, path: str, file_hash: str) -> bool:
+    cursor = conn.execute("SELECT 1 FROM file_version WHERE path = ? AND hash = ? LIMIT 1", (path, file_hash))
+    return cursor.fetchone() is not None
+
+
+def _row_to_metadata(row) -> FileMetadata:
+    return FileMetadata(
+        path=row[1],
+        hash=row[2],
+        signature=row[3],
+        file_size=row[4],
+        last_modified=row[5],
+    )
+
+
+def _row_to_dict(row) -> dict[str, Any]:
+    """Convert a file_metadata row to the JSON representation of FileMetadata, without validation."""
+    return {
+        "path": row[1],
+        "hash": row[2],
+        "signature": row[3],
+        "file_size": row[4],
+        "last_modified": row[5],
+    }
+
+
+def _readable_metadata_rows(conn: sqlite3.Connection, user_email: str, dir: str) -> sqlite3.Cursor:
+    """
+    Query the file_metadata rows of all files below dir that user_email can read, using the ACL tables.
+
+    Only scopes readable by the user are visited, so the cost scales with the number of readable files.
+    A file is governed by its deepest scope, unless an ancestor scope is terminal. Files outside of any scope
+    are not readable.
+
+    The direct child scopes of a scope do not overlap, so the only child scope that can contain a file is the
+    last one that starts before it. This finds the deeper scope of a file with one index lookup.
+    """
+    prefix = dir.rstrip("/") + "/"
+    return conn.execute(
+        """
+    SELECT f.* FROM (
+        SELECT DISTINCT scope FROM acl_reader WHERE principal IN (:email, :group)
+    ) AS r
+    JOIN acl_scope s ON s.path = r.scope
+    -- a single range, so the path index is searched with the bounds of the scope and not of dir
+    JOIN file_metadata f ON f.path >= MAX(s.path, :dir) AND f.path < MIN(s.path_end, :dir_end)
+    WHERE s.path < :dir_end AND s.path_end > :dir
+        -- scopes below a terminal scope do not apply
+        AND s.shadowed = 0
+        -- files in a deeper scope are governed by that scope
+        AND (s.terminal = 1 OR COALESCE((
+            SELECT d.path_end FROM acl_scope d
+            WHERE d.parent = s.path AND d.path <= f.path
+            ORDER BY d.path DESC LIMIT 1
+        ), '') <= f.path)
+    """,
+        {"email": user_email, "group": USER_GROUP_GLOBAL, "dir": prefix, "dir_end": _prefix_end(prefix)},
+    )
+
+
+def get_readable_metadata(conn: sqlite3.Connection, user_email: str, dir: str) -> list[FileMetadata]:
+    """Get the metadata of all files below dir that user_email can read."""
+    return [_row_to_metadata(row) for row in _readable_metadata_rows(conn, user_email, dir)]
+
+
+def get_readable_metadata_dicts(conn: sqlite3.Connection, user_email: str, dir: str) -> list[dict[str, Any]]:
+    """
+    Same as `get_readable_metadata`, but returns the rows as JSON-serializable dicts.
+    This skips building and validating a FileMetadata per row, for listings that are serialized as-is.
+    """
+    return [_row_to_dict(row) for row in _readable_metadata_rows(conn, user_email, dir)]
+
+
+def get_all_metadata_dicts(conn: sqlite3.Connection, dir: str) -> list[dict[str, Any]]:
+    """Get the metadata of all files below dir as JSON-serializable dicts, regardless of permissions."""
+    prefix = dir.rstrip("/") + "/"
+    cursor = conn.execute(
+        "SELECT * FROM file_metadata WHERE path >= ? AND path < ?",
+        (prefix, _prefix_end(prefix)),
+    )
+    return [_row_to_dict(row) for row in cursor]
 
 
 def get_all_metadata(conn: sqlite3.Connection, path_like: Optional[str] = None) -> list[FileMetadata]:
@@ -74,16 +547,22 @@ def get_all_metadata(conn: sqlite3.Connection, path_like: Optional[str] = None)
 
     cursor = conn.execute(query, params)
     # would be nice to paginate
-    return [
-        FileMetadata(
-            path=row[1],
-            hash=row[2],
-            signature=row[3],
-            file_size=row[4],
-            last_modified=row[5],
-        )
-        for row in cursor
-    ]
+    return [_row_to_metadata(row) for row in cursor]
+
+
+def get_dir_files(conn: sqlite3.Connection, dir: str) -> list[FileMetadata]:
+    """Get the metadata of all files directly inside dir, not recursive."""
+    cursor = conn.execute(
+        "SELECT * FROM file_metadata WHERE RTRIM(path, REPLACE(path, '/', '')) = ?",
+        (dir.rstrip("/") + "/",),
+    )
+    return [_row_to_metadata(row) for row in cursor]
+
+
+def get_child_dir_digests(conn: sqlite3.Connection, dir: str) -> dict[str, str]:
+    """Get the digests of all direct subdirectories of dir, keyed by relative path."""
+    cursor = conn.execute("SELECT path, digest FROM dir_digest WHERE parent = ?", (dir,))
+    return {row[0]: row[1] for row in cursor}
 
 
 def get_one_metadata(conn: sqlite3.Connection, path: str) -> FileMetadata:
@@ -91,24 +570,45 @@ def get_one_metadata(conn: sqlite3.Connection, path: str) -> FileMetadata:
     rows = cursor.fetchall()
     if len(rows) == 0 or len(rows) > 1:
         raise ValueError(f"Expected 1 metadata entry for {path}, got {len(rows)}")
-    row = rows[0]
-    return FileMetadata(
-        path=row[1],
-        hash=row[2],
-        signature=row[3],
-        file_size=row[4],
-        last_modified=row[5],
-    )
+    return _row_to_metadata(rows[0])
 
 
 def get_all_datasites(conn: sqlite3.Connection) -> list[str]:
-    # INSTR(path, '/'): Finds the position of the first slash in the path.
+    cursor = conn.execute("SELECT datasite FROM datasite_state WHERE file_count > 0")
+    return [row[0] for row in cursor if row[0]]
+
+
+def get_datasite_versions(conn: sqlite3.Connection) -> dict[str, int]:
+    """Returns the current version of every datasite that contains files."""
+    cursor = conn.execute("SELECT datasite, version FROM datasite_state WHERE file_count > 0")
+    return {row[0]: row[1] for row in cursor if row[0]}
+
+
+def get_datasite_version(conn: sqlite3.Connection, datasite: str) -> Optional[int]:
+    cursor = conn.execute("SELECT version FROM datasite_state WHERE datasite = ?", (datasite,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def get_permission_version(conn: sqlite3.Connection, datasite: str) -> int:
+    cursor = conn.execute("SELECT version FROM permission_state WHERE datasite = ?", (datasite,))
+    row = cursor.fetchone()
+    return row[0] if row else 0
+
+
+def get_permission_file_paths(conn: sqlite3.Connection, datasite: str) -> list[str]:
+    """Get the paths of all permission files in a datasite."""
+    # range query on the path index, all paths starting with "{datasite}/"
     cursor = conn.execute(
-        """SELECT DISTINCT SUBSTR(path, 1, INSTR(path, '/') - 1) AS root_folder
-        FROM file_metadata;
-        """
+        "SELECT path FROM file_metadata WHERE path >= ? AND path < ? AND path GLOB '*.syftperm'",
+        (f"{datasite}/", f"{datasite}0"),
     )
-    return [row[0] for row in cursor if row[0]]
+    return [row[0] for row in cursor]
+
+
+def get_server_epoch(conn: sqlite3.Connection) -> str:
+    cursor = conn.execute("SELECT value FROM server_meta WHERE key = 'epoch'")
+    return cursor.fetchone()[0]
 
 
 def move_with_transaction(
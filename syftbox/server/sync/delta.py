@@ -0,0 +1,108 @@
+"""
+Cache of rsync deltas between two versions of a file, keyed by (from_hash, to_hash).
+
+When a file in a shared folder changes, every subscriber asks for the same delta from the previous
+version to the current one. The server retains a few previous versions per file (see `FileStore.put`),
+so it can compute that delta once and serve it from memory to everyone else.
+
+Concurrent requests for a delta that is not cached yet share a single computation.
+"""
+
+import asyncio
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Optional
+
+from fastapi import Request
+
+DeltaKey = tuple[str, str]
+# (diff, hash of the file the diff produces)
+Delta = tuple[bytes, str]
+
+
+@dataclass
+class DeltaCacheStats:
+    hits: int = 0
+    misses: int = 0
+    coalesced: int = 0
+    evictions: int = 0
+
+
+class DeltaCache:
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.stats = DeltaCacheStats()
+        self._deltas: OrderedDict[DeltaKey, bytes] = OrderedDict()
+        self._in_flight: dict[DeltaKey, asyncio.Future] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._deltas)
+
+    def get(self, from_hash: str, to_hash: str) -> Optional[bytes]:
+        key = (from_hash, to_hash)
+        with self._lock:
+            diff = self._deltas.get(key)
+            if diff is not None:
+                self._deltas.move_to_end(key)
+            return diff
+
+    def put(self, from_hash: str, to_hash: str, diff: bytes) -> None:
+        if len(diff) > self.max_bytes:
+            return
+        key = (from_hash, to_hash)
+        with self._lock:
+            previous = self._deltas.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous)
+            self._deltas[key] = diff
+            self.size += len(diff)
+            while self.size > self.max_bytes:
+                _, evicted = self._deltas.popitem(last=False)
+                self.size -= len(evicted)
+                self.stats.evictions += 1
+
+    async def get_or_compute(self, from_hash: str, to_hash: str, compute: Callable[[], Awaitable[Delta]]) -> Delta:
+        """
+        Returns the delta from from_hash to to_hash, computing it with `compute` if it is not cached.
+
+        Only one computation per key runs at a time, concurrent callers wait for its result.
+        The result is only cached if it produces to_hash, the file may have changed since to_hash was read.
+        """
+        diff = self.get(from_hash, to_hash)
+        if diff is not None:
+            self.stats.hits += 1
+            return diff, to_hash
+
+        key = (from_hash, to_hash)
+        in_flight = self._in_flight.get(key)
+        if in_flight is not None:
+            self.stats.coalesced += 1
+            return await asyncio.shield(in_flight)
+
+        self.stats.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            diff, new_hash = await compute()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # the exception is raised here, don't warn if no other caller is waiting
+            future.exception()
+            raise
+        else:
+            if new_hash == to_hash:
+                self.put(from_hash, to_hash, diff)
+            future.set_result((diff, new_hash))
+            return diff, new_hash
+        finally:
+            del self._in_flight[key]
+
+
+async def get_delta_cache(request: Request) -> DeltaCache:
+    return request.state.delta_cache
@@ -0,0 +1,135 @@
+"""
+Bounded executor for CPU-heavy sync operations (rsync diffs and hashing).
+
+Running these in the default threadpool lets a few large diffs starve every other endpoint.
+The CPUExecutor runs them on a dedicated pool of `cpu_workers`, and rejects new work when
+`cpu_workers + cpu_queue_size` tasks are already admitted, so the server can answer with a 503 instead of
+queueing indefinitely.
+
+Tasks are module-level functions that take file paths instead of file contents,
+so they can run in a process pool without sending the file contents to the worker.
+"""
+
+import asyncio
+import hashlib
+import threading
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, TypeVar
+
+import py_fast_rsync
+from fastapi import Request
+from loguru import logger
+
+T = TypeVar("T")
+
+
+class CPUExecutorBusy(Exception):
+    pass
+
+
+@dataclass
+class CPUExecutorStats:
+    admitted: int = 0
+    rejected: int = 0
+    completed: int = 0
+    queue_time_total: float = 0.0
+    queue_time_max: float = 0.0
+    run_time_total: float = 0.0
+
+
+@dataclass
+class TaskTiming:
+    queue_time: float
+    run_time: float
+
+    def server_timing(self) -> str:
+        return f"cpu-queue;dur={self.queue_time * 1000:.2f}, cpu;dur={self.run_time * 1000:.2f}"
+
+
+def _timed_call(submitted_at: float, fn: Callable[..., T], *args: Any) -> tuple[T, float, float]:
+    # wall clock time, since the task may run in a different process
+    started_at = time.time()
+    result = fn(*args)
+    return result, started_at - submitted_at, time.time() - started_at
+
+
+class CPUExecutor:
+    def __init__(self, max_workers: int, max_queue_size: int, use_processes: bool = False) -> None:
+        self.max_workers = max_workers
+        self.max_queue_size = max_queue_size
+        self.use_processes = use_processes
+        self._executor: Executor = (
+            ProcessPoolExecutor(max_workers=max_workers)
+            if use_processes
+            else ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="syftbox-cpu")
+        )
+        self._admitted = 0
+        self._lock = threading.Lock()
+        self.stats = CPUExecutorStats()
+
+    @property
+    def capacity(self) -> int:
+        return self.max_workers + self.max_queue_size
+
+    async def run(self, fn: Callable[..., T], *args: Any) -> tuple[T, TaskTiming]:
+        """
+        Run fn(*args) on the executor, and wait for the result without blocking the event loop.
+
+        Raises:
+            CPUExecutorBusy: if the executor is at capacity.
+        """
+        with self._lock:
+            if self._admitted >= self.capacity:
+                self.stats.rejected += 1
+                raise CPUExecutorBusy(f"{self._admitted} tasks in progress")
+            self._admitted += 1
+            self.stats.admitted += 1
+
+        try:
+            future = self._executor.submit(_timed_call, time.time(), fn, *args)
+            result, queue_time, run_time = await asyncio.wrap_future(future)
+        finally:
+            with self._lock:
+                self._admitted -= 1
+
+        with self._lock:
+            self.stats.completed += 1
+            self.stats.queue_time_total += queue_time
+            self.stats.queue_time_max = max(self.stats.queue_time_max, queue_time)
+            self.stats.run_time_total += run_time
+        logger.debug(f"{fn.__name__} queued {queue_time * 1000:.2f}ms, ran {run_time * 1000:.2f}ms")
+        return result, TaskTiming(queue_time=queue_time, run_time=run_time)
+
+    def stop(self) -> None:
+        """Cancel the queued tasks, and wait for the running tasks and the workers to finish."""
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+
+def diff_file(path: Path, signature: bytes) -> bytes:
+    """Returns the rsync diff of the file at path against signature."""
+    return py_fast_rsync.diff(signature, path.read_bytes())
+
+
+def diff_data(data: bytes, signature: bytes) -> bytes:
+    """Returns the rsync diff of data against signature, for files that are already in memory."""
+    return py_fast_rsync.diff(signature, data)
+
+
+def apply_diff_to_file(path: Path, diff: bytes) -> tuple[bytes, str]:
+    """Applies an rsync diff to the file at path, returns the result and its sha256 hex digest."""
+    result = py_fast_rsync.apply(path.read_bytes(), diff)
+    return result, hashlib.sha256(result).hexdigest()
+
+
+def delta_between_files(old_path: Path, new_path: Path) -> tuple[bytes, str]:
+    """Returns the rsync diff from the file at old_path to the file at new_path, and the sha256 of new_path."""
+    new_data = new_path.read_bytes()
+    signature = py_fast_rsync.signature.calculate(old_path.read_bytes())
+    return py_fast_rsync.diff(signature, new_data), hashlib.sha256(new_data).hexdigest()
+
+
+async def get_cpu_executor(request: Request) -> CPUExecutor:
+    return request.state.cpu_executor
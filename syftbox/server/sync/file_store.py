@@ -1,13 +1,60 @@
+import functools
+import hashlib
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
 from pathlib import Path
+from typing import AsyncIterator, BinaryIO, Callable, Optional, TypeVar, Union
 
+import anyio
+import anyio.to_thread
 from pydantic import BaseModel
 
+from syftbox.lib.lib import SyftPermission
+from syftbox.server.metrics import Histogram, ServerMetrics
 from syftbox.server.settings import ServerSettings
 from syftbox.server.sync import db
+from syftbox.server.sync.content_cache import ContentCache
 from syftbox.server.sync.db import get_db
 from syftbox.server.sync.hash import hash_file
 from syftbox.server.sync.models import AbsolutePath, FileMetadata, RelativePath
 
+T = TypeVar("T")
+
+# chunk size for streaming file reads
+CHUNK_SIZE = 1024 * 1024
+
+
+def write_temp(path: Path, contents: Union[bytes, BinaryIO]) -> Path:
+    """
+    Write contents to a new temporary file in the folder of path. Returns the path of the temporary file.
+    contents can be a file object, which is copied in chunks.
+    """
+    path.parent.mkdir(exist_ok=True, parents=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            if isinstance(contents, bytes):
+                f.write(contents)
+            else:
+                shutil.copyfileobj(contents, f, CHUNK_SIZE)
+    except BaseException:
+        Path(tmp_path).unlink(missing_ok=True)
+        raise
+    return Path(tmp_path)
+
+
+def write_atomic(path: Path, contents: bytes) -> None:
+    """Write a file through a temporary file in the same folder, so readers see either the old or the new contents."""
+    tmp_path = write_temp(path, contents)
+    try:
+        os.replace(tmp_path, path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
 
 class SyftFile(BaseModel):
     metadata: FileMetadata
@@ -16,25 +63,73 @@ class SyftFile(BaseModel):
 
 
 class FileStore:
-    def __init__(self, server_settings: ServerSettings) -> None:
+    def __init__(self, server_settings: ServerSettings, content_cache: Optional[ContentCache] = None) -> None:
         self.server_settings = server_settings
+        self.content_cache = content_cache
 
     @property
     def db_path(self) -> AbsolutePath:
         return self.server_settings.file_db_path
 
-    def delete(self, path: RelativePath) -> None:
+    def delete(self, path: RelativePath) -> Optional[FileMetadata]:
+        """Delete a file. Returns the metadata of the deleted file, or None if it did not exist."""
         conn = get_db(self.db_path)
         cursor = conn.cursor()
         cursor.execute("BEGIN IMMEDIATE;")
+        metadata = None
         try:
+            metadata = db.get_one_metadata(cursor, path=str(path))
             db.delete_file_metadata(cursor, str(path))
+            self._invalidate(metadata.hash)
         except ValueError:
             pass
+        if SyftPermission.is_permission_file(path):
+            db.delete_acl(cursor, Path(path).as_posix())
+        self._delete_versions(db.delete_file_versions(cursor, str(path)))
         abs_path = self.server_settings.snapshot_folder / path
         abs_path.unlink(missing_ok=True)
         conn.commit()
         cursor.close()
+        return metadata
+
+    def version_path(self, file_hash: str) -> AbsolutePath:
+        """Path of a previous version of a file, stored by content hash."""
+        return self.server_settings.versions_folder / file_hash[:2] / file_hash
+
+    def get_version_path(self, path: RelativePath, file_hash: str) -> Optional[AbsolutePath]:
+        """Returns the path of a previous version of path with file_hash, or None if it is not retained."""
+        with get_db(self.db_path) as conn:
+            if not db.has_file_version(conn, str(path), file_hash):
+                return None
+        version_path = self.version_path(file_hash)
+        return version_path if version_path.is_file() else None
+
+    def _retain_version(self, cursor, path: Path, abs_path: Path, contents: bytes) -> None:
+        try:
+            old_hash = db.get_one_metadata(cursor, path=str(path)).hash
+        except ValueError:
+            return
+        if old_hash == hashlib.sha256(contents).hexdigest():
+            return
+        if abs_path.stat().st_size > self.server_settings.version_max_file_size:
+            return
+
+        version_path = self.version_path(old_hash)
+        if not version_path.exists():
+            version_path.parent.mkdir(parents=True, exist_ok=True)
+            # files are only replaced, never written in place, so the version can share the current file
+            try:
+                os.link(abs_path, version_path)
+            except FileExistsError:
+                pass
+            except OSError:
+                shutil.copyfile(abs_path, version_path)
+        max_versions = self.server_settings.version_history_size
+        self._delete_versions(db.add_file_version(cursor, str(path), old_hash, max_versions))
+
+    def _delete_versions(self, hashes: list[str]) -> None:
+        for file_hash in hashes:
+            self.version_path(file_hash).unlink(missing_ok=True)
 
     def get(self, path: RelativePath) -> SyftFile:
         with get_db(self.db_path) as conn:
@@ -44,40 +139,245 @@ class FileStore:
             if not Path(abs_path).exists():
                 self.delete(metadata.path.as_posix())
                 raise ValueError("File not found")
-            return SyftFile(metadata=metadata, data=self._read_bytes(abs_path), absolute_path=abs_path)
+            return SyftFile(metadata=metadata, data=self._read_contents(metadata), absolute_path=abs_path)
 
     def exists(self, path: RelativePath) -> bool:
         with get_db(self.db_path) as conn:
-            try:
-                db.get_one_metadata(conn, path=str(path))
-                return True
-            except ValueError:
-                return False
+            return _has_metadata(conn, path)
 
     def get_metadata(self, path: RelativePath) -> FileMetadata:
         with get_db(self.db_path) as conn:
             metadata = db.get_one_metadata(conn, path=str(path))
             return metadata
 
+    def read_cached(self, metadata: FileMetadata) -> Optional[bytes]:
+        """
+        Returns the contents of a file from the content cache, reading it from disk on a miss.
+        Returns None if there is no cache or the file is too large to be cached, callers should stream it from disk.
+        """
+        if self.content_cache is None or not self.content_cache.fits(metadata.file_size):
+            return None
+        return self._read_contents(metadata)
+
+    def _read_contents(self, metadata: FileMetadata) -> bytes:
+        if self.content_cache is not None:
+            data = self.content_cache.get(metadata.hash)
+            if data is not None:
+                return data
+
+        data = self._read_bytes(self.server_settings.snapshot_folder / metadata.path)
+        # the file can be replaced after its metadata was read, only cache the contents the hash belongs to
+        if self.content_cache is not None and hashlib.sha256(data).hexdigest() == metadata.hash:
+            self.content_cache.put(metadata.hash, data)
+        return data
+
     def _read_bytes(self, path: AbsolutePath) -> bytes:
         with open(path, "rb") as f:
             return f.read()
 
-    def put(self, path: Path, contents: bytes) -> None:
-        abs_path = self.server_settings.snapshot_folder / path
-        abs_path.parent.mkdir(exist_ok=True, parents=True)
+    def _invalidate(self, file_hash: str) -> None:
+        if self.content_cache is not None:
+            self.content_cache.invalidate(file_hash)
 
+    def put(self, path: Path, contents: bytes) -> FileMetadata:
+        """Write a file. Returns the metadata of the written file."""
         conn = get_db(self.db_path)
         cursor = conn.cursor()
         cursor.execute("BEGIN IMMEDIATE;")
-        abs_path.write_bytes(contents)
-        metadata = hash_file(abs_path, root_dir=self.server_settings.snapshot_folder)
-        db.save_file_metadata(cursor, metadata)
+        metadata = self._put(cursor, path, contents)
         conn.commit()
         cursor.close()
         conn.close()
+        return metadata
 
-    def list(self, path: RelativePath) -> list[FileMetadata]:
+    def write_temp(self, path: Path, contents: Union[bytes, BinaryIO]) -> tuple[Path, FileMetadata]:
+        """
+        Stage a file for `create_many`: write it to a temporary file next to path in the snapshot folder, and hash it.
+        Returns the path of the temporary file and the metadata of the file.
+        """
+        tmp_path = write_temp(self.server_settings.snapshot_folder / path, contents)
+        try:
+            return tmp_path, hash_file(tmp_path).model_copy(update={"path": Path(path)})
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+
+    def create_many(self, files: list[tuple[Path, FileMetadata]]) -> list[FileMetadata]:
+        """
+        Create files staged with `write_temp`, and commit their metadata in a single transaction.
+        Files that already exist are skipped. Returns the metadata of the created files.
+
+        The files are written and hashed before the write lock is taken, so the lock is only held while they are
+        renamed into place and their metadata is saved. The temporary files are removed.
+        """
+        conn = get_db(self.db_path)
+        created = []
+        try:
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE;")
+            try:
+                for tmp_path, metadata in files:
+                    # the file can be created by another request after it was staged
+                    if _has_metadata(cursor, metadata.path):
+                        continue
+                    os.replace(tmp_path, self.server_settings.snapshot_folder / metadata.path)
+                    self._save_metadata(cursor, metadata)
+                    created.append(metadata)
+                conn.commit()
+            finally:
+                cursor.close()
+        finally:
+            conn.close()
+            # files that were skipped or not created because of an error
+            for tmp_path, _ in files:
+                tmp_path.unlink(missing_ok=True)
+        return created
+
+    def _put(self, cursor: sqlite3.Cursor, path: Path, contents: bytes) -> FileMetadata:
+        abs_path = self.server_settings.snapshot_folder / path
+        try:
+            self._invalidate(db.get_one_metadata(cursor, path=str(path)).hash)
+        except ValueError:
+            pass
+        if self.server_settings.version_history_size > 0 and abs_path.is_file():
+            self._retain_version(cursor, path, abs_path, contents)
+        write_atomic(abs_path, contents)
+        metadata = hash_file(abs_path, root_dir=self.server_settings.snapshot_folder)
+        self._save_metadata(cursor, metadata, contents)
+        return metadata
+
+    def _save_metadata(self, cursor: sqlite3.Cursor, metadata: FileMetadata, contents: Optional[bytes] = None) -> None:
+        """Save the metadata of a written file. Without contents, permission files are read back from disk."""
+        db.save_file_metadata(cursor, metadata)
+        if self.content_cache is not None and contents is not None:
+            # a written file is likely to be downloaded by its subscribers next
+            self.content_cache.put(metadata.hash, contents)
+        if SyftPermission.is_permission_file(metadata.path):
+            if contents is None:
+                contents = self._read_bytes(self.server_settings.snapshot_folder / metadata.path)
+            db.save_acl(cursor, metadata.path.as_posix(), db.load_permission(contents))
+
+    def list(self, path: RelativePath, readable_by: Optional[str] = None) -> list[FileMetadata]:
+        """List all files below path. If readable_by is set, only files readable by that email are returned."""
         with get_db(self.db_path) as conn:
+            if readable_by is not None:
+                return db.get_readable_metadata(conn, readable_by, path.as_posix())
             metadata = db.get_all_metadata(conn, path_like=path.as_posix())
             return metadata
+
+
+def _has_metadata(conn: Union[sqlite3.Connection, sqlite3.Cursor], path: Union[str, Path]) -> bool:
+    try:
+        db.get_one_metadata(conn, path=str(path))
+        return True
+    except ValueError:
+        return False
+
+
+def _operation_name(fn: Callable) -> str:
+    return getattr(fn, "__name__", None) or type(fn).__name__
+
+
+class AsyncFileStore:
+    """
+    Async interface to a FileStore, for async routes.
+
+    SQLite and file I/O are blocking, so each call runs on a worker thread. Threads are bounded by `limiter`
+    (the `io_threads` setting) instead of the default threadpool of 40 threads shared with sync routes,
+    and the event loop stays free to serve other requests while a call is waiting on I/O.
+
+    With `metrics`, the time of each call on its thread is recorded per operation, excluding the wait for a thread.
+    """
+
+    def __init__(
+        self,
+        store: FileStore,
+        limiter: Optional[anyio.CapacityLimiter] = None,
+        metrics: Optional[ServerMetrics] = None,
+    ) -> None:
+        self.store = store
+        self.limiter = limiter
+        self.metrics = metrics
+
+    @property
+    def server_settings(self) -> ServerSettings:
+        return self.store.server_settings
+
+    async def _run_timed(self, histogram: Optional[Histogram], operation: str, fn: Callable[[], T]) -> T:
+        def run_and_time() -> T:
+            start = time.perf_counter()
+            try:
+                return fn()
+            finally:
+                histogram.observe(time.perf_counter() - start, (operation,))
+
+        return await anyio.to_thread.run_sync(fn if histogram is None else run_and_time, limiter=self.limiter)
+
+    async def run(self, fn: Callable[..., T], *args, **kwargs) -> T:
+        """Run a blocking function on an I/O thread."""
+        histogram = self.metrics.file_store_duration if self.metrics is not None else None
+        return await self._run_timed(histogram, _operation_name(fn), functools.partial(fn, *args, **kwargs))
+
+    async def run_db(self, fn: Callable[..., T], *args, **kwargs) -> T:
+        """Run fn(conn, *args, **kwargs) on an I/O thread, with a connection opened and closed on that thread."""
+
+        def run_with_connection() -> T:
+            conn = get_db(self.store.db_path)
+            try:
+                return fn(conn, *args, **kwargs)
+            finally:
+                conn.close()
+
+        histogram = self.metrics.db_duration if self.metrics is not None else None
+        return await self._run_timed(histogram, _operation_name(fn), run_with_connection)
+
+    async def get(self, path: RelativePath) -> SyftFile:
+        return await self.run(self.store.get, path)
+
+    async def get_metadata(self, path: RelativePath) -> FileMetadata:
+        return await self.run(self.store.get_metadata, path)
+
+    async def exists(self, path: RelativePath) -> bool:
+        return await self.run(self.store.exists, path)
+
+    async def put(self, path: Path, contents: bytes) -> FileMetadata:
+        return await self.run(self.store.put, path, contents)
+
+    async def create_many(self, files: list[tuple[Path, FileMetadata]]) -> list[FileMetadata]:
+        return await self.run(self.store.create_many, files)
+
+    async def delete(self, path: RelativePath) -> Optional[FileMetadata]:
+        return await self.run(self.store.delete, path)
+
+    async def list(self, path: RelativePath, readable_by: Optional[str] = None) -> list[FileMetadata]:
+        return await self.run(self.store.list, path, readable_by)
+
+    async def read_cached(self, metadata: FileMetadata) -> Optional[bytes]:
+        return await self.run(self.store.read_cached, metadata)
+
+    async def get_version_path(self, path: RelativePath, file_hash: str) -> Optional[AbsolutePath]:
+        return await self.run(self.store.get_version_path, path, file_hash)
+
+    async def iter_bytes(
+        self,
+        path: AbsolutePath,
+        start: int = 0,
+        end: Optional[int] = None,
+        chunk_size: int = CHUNK_SIZE,
+    ) -> AsyncIterator[bytes]:
+        """Read the bytes [start, end) of a file in chunks, without holding a thread between chunks."""
+        f = await self.run(open, path, "rb")
+        try:
+            await self.run(f.seek, start)
+            remaining = end - start if end is not None else None
+            while remaining is None or remaining > 0:
+                size = chunk_size if remaining is None else min(chunk_size, remaining)
+                chunk = await self.run(f.read, size)
+                if not chunk:
+                    break
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+        finally:
+            # closing does not block, and must not be awaited if the generator is closed by garbage collection
+            f.close()
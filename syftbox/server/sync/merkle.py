@@ -0,0 +1,178 @@
+"""
+Directory digests over the datasite hierarchy, used to find out-of-sync subtrees without comparing every file.
+
+The digest of a directory is the XOR of the leaf digests of all files below it,
+where the leaf digest of a file is sha256(path + hash).
+Unlike a Merkle tree that hashes the sorted children of a directory, this digest can be updated in O(depth)
+when a single file changes, by XOR-ing out the old leaf and XOR-ing in the new leaf for every ancestor.
+
+The server stores the digests in its database. Clients keep a `DirIndex` of the local files and of the remote
+files of each datasite, and only compare the files of directories whose digests differ.
+"""
+
+import hashlib
+from collections import defaultdict
+from collections.abc import Iterable
+from typing import Optional
+
+from syftbox.server.sync.models import FileMetadata
+
+EMPTY_DIGEST = 0
+
+
+def leaf_digest(path: str, file_hash: str) -> int:
+    digest = hashlib.sha256(f"{path}\0{file_hash}".encode()).digest()
+    return int.from_bytes(digest, "big")
+
+
+def digest_to_hex(digest: int) -> str:
+    return f"{digest:064x}"
+
+
+def digest_from_hex(digest: str) -> int:
+    return int(digest, 16)
+
+
+def parent_dir(path: str) -> str:
+    return path.rpartition("/")[0]
+
+
+def ancestor_dirs(path: str) -> list[str]:
+    """Returns all parent directories of a relative posix path, e.g. "a/b/c.txt" -> ["a", "a/b"]"""
+    parts = path.split("/")[:-1]
+    return ["/".join(parts[: i + 1]) for i in range(len(parts))]
+
+
+def compute_digest(files: Iterable[FileMetadata]) -> int:
+    digest = EMPTY_DIGEST
+    for file in files:
+        digest ^= leaf_digest(file.path.as_posix(), file.hash)
+    return digest
+
+
+def compute_dir_digests(files: Iterable[FileMetadata]) -> dict[str, str]:
+    """Compute the digest of every directory that contains files, keyed by relative posix path."""
+    digests: dict[str, int] = {}
+    for file in files:
+        path = file.path.as_posix()
+        leaf = leaf_digest(path, file.hash)
+        for dir in ancestor_dirs(path):
+            digests[dir] = digests.get(dir, EMPTY_DIGEST) ^ leaf
+    return {dir: digest_to_hex(digest) for dir, digest in digests.items()}
+
+
+def update_digest(digest: Optional[str], delta: int) -> str:
+    current = EMPTY_DIGEST if digest is None else digest_from_hex(digest)
+    return digest_to_hex(current ^ delta)
+
+
+class DirIndex:
+    """
+    Files of a datasite grouped by directory, with the digest of every directory that contains files.
+
+    Digests are updated per added, changed or removed file, so keeping an index up to date with a new state only
+    hashes the files that changed.
+    """
+
+    def __init__(self, files: Iterable[FileMetadata] = ()) -> None:
+        self.files: dict[str, FileMetadata] = {}
+        self.files_by_dir: dict[str, dict[str, FileMetadata]] = defaultdict(dict)
+        self.subdirs: dict[str, set[str]] = defaultdict(set)
+        self._digests: dict[str, int] = {}
+        self._file_counts: dict[str, int] = defaultdict(int)
+        for file in files:
+            self.put(file)
+
+    def __len__(self) -> int:
+        return len(self.files)
+
+    def digest(self, dir: str) -> Optional[str]:
+        """Hex digest of all files below dir, or None if dir has no files."""
+        digest = self._digests.get(dir)
+        return None if digest is None else digest_to_hex(digest)
+
+    def put(self, file: FileMetadata) -> None:
+        path = file.path.as_posix()
+        old_file = self.files.get(path)
+        if old_file is not None and old_file.hash == file.hash:
+            self.files[path] = self.files_by_dir[parent_dir(path)][path] = file
+            return
+        self.remove(path)
+
+        self.files[path] = self.files_by_dir[parent_dir(path)][path] = file
+        leaf = leaf_digest(path, file.hash)
+        for dir in ancestor_dirs(path):
+            if self._file_counts[dir] == 0:
+                self.subdirs[parent_dir(dir)].add(dir)
+            self._file_counts[dir] += 1
+            self._digests[dir] = self._digests.get(dir, EMPTY_DIGEST) ^ leaf
+
+    def remove(self, path: str) -> None:
+        file = self.files.pop(path, None)
+        if file is None:
+            return
+        dir_files = self.files_by_dir[parent_dir(path)]
+        del dir_files[path]
+        if not dir_files:
+            del self.files_by_dir[parent_dir(path)]
+
+        leaf = leaf_digest(path, file.hash)
+        for dir in ancestor_dirs(path):
+            self._file_counts[dir] -= 1
+            if self._file_counts[dir] > 0:
+                self._digests[dir] ^= leaf
+                continue
+            del self._file_counts[dir]
+            del self._digests[dir]
+            siblings = self.subdirs[parent_dir(dir)]
+            siblings.discard(dir)
+            if not siblings:
+                del self.subdirs[parent_dir(dir)]
+
+    def remove_dir(self, dir: str) -> None:
+        """Remove all files below dir."""
+        paths = []
+        dirs = [dir]
+        while dirs:
+            current = dirs.pop()
+            paths.extend(self.files_by_dir.get(current, {}))
+            dirs.extend(self.subdirs.get(current, ()))
+        for path in paths:
+            self.remove(path)
+
+    def set_dir_files(self, dir: str, files: Iterable[FileMetadata]) -> None:
+        """Replace the files directly inside dir, files in subdirectories are kept."""
+        new_files = {file.path.as_posix(): file for file in files}
+        for path in self.files_by_dir.get(dir, {}).keys() - new_files.keys():
+            self.remove(path)
+        for file in new_files.values():
+            self.put(file)
+
+    def update(self, files: Iterable[FileMetadata]) -> None:
+        """Replace all files of the index."""
+        new_files = {file.path.as_posix(): file for file in files}
+        for path in self.files.keys() - new_files.keys():
+            self.remove(path)
+        for file in new_files.values():
+            self.put(file)
+
+
+def get_out_of_sync_paths(left: DirIndex, right: DirIndex, root: str) -> list[str]:
+    """
+    Paths below root of the files that differ between two indexes.
+    Only directories whose digests differ are visited, so the cost depends on the number of changes.
+    """
+    paths = []
+    dirs = [root]
+    while dirs:
+        dir = dirs.pop()
+        if left.digest(dir) == right.digest(dir):
+            continue
+        left_files = left.files_by_dir.get(dir, {})
+        right_files = right.files_by_dir.get(dir, {})
+        for path in left_files.keys() | right_files.keys():
+            left_file, right_file = left_files.get(path), right_files.get(path)
+            if left_file is None or right_file is None or left_file.hash != right_file.hash:
+                paths.append(path)
+        dirs.extend(left.subdirs.get(dir, set()) | right.subdirs.get(dir, set()))
+    return paths
@@ -19,6 +19,9 @@ def should_be_absolute(v):
     return v
 
 
+DATASITE_ETAGS_HEADER = "X-Syftbox-Datasite-ETags"
+COLUMNAR_MEDIA_TYPE = "application/vnd.syftbox.columnar"
+
 RelativePath = Annotated[Path, AfterValidator(should_be_relative)]
 
 AbsolutePath = Annotated[Path, AfterValidator(should_be_absolute)]
@@ -33,6 +36,11 @@ class DiffRequest(BaseModel):
         return base64.b85decode(self.signature)
 
 
+class DeltaRequest(BaseModel):
+    path: RelativePath
+    from_hash: str
+
+
 class DiffResponse(BaseModel):
     path: RelativePath
     diff: str
@@ -109,6 +117,22 @@ class FileMetadata(BaseModel):
         return self.path == value.path and self.hash == value.hash
 
 
+class DirDigestRequest(BaseModel):
+    path: RelativePath
+
+
+class DirDigestResponse(BaseModel):
+    path: RelativePath
+    digest: Optional[str] = Field(description="Digest of all files below path, None if path has no files")
+    dirs: dict[str, str] = Field(description="Digests of all subdirectories, keyed by relative path")
+    files: list[FileMetadata] = Field(description="Metadata of all files directly inside path")
+
+
+class BulkUploadResponse(BaseModel):
+    created: list[RelativePath] = Field(default_factory=list, description="Paths of the created files")
+    errors: dict[str, str] = Field(default_factory=dict, description="Reasons files were not created, keyed by path")
+
+
 class SyncLog(BaseModel):
     path: Path
     method: str  # pull or push
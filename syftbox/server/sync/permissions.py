@@ -0,0 +1,64 @@
+import sqlite3
+import threading
+from pathlib import Path
+
+from fastapi import Request
+from loguru import logger
+
+from syftbox.lib.lib import PermissionTree, SyftPermission, perm_file_path
+from syftbox.server.sync import db
+
+
+class PermissionCache:
+    """
+    Caches the PermissionTree of each datasite.
+
+    A cached tree is valid as long as the permission version of its datasite has not changed.
+    The version is bumped by the database on every write to a permission file (see `db._create_permission_state`),
+    so trees are only rebuilt when a permission file changes through the FileStore.
+    Rebuilding reads the permission file paths from the database, and does not walk the snapshot folder.
+    """
+
+    def __init__(self, snapshot_folder: Path) -> None:
+        self.snapshot_folder = snapshot_folder
+        self._trees: dict[str, tuple[int, PermissionTree]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, conn: sqlite3.Connection, datasite: str) -> PermissionTree:
+        version = db.get_permission_version(conn, datasite)
+        cached = self._trees.get(datasite)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+        with self._lock:
+            # concurrent requests wait for the first one to build the tree
+            cached = self._trees.get(datasite)
+            if cached is not None and cached[0] == version:
+                return cached[1]
+            tree = self._build(conn, datasite)
+            self._trees[datasite] = (version, tree)
+        return tree
+
+    def _build(self, conn: sqlite3.Connection, datasite: str) -> PermissionTree:
+        logger.debug(f"Building permission tree for {datasite}")
+        parent_path = self.snapshot_folder / datasite
+
+        perm_dict = {}
+        corrupted_permission_files = []
+        for path in db.get_permission_file_paths(conn, datasite):
+            abs_path = str(self.snapshot_folder / path)
+            try:
+                perm_dict[abs_path] = SyftPermission.load(abs_path)
+            except Exception:
+                corrupted_permission_files.append(abs_path)
+
+        return PermissionTree(
+            root_perm=perm_dict.get(perm_file_path(str(parent_path))),
+            tree=perm_dict,
+            parent_path=parent_path,
+            corrupted_permission_files=corrupted_permission_files,
+        )
+
+
+async def get_permission_cache(request: Request) -> PermissionCache:
+    return request.state.permission_cache
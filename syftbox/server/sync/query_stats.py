@@ -0,0 +1,260 @@
+"""
+Per-statement statistics of the file metadata database.
+
+With the `db_query_stats` setting, connections opened with `db.get_db` are `InstrumentedConnection`s, which
+record for every statement:
+- the time spent in SQLite, from execute until the last row is fetched
+- the number of rows returned, or changed by an INSERT, UPDATE or DELETE
+- the number of SQLite VM steps, counted by a progress handler, as a measure of the rows scanned
+- for `BEGIN IMMEDIATE`, the time spent waiting for the write lock
+
+Statements are grouped by their SQL text, with placeholder lists like `IN (?, ?, ?)` collapsed.
+Statements slower than `slow_query_seconds` are logged. The statistics are served with their query plans by
+the admin routes, and exposed as totals at `/metrics`.
+
+The instrumentation is off by default: the progress handler and the wrapped fetches make iterating over results
+about a third slower, and double the time of point lookups.
+"""
+
+import dataclasses
+import re
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Optional
+
+from loguru import logger
+
+# the progress handler is called every PROGRESS_STEPS SQLite VM instructions
+PROGRESS_STEPS = 1000
+
+# statements beyond this number are grouped together, so dynamic SQL cannot grow the stats without bound
+MAX_STATEMENTS = 1000
+OTHER_STATEMENTS = "<other>"
+
+_PLACEHOLDER_LIST = re.compile(r"\?(\s*,\s*\?)+")
+
+
+def normalize_sql(sql: str) -> str:
+    return _PLACEHOLDER_LIST.sub("?, ...", " ".join(sql.split()))
+
+
+@dataclass
+class StatementStats:
+    sql: str
+    example: str
+    calls: int = 0
+    time_total: float = 0.0
+    time_max: float = 0.0
+    rows: int = 0
+    vm_steps: int = 0
+    lock_wait_total: float = 0.0
+    slow_calls: int = 0
+
+
+@dataclass
+class QueryTotals:
+    queries: int = 0
+    query_seconds: float = 0.0
+    lock_wait_seconds: float = 0.0
+    rows: int = 0
+    vm_steps: int = 0
+    slow_queries: int = 0
+
+
+class QueryStats:
+    def __init__(self, slow_query_seconds: Optional[float] = None) -> None:
+        """
+        Args:
+            slow_query_seconds: statements that take longer are logged. None disables the slow query log.
+        """
+        self.enabled = False
+        self.slow_query_seconds = slow_query_seconds
+        self._statements: dict[str, StatementStats] = {}
+        self._lock = threading.Lock()
+
+    def configure(self, enabled: bool, slow_query_seconds: Optional[float]) -> None:
+        self.enabled = enabled
+        self.slow_query_seconds = slow_query_seconds
+
+    def record(self, sql: str, duration: float, rows: int, vm_steps: int) -> None:
+        key = normalize_sql(sql)
+        slow = self.slow_query_seconds is not None and duration >= self.slow_query_seconds
+        with self._lock:
+            stats = self._statements.get(key)
+            if stats is None:
+                if len(self._statements) >= MAX_STATEMENTS:
+                    key = OTHER_STATEMENTS
+                stats = self._statements.setdefault(key, StatementStats(sql=key, example=sql))
+            stats.calls += 1
+            stats.time_total += duration
+            stats.time_max = max(stats.time_max, duration)
+            stats.rows += max(rows, 0)
+            stats.vm_steps += vm_steps
+            if key.upper().startswith("BEGIN"):
+                stats.lock_wait_total += duration
+            stats.slow_calls += slow
+        if slow:
+            logger.warning(f"Slow query: {duration * 1000:.1f}ms, {rows} rows, ~{vm_steps} VM steps: {key}")
+
+    def statements(self) -> list[StatementStats]:
+        """Statistics per statement, by descending total time."""
+        with self._lock:
+            statements = [dataclasses.replace(stats) for stats in self._statements.values()]
+        return sorted(statements, key=lambda stats: stats.time_total, reverse=True)
+
+    def totals(self) -> QueryTotals:
+        totals = QueryTotals()
+        for stats in self.statements():
+            totals.queries += stats.calls
+            totals.query_seconds += stats.time_total
+            totals.lock_wait_seconds += stats.lock_wait_total
+            totals.rows += stats.rows
+            totals.vm_steps += stats.vm_steps
+            totals.slow_queries += stats.slow_calls
+        return totals
+
+    def reset(self) -> None:
+        with self._lock:
+            self._statements.clear()
+
+
+# connections are opened from many places with only a database path, so the stats are shared by the process
+QUERY_STATS = QueryStats()
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Records each statement when its last row is fetched, or when the cursor is reused, closed or deleted."""
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._sql: Optional[str] = None
+        self._time = 0.0
+        self._rows = 0
+        self._start_steps = 0
+
+    def _begin(self, sql: str) -> None:
+        self._finish()
+        self._sql = sql
+        self._time = 0.0
+        self._rows = 0
+        self._start_steps = self.connection.vm_steps
+
+    def _finish(self) -> None:
+        if self._sql is None:
+            return
+        sql, self._sql = self._sql, None
+        vm_steps = (self.connection.vm_steps - self._start_steps) * PROGRESS_STEPS
+        QUERY_STATS.record(sql, self._time, self._rows, vm_steps)
+
+    def _timed(self, fn, *args) -> Any:
+        start = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            self._time += time.perf_counter() - start
+
+    def execute(self, sql: str, parameters: Any = (), /) -> "InstrumentedCursor":
+        self._begin(sql)
+        self._timed(super().execute, sql, parameters)
+        if self.description is None:
+            # no result rows
+            self._rows = self.rowcount
+            self._finish()
+        return self
+
+    def executemany(self, sql: str, seq_of_parameters: Any, /) -> "InstrumentedCursor":
+        self._begin(sql)
+        self._timed(super().executemany, sql, seq_of_parameters)
+        self._rows = self.rowcount
+        self._finish()
+        return self
+
+    def executescript(self, sql_script: str, /) -> "InstrumentedCursor":
+        self._begin(sql_script)
+        self._timed(super().executescript, sql_script)
+        self._finish()
+        return self
+
+    def fetchone(self) -> Any:
+        row = self._timed(super().fetchone)
+        if row is None:
+            self._finish()
+        else:
+            self._rows += 1
+        return row
+
+    def fetchmany(self, size: Optional[int] = None) -> list:
+        size = self.arraysize if size is None else size
+        rows = self._timed(super().fetchmany, size)
+        self._rows += len(rows)
+        if len(rows) < size:
+            self._finish()
+        return rows
+
+    def fetchall(self) -> list:
+        rows = self._timed(super().fetchall)
+        self._rows += len(rows)
+        self._finish()
+        return rows
+
+    def __next__(self) -> Any:
+        try:
+            row = self._timed(super().__next__)
+        except StopIteration:
+            self._finish()
+            raise
+        self._rows += 1
+        return row
+
+    def close(self) -> None:
+        self._finish()
+        super().close()
+
+    def __del__(self) -> None:
+        try:
+            self._finish()
+        except Exception:
+            pass
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """Connection whose cursors record `QUERY_STATS`."""
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.vm_steps = 0
+        self.set_progress_handler(self._on_progress, PROGRESS_STEPS)
+
+    def _on_progress(self) -> int:
+        self.vm_steps += 1
+        # 0 continues the statement
+        return 0
+
+    def cursor(self, factory: type[sqlite3.Cursor] = InstrumentedCursor) -> sqlite3.Cursor:
+        return super().cursor(factory)
+
+    # the shortcuts of sqlite3.Connection create their cursor without calling `cursor`
+
+    def execute(self, sql: str, parameters: Any = (), /) -> sqlite3.Cursor:
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql: str, seq_of_parameters: Any, /) -> sqlite3.Cursor:
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script: str, /) -> sqlite3.Cursor:
+        return self.cursor().executescript(sql_script)
+
+
+def explain_query_plan(conn: sqlite3.Connection, sql: str) -> list[str]:
+    """The query plan of a statement, with NULL for its parameters. Returns an empty list if it has no plan."""
+    named = re.findall(r"[:@$](\w+)", sql)
+    parameters: Any = dict.fromkeys(named) if named else [None] * sql.count("?")
+    rows = conn.execute(f"EXPLAIN QUERY PLAN {sql}", parameters).fetchall()
+    depths: dict[int, int] = {}
+    plan = []
+    for node_id, parent_id, _, detail in rows:
+        depths[node_id] = depths.get(parent_id, -1) + 1
+        plan.append("  " * depths[node_id] + detail)
+    return plan
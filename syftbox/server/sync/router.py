@@ -1,30 +1,62 @@
 import base64
 import hashlib
+import json
+import mimetypes
 import sqlite3
 import zipfile
+import zlib
 from io import BytesIO
+from pathlib import Path
+from typing import Any, BinaryIO, Optional
 
-import py_fast_rsync
-from fastapi import APIRouter, Depends, HTTPException, Request, Response, UploadFile
+from fastapi import APIRouter, Depends, Header, HTTPException, Request, Response, UploadFile
 from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 from loguru import logger
 
-from syftbox.lib.lib import PermissionTree, SyftPermission, filter_metadata
-from syftbox.server.analytics import log_file_change_event
-from syftbox.server.settings import ServerSettings, get_server_settings
+from syftbox.lib.lib import SyftPermission, filter_metadata
+from syftbox.server.analytics import AnalyticsQueue, get_analytics_queue
+from syftbox.server.rate_limit import rate_limit
+from syftbox.server.settings import ServerSettings
+from syftbox.server.sync import columnar, merkle
 from syftbox.server.sync.db import (
     get_all_datasites,
-    get_db,
+    get_all_metadata_dicts,
+    get_child_dir_digests,
+    get_corrupted_permission_files,
+    get_datasite_version,
+    get_datasite_versions,
+    get_dir_files,
+    get_readable_metadata,
+    get_readable_metadata_dicts,
+    get_server_epoch,
 )
-from syftbox.server.sync.file_store import FileStore, SyftFile
+from syftbox.server.sync.delta import DeltaCache, get_delta_cache
+from syftbox.server.sync.executor import (
+    CPUExecutor,
+    CPUExecutorBusy,
+    apply_diff_to_file,
+    delta_between_files,
+    diff_data,
+    diff_file,
+    get_cpu_executor,
+)
+from syftbox.server.sync.file_store import AsyncFileStore, FileStore, SyftFile
+from syftbox.server.sync.permissions import PermissionCache, get_permission_cache
+from syftbox.server.sync.single_flight import SingleFlight, get_single_flight
 from syftbox.server.users.auth import get_current_user
 
 from .models import (
+    COLUMNAR_MEDIA_TYPE,
+    DATASITE_ETAGS_HEADER,
     ApplyDiffRequest,
     ApplyDiffResponse,
     BatchFileRequest,
+    BulkUploadResponse,
+    DeltaRequest,
     DiffRequest,
     DiffResponse,
+    DirDigestRequest,
+    DirDigestResponse,
     FileMetadata,
     FileMetadataRequest,
     FileRequest,
@@ -32,194 +64,622 @@ from .models import (
 )
 
 
-def get_db_connection(request: Request):
-    conn = get_db(request.state.server_settings.file_db_path)
-    yield conn
-    conn.close()
-
-
-def get_file_store(request: Request):
+async def get_file_store(request: Request) -> AsyncFileStore:
     store = FileStore(
         server_settings=request.state.server_settings,
+        content_cache=request.state.content_cache,
     )
-    yield store
+    return AsyncFileStore(store, limiter=request.state.io_limiter, metrics=request.state.metrics)
 
 
-router = APIRouter(prefix="/sync", tags=["sync"])
+router = APIRouter(prefix="/sync", tags=["sync"], dependencies=[Depends(rate_limit)])
+
+
+def _cpu_executor_busy(e: CPUExecutorBusy) -> HTTPException:
+    return HTTPException(status_code=503, detail=f"server is busy: {e}", headers={"Retry-After": "1"})
 
 
 @router.post("/get_diff", response_model=DiffResponse)
-def get_diff(
+async def get_diff(
     req: DiffRequest,
-    file_store: FileStore = Depends(get_file_store),
+    response: Response,
+    file_store: AsyncFileStore = Depends(get_file_store),
+    cpu_executor: CPUExecutor = Depends(get_cpu_executor),
     email: str = Depends(get_current_user),
 ) -> DiffResponse:
     try:
-        file = file_store.get(req.path)
+        metadata = await file_store.get_metadata(req.path)
     except ValueError:
         raise HTTPException(status_code=404, detail="file not found")
-    diff = py_fast_rsync.diff(req.signature_bytes, file.data)
+
+    abs_path = file_store.server_settings.snapshot_folder / metadata.path
+    try:
+        data = await file_store.read_cached(metadata)
+        if data is not None:
+            diff, timing = await cpu_executor.run(diff_data, data, req.signature_bytes)
+        else:
+            diff, timing = await cpu_executor.run(diff_file, abs_path, req.signature_bytes)
+    except CPUExecutorBusy as e:
+        raise _cpu_executor_busy(e)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="file not found")
+
+    response.headers["Server-Timing"] = timing.server_timing()
     diff_bytes = base64.b85encode(diff).decode("utf-8")
     return DiffResponse(
-        path=file.metadata.path.as_posix(),
+        path=metadata.path.as_posix(),
         diff=diff_bytes,
-        hash=file.metadata.hash,
+        hash=metadata.hash,
+    )
+
+
+@router.post("/get_delta", response_model=DiffResponse)
+async def get_delta(
+    req: DeltaRequest,
+    response: Response,
+    file_store: AsyncFileStore = Depends(get_file_store),
+    cpu_executor: CPUExecutor = Depends(get_cpu_executor),
+    delta_cache: DeltaCache = Depends(get_delta_cache),
+    email: str = Depends(get_current_user),
+) -> DiffResponse:
+    """
+    Returns the diff from a previous version of a file, identified by its hash, to the current version.
+    Unlike `/sync/get_diff`, the client does not need to send a signature, and the diff is shared between clients.
+    """
+    try:
+        metadata = await file_store.get_metadata(req.path)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="file not found")
+
+    version_path = await file_store.get_version_path(metadata.path, req.from_hash)
+    if version_path is None:
+        raise HTTPException(status_code=404, detail="version not found")
+
+    abs_path = file_store.server_settings.snapshot_folder / metadata.path
+
+    async def compute_delta():
+        (diff, new_hash), timing = await cpu_executor.run(delta_between_files, version_path, abs_path)
+        response.headers["Server-Timing"] = timing.server_timing()
+        return diff, new_hash
+
+    try:
+        diff, new_hash = await delta_cache.get_or_compute(req.from_hash, metadata.hash, compute_delta)
+    except CPUExecutorBusy as e:
+        raise _cpu_executor_busy(e)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="file not found")
+
+    return DiffResponse(
+        path=metadata.path.as_posix(),
+        diff=base64.b85encode(diff).decode("utf-8"),
+        hash=new_hash,
     )
 
 
-@router.post("/datasite_states", response_model=dict[str, list[FileMetadata]])
-def get_datasite_states(
-    conn: sqlite3.Connection = Depends(get_db_connection),
-    file_store: FileStore = Depends(get_file_store),
-    server_settings: ServerSettings = Depends(get_server_settings),
+def _datasite_etag(epoch: str, datasite: str, version: int) -> str:
+    token = hashlib.sha256(f"{epoch}:{datasite}:{version}".encode()).hexdigest()[:16]
+    return f'"{token}"'
+
+
+def _parse_etags(header_value: Optional[str]) -> set[str]:
+    if not header_value:
+        return set()
+    return {value.strip().removeprefix("W/") for value in header_value.split(",") if value.strip()}
+
+
+def _get_permission_tree(conn: sqlite3.Connection, permission_cache: PermissionCache, dir: RelativePath):
+    datasite = dir.parts[0] if dir.parts else ""
+    perm_tree = permission_cache.get(conn, datasite)
+    if perm_tree.corrupted_permission_files:
+        raise HTTPException(status_code=500, detail=f"Failed to parse permission tree: {dir}")
+    return perm_tree
+
+
+def _filtered_dir_state(
+    dir: RelativePath,
+    conn: sqlite3.Connection,
+    email: str,
+    single_flight: Optional[SingleFlight] = None,
+    version: Optional[int] = None,
+    read_all: bool = False,
+) -> list[dict[str, Any]]:
+    """
+    Returns the metadata of all files below dir readable by email, as JSON-serializable dicts.
+    If read_all is set, permissions are not checked, see `_can_read_all`.
+
+    If the datasite version is known, identical concurrent requests share a single query through single_flight.
+    The returned list may be shared between requests, and should not be modified.
+    """
+    datasite = dir.parts[0] if dir.parts else ""
+
+    def compute() -> list[dict[str, Any]]:
+        if get_corrupted_permission_files(conn, datasite):
+            raise HTTPException(status_code=500, detail=f"Failed to parse permission tree: {dir}")
+        if read_all:
+            return get_all_metadata_dicts(conn, dir.as_posix())
+        # the read state for this user is filtered by the ACL tables in the query
+        return get_readable_metadata_dicts(conn, email, dir.as_posix())
+
+    if single_flight is None or version is None:
+        return compute()
+    return single_flight.do(("dir_state", dir.as_posix(), version, email), compute)
+
+
+def _can_read_all(server_settings: ServerSettings, email: str) -> bool:
+    """Mirror servers list all files, so they can serve every user from their copy."""
+    return email in server_settings.mirror_emails
+
+
+def _json_response(content: Any, headers: Optional[dict[str, str]] = None) -> Response:
+    """
+    Serialize trusted data straight to JSON bytes.
+
+    Listings can contain hundreds of thousands of rows, which are read from our own database.
+    Returning a Response skips the response_model validation and jsonable_encoder of FastAPI,
+    the response_model of the endpoint is only used for the OpenAPI schema.
+    """
+    body = json.dumps(content, ensure_ascii=False, check_circular=False, separators=(",", ":")).encode()
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+@router.post("/datasite_states", response_model=dict[str, Optional[list[FileMetadata]]])
+async def get_datasite_states(
+    file_store: AsyncFileStore = Depends(get_file_store),
+    single_flight: SingleFlight = Depends(get_single_flight),
     email: str = Depends(get_current_user),
-) -> dict[str, list[FileMetadata]]:
-    all_datasites = get_all_datasites(conn)
-    datasite_states: dict[str, list[FileMetadata]] = {}
-    for datasite in all_datasites:
+    if_none_match: Optional[str] = Header(default=None),
+    accept: Optional[str] = Header(default=None),
+    incremental: bool = False,
+) -> Response:
+    """
+    Get the state of all datasites visible to the current user.
+
+    Clients can send the per-datasite ETags from a previous response in the If-None-Match header.
+    Datasites with a matching ETag are unchanged, and are returned with a `null` state.
+    The ETags of all returned states are sent as a JSON object in the `X-Syftbox-Datasite-ETags` header.
+    If no datasite has changed, a 304 is returned.
+
+    If `incremental` is set, changed datasites are also returned with a `null` state and their new ETag,
+    so the client can update its previous state with `/sync/dir_digest` instead of receiving the full state.
+
+    Clients that accept `application/vnd.syftbox.columnar` receive the states in the compact encoding
+    of `syftbox.server.sync.columnar` instead of JSON.
+    """
+    read_all = _can_read_all(file_store.server_settings, email)
+    return await file_store.run_db(
+        _get_datasite_states, single_flight, email, if_none_match, accept, incremental, read_all
+    )
+
+
+def _get_datasite_states(
+    conn: sqlite3.Connection,
+    single_flight: SingleFlight,
+    email: str,
+    if_none_match: Optional[str],
+    accept: Optional[str],
+    incremental: bool,
+    read_all: bool = False,
+) -> Response:
+    epoch = get_server_epoch(conn)
+    datasite_versions = get_datasite_versions(conn)
+    datasite_etags = {
+        datasite: _datasite_etag(epoch, datasite, version) for datasite, version in datasite_versions.items()
+    }
+    known_etags = _parse_etags(if_none_match)
+    if known_etags and known_etags == set(datasite_etags.values()):
+        return Response(status_code=304)
+
+    datasite_states: dict[str, Optional[list[dict[str, Any]]]] = {}
+    changed_etags: dict[str, str] = {}
+    for datasite, etag in datasite_etags.items():
+        if etag in known_etags:
+            datasite_states[datasite] = None
+            continue
+        if incremental:
+            datasite_states[datasite] = None
+            changed_etags[datasite] = etag
+            continue
         try:
-            datasite_state = dir_state(RelativePath(datasite), file_store, server_settings, email)
+            datasite_state = _filtered_dir_state(
+                RelativePath(datasite), conn, email, single_flight, datasite_versions[datasite], read_all
+            )
         except Exception as e:
             logger.error(f"Failed to get dir state for {datasite}: {e}")
             continue
         datasite_states[datasite] = datasite_state
+        changed_etags[datasite] = etag
 
-    return datasite_states
+    headers = {DATASITE_ETAGS_HEADER: json.dumps(changed_etags), "Vary": "Accept"}
+    if accept is not None and COLUMNAR_MEDIA_TYPE in accept:
+        try:
+            content = columnar.encode_datasite_states(datasite_states)
+            return Response(content=content, media_type=COLUMNAR_MEDIA_TYPE, headers=headers)
+        except columnar.ColumnarEncodeError as e:
+            logger.warning(f"Falling back to JSON for datasite states: {e}")
+    return _json_response(datasite_states, headers=headers)
 
 
 @router.post("/dir_state", response_model=list[FileMetadata])
-def dir_state(
+async def dir_state(
     dir: RelativePath,
-    file_store: FileStore = Depends(get_file_store),
-    server_settings: ServerSettings = Depends(get_server_settings),
+    file_store: AsyncFileStore = Depends(get_file_store),
+    single_flight: SingleFlight = Depends(get_single_flight),
     email: str = Depends(get_current_user),
-) -> list[FileMetadata]:
-    full_path = server_settings.snapshot_folder / dir
-    # get the top level perm file
-    try:
-        perm_tree = PermissionTree.from_path(full_path, raise_on_corrupted_files=True)
-    except ValueError:
-        raise HTTPException(status_code=500, detail=f"Failed to parse permission tree: {dir}")
+    if_none_match: Optional[str] = Header(default=None),
+) -> Response:
+    read_all = _can_read_all(file_store.server_settings, email)
+    return await file_store.run_db(_dir_state, dir, single_flight, email, if_none_match, read_all)
 
-    # filter the read state for this user by the perm tree
-    metadata_list = file_store.list(dir)
-    filtered_metadata = filter_metadata(email, metadata_list, perm_tree, server_settings.snapshot_folder)
-    return filtered_metadata
+
+def _dir_state(
+    conn: sqlite3.Connection,
+    dir: RelativePath,
+    single_flight: SingleFlight,
+    email: str,
+    if_none_match: Optional[str],
+    read_all: bool = False,
+) -> Response:
+    datasite = dir.parts[0] if dir.parts else ""
+    version = get_datasite_version(conn, datasite)
+    headers = {}
+    if version is not None:
+        etag = _datasite_etag(get_server_epoch(conn), datasite, version)
+        if etag in _parse_etags(if_none_match):
+            return Response(status_code=304, headers={"ETag": etag})
+        headers["ETag"] = etag
+
+    return _json_response(_filtered_dir_state(dir, conn, email, single_flight, version, read_all), headers=headers)
+
+
+@router.post("/dir_digest", response_model=DirDigestResponse)
+async def get_dir_digest(
+    req: DirDigestRequest,
+    file_store: AsyncFileStore = Depends(get_file_store),
+    permission_cache: PermissionCache = Depends(get_permission_cache),
+    email: str = Depends(get_current_user),
+) -> DirDigestResponse:
+    """
+    Get the digest of a directory, the digests of its subdirectories and the files directly inside it.
+
+    Digests only include files the current user can read. Subtrees that are fully readable use the digest
+    stored in the database, other subtrees are computed from their readable files.
+    """
+    if not req.path.parts:
+        raise HTTPException(status_code=400, detail="path should be inside a datasite")
+    return await file_store.run_db(_dir_digest, req, file_store.server_settings, permission_cache, email)
+
+
+def _dir_digest(
+    conn: sqlite3.Connection,
+    req: DirDigestRequest,
+    server_settings: ServerSettings,
+    permission_cache: PermissionCache,
+    email: str,
+) -> DirDigestResponse:
+    snapshot_folder = server_settings.snapshot_folder
+    perm_tree = _get_permission_tree(conn, permission_cache, req.path)
+
+    files = filter_metadata(email, get_dir_files(conn, req.path.as_posix()), perm_tree, snapshot_folder)
+    digest = merkle.compute_digest(files)
+
+    child_digests = {}
+    for child_dir, child_digest in get_child_dir_digests(conn, req.path.as_posix()).items():
+        if not perm_tree.can_read_all(email, (snapshot_folder / child_dir).as_posix()):
+            readable_files = get_readable_metadata(conn, email, child_dir)
+            if not readable_files:
+                continue
+            child_digest = merkle.digest_to_hex(merkle.compute_digest(readable_files))
+        child_digests[child_dir] = child_digest
+        digest ^= merkle.digest_from_hex(child_digest)
+
+    return DirDigestResponse(
+        path=req.path,
+        digest=merkle.digest_to_hex(digest) if files or child_digests else None,
+        dirs=child_digests,
+        files=files,
+    )
 
 
 @router.post("/get_metadata", response_model=FileMetadata)
-def get_metadata(
+async def get_metadata(
     req: FileMetadataRequest,
-    file_store: FileStore = Depends(get_file_store),
+    file_store: AsyncFileStore = Depends(get_file_store),
     email: str = Depends(get_current_user),
 ) -> FileMetadata:
     try:
-        metadata = file_store.get_metadata(req.path_like)
+        metadata = await file_store.get_metadata(req.path_like)
         return metadata
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 
 @router.post("/apply_diff", response_model=ApplyDiffResponse)
-def apply_diffs(
+async def apply_diffs(
     req: ApplyDiffRequest,
-    file_store: FileStore = Depends(get_file_store),
+    response: Response,
+    file_store: AsyncFileStore = Depends(get_file_store),
+    cpu_executor: CPUExecutor = Depends(get_cpu_executor),
+    analytics_queue: AnalyticsQueue = Depends(get_analytics_queue),
     email: str = Depends(get_current_user),
 ) -> ApplyDiffResponse:
     try:
-        file = file_store.get(req.path)
+        metadata = await file_store.get_metadata(req.path)
     except ValueError:
         raise HTTPException(status_code=404, detail="file not found")
 
-    result = py_fast_rsync.apply(file.data, req.diff_bytes)
-    new_hash = hashlib.sha256(result).hexdigest()
+    abs_path = file_store.server_settings.snapshot_folder / metadata.path
+    try:
+        (result, new_hash), timing = await cpu_executor.run(apply_diff_to_file, abs_path, req.diff_bytes)
+    except CPUExecutorBusy as e:
+        raise _cpu_executor_busy(e)
+    except FileNotFoundError:
+        await file_store.delete(metadata.path)
+        raise HTTPException(status_code=404, detail="file not found")
 
     if new_hash != req.expected_hash:
         raise HTTPException(status_code=400, detail="hash mismatch, skipped writing")
 
-    if SyftPermission.is_permission_file(file.metadata.path) and not SyftPermission.is_valid(result):
+    if SyftPermission.is_permission_file(metadata.path) and not SyftPermission.is_valid(result):
         raise HTTPException(status_code=400, detail="invalid syftpermission contents, skipped writing")
 
-    file_store.put(req.path, result)
-
-    log_file_change_event(
-        "/sync/apply_diff",
-        email=email,
-        relative_path=req.path,
-        file_store=file_store,
-    )
+    new_metadata = await file_store.put(req.path, result)
+    analytics_queue.log_file_change("/sync/apply_diff", email, new_metadata)
 
-    return ApplyDiffResponse(path=req.path, current_hash=new_hash, previous_hash=file.metadata.hash)
+    response.headers["Server-Timing"] = timing.server_timing()
+    return ApplyDiffResponse(path=req.path, current_hash=new_hash, previous_hash=metadata.hash)
 
 
 @router.post("/delete", response_class=JSONResponse)
-def delete_file(
+async def delete_file(
     req: FileRequest,
-    file_store: FileStore = Depends(get_file_store),
+    file_store: AsyncFileStore = Depends(get_file_store),
+    analytics_queue: AnalyticsQueue = Depends(get_analytics_queue),
     email: str = Depends(get_current_user),
 ) -> JSONResponse:
-    log_file_change_event(
-        "/sync/delete",
-        email=email,
-        relative_path=req.path,
-        file_store=file_store,
-    )
-
-    file_store.delete(req.path)
+    metadata = await file_store.delete(req.path)
+    if metadata is not None:
+        analytics_queue.log_file_change("/sync/delete", email, metadata)
     return JSONResponse(content={"status": "success"})
 
 
 @router.post("/create", response_class=JSONResponse)
-def create_file(
+async def create_file(
     file: UploadFile,
-    file_store: FileStore = Depends(get_file_store),
+    file_store: AsyncFileStore = Depends(get_file_store),
+    analytics_queue: AnalyticsQueue = Depends(get_analytics_queue),
     email: str = Depends(get_current_user),
 ) -> JSONResponse:
     relative_path = RelativePath(file.filename)
     if "%" in file.filename:
         raise HTTPException(status_code=400, detail="filename cannot contain '%'")
 
-    if file_store.exists(relative_path):
+    if await file_store.exists(relative_path):
         raise HTTPException(status_code=400, detail="file already exists")
 
-    contents = file.file.read()
+    contents = await file.read()
 
     if SyftPermission.is_permission_file(relative_path) and not SyftPermission.is_valid(contents):
         raise HTTPException(status_code=400, detail="invalid syftpermission contents, skipped writing")
 
-    file_store.put(
-        relative_path,
-        contents,
-    )
-
-    log_file_change_event(
-        "/sync/create",
-        email=email,
-        relative_path=relative_path,
-        file_store=file_store,
-    )
+    metadata = await file_store.put(relative_path, contents)
+    analytics_queue.log_file_change("/sync/create", email, metadata)
     return JSONResponse(content={"status": "success"})
 
 
+# limits of a single bulk upload, checked against the zip directory before anything is extracted
+MAX_BULK_UPLOAD_FILES = 10_000
+MAX_BULK_UPLOAD_BYTES = 512 * 1024 * 1024
+
+
+def read_upload_zip(
+    upload: BinaryIO, datasite: str, file_store: FileStore
+) -> tuple[list[tuple[Path, FileMetadata]], dict[str, str]]:
+    """
+    Extract the files of a bulk upload. All files should be inside datasite.
+    Each valid file is streamed to a temporary file with `FileStore.write_temp`, so the upload is never in memory.
+    Returns the staged files for `FileStore.create_many`, and the reasons the other files were rejected keyed by
+    their path.
+    """
+    with zipfile.ZipFile(upload) as zf:
+        entries = [info for info in zf.infolist() if not info.is_dir()]
+        if len(entries) > MAX_BULK_UPLOAD_FILES:
+            raise HTTPException(status_code=413, detail=f"too many files, the maximum is {MAX_BULK_UPLOAD_FILES}")
+        if sum(info.file_size for info in entries) > MAX_BULK_UPLOAD_BYTES:
+            raise HTTPException(
+                status_code=413, detail=f"upload too large, the maximum is {MAX_BULK_UPLOAD_BYTES} bytes"
+            )
+
+        files: list[tuple[Path, FileMetadata]] = []
+        errors: dict[str, str] = {}
+        try:
+            for info in entries:
+                path = Path(info.filename)
+                if path.is_absolute() or ".." in path.parts or not path.parts or path.parts[0] != datasite:
+                    errors[info.filename] = f"path should be inside datasite {datasite}"
+                    continue
+                if "%" in info.filename:
+                    errors[info.filename] = "filename cannot contain '%'"
+                    continue
+                if SyftPermission.is_permission_file(path):
+                    # permission files are small, and are validated before they are written
+                    contents = zf.read(info)
+                    if not SyftPermission.is_valid(contents):
+                        errors[info.filename] = "invalid syftpermission contents, skipped writing"
+                        continue
+                    files.append(file_store.write_temp(path, contents))
+                else:
+                    with zf.open(info) as source:
+                        files.append(file_store.write_temp(path, source))
+        except BaseException:
+            for tmp_path, _ in files:
+                tmp_path.unlink(missing_ok=True)
+            raise
+    return files, errors
+
+
+@router.post("/upload_bulk", response_model=BulkUploadResponse)
+async def upload_bulk(
+    file: UploadFile,
+    file_store: AsyncFileStore = Depends(get_file_store),
+    analytics_queue: AnalyticsQueue = Depends(get_analytics_queue),
+    email: str = Depends(get_current_user),
+) -> BulkUploadResponse:
+    """
+    Create many files of a datasite at once, for example when a new datasite is seeded.
+
+    The upload is a zip archive of files, named after the datasite they are in. Files are validated like in
+    `/sync/create`, and the valid files are created in a single transaction.
+    Files that already exist or are invalid are not created, and are returned in `errors`.
+    """
+    datasite = file.filename or ""
+    if not datasite or "/" in datasite or datasite in (".", ".."):
+        raise HTTPException(status_code=400, detail="filename should be the datasite of the uploaded files")
+
+    try:
+        files, errors = await file_store.run(read_upload_zip, file.file, datasite, file_store.store)
+    except (zipfile.BadZipFile, zlib.error):
+        raise HTTPException(status_code=400, detail="upload is not a valid zip file")
+
+    created = await file_store.create_many(files)
+    for metadata in created:
+        analytics_queue.log_file_change("/sync/upload_bulk", email, metadata)
+
+    created_paths = {metadata.path for metadata in created}
+    for _, metadata in files:
+        if metadata.path not in created_paths:
+            errors[metadata.path.as_posix()] = "file already exists"
+    return BulkUploadResponse(created=[metadata.path for metadata in created], errors=errors)
+
+
 @router.post("/download", response_class=FileResponse)
-def download_file(
+async def download_file(
     req: FileRequest,
-    file_store: FileStore = Depends(get_file_store),
+    file_store: AsyncFileStore = Depends(get_file_store),
     email: str = Depends(get_current_user),
 ) -> FileResponse:
     try:
-        abs_path = file_store.get(req.path).absolute_path
-        return FileResponse(abs_path)
+        file = await file_store.get(req.path)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
+    # the contents are already in memory, don't read the file again
+    return Response(content=file.data, media_type=_guess_media_type(file.absolute_path))
+
+
+def _guess_media_type(path: Path) -> str:
+    # same default as FileResponse
+    return mimetypes.guess_type(path.name)[0] or "text/plain"
+
+
+def _parse_range_header(range_header: str, file_size: int) -> Optional[tuple[int, int]]:
+    """Parse a single `bytes=start-end` range into an inclusive (start, end) tuple.
+
+    Returns None for malformed or multi-range headers, these are served as a full response.
+    Raises a 416 if the range cannot be satisfied.
+    """
+    unit, _, byte_range = range_header.partition("=")
+    if unit.strip() != "bytes" or "," in byte_range:
+        return None
+
+    start_str, sep, end_str = byte_range.strip().partition("-")
+    if not sep:
+        return None
+
+    try:
+        if start_str == "":
+            # suffix range, e.g. bytes=-500 for the last 500 bytes
+            suffix_length = int(end_str)
+            start, end = max(file_size - suffix_length, 0), file_size - 1
+        else:
+            start = int(start_str)
+            end = int(end_str) if end_str else file_size - 1
+    except ValueError:
+        return None
+
+    end = min(end, file_size - 1)
+    if start < 0 or start > end:
+        raise HTTPException(
+            status_code=416,
+            detail="requested range not satisfiable",
+            headers={"Content-Range": f"bytes */{file_size}"},
+        )
+    return start, end
+
+
+def _etag_matches(header_value: Optional[str], etag: str) -> bool:
+    if header_value is None:
+        return False
+    candidates = [value.strip().removeprefix("W/") for value in header_value.split(",")]
+    return "*" in candidates or etag in candidates
+
+
+@router.get("/download/{path:path}")
+async def download_file_by_path(
+    path: str,
+    file_store: AsyncFileStore = Depends(get_file_store),
+    email: str = Depends(get_current_user),
+    range_header: Optional[str] = Header(default=None, alias="Range"),
+    if_range: Optional[str] = Header(default=None),
+    if_none_match: Optional[str] = Header(default=None),
+) -> Response:
+    """
+    Download a file by path, with support for conditional and partial requests.
+
+    The sha256 content hash is used as a strong ETag, so clients can resume an interrupted
+    download with `Range` + `If-Range`, or skip the download entirely with `If-None-Match`.
+    """
+    relative_path = RelativePath(path)
+    try:
+        metadata = await file_store.get_metadata(relative_path)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="file not found")
+
+    abs_path = file_store.server_settings.snapshot_folder / metadata.path
+    try:
+        file_size = (await file_store.run(abs_path.stat)).st_size
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="file not found")
+
+    etag = f'"{metadata.hash}"'
+    headers = {"ETag": etag, "Accept-Ranges": "bytes"}
+
+    if _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+
+    byte_range = None
+    if range_header is not None and (if_range is None or if_range.strip() == etag):
+        byte_range = _parse_range_header(range_header, file_size)
+
+    # hot files are served from the content cache, large files are streamed from disk
+    data = await file_store.read_cached(metadata)
+    if byte_range is None:
+        if data is not None:
+            return Response(content=data, headers=headers, media_type=_guess_media_type(abs_path))
+        return FileResponse(abs_path, headers=headers)
+
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{file_size}"
+    if data is not None:
+        return Response(
+            content=data[start : end + 1],
+            status_code=206,
+            headers=headers,
+            media_type="application/octet-stream",
+        )
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(
+        file_store.iter_bytes(abs_path, start, end + 1),
+        status_code=206,
+        headers=headers,
+        media_type="application/octet-stream",
+    )
 
 
 @router.post("/datasites", response_model=list[str])
-def get_datasites(
-    conn: sqlite3.Connection = Depends(get_db_connection),
+async def get_datasites(
+    file_store: AsyncFileStore = Depends(get_file_store),
     email: str = Depends(get_current_user),
 ) -> list[str]:
-    return get_all_datasites(conn)
+    return await file_store.run_db(get_all_datasites)
 
 
 def create_zip_from_files(files: list[SyftFile]) -> BytesIO:
@@ -234,16 +694,16 @@ def create_zip_from_files(files: list[SyftFile]) -> BytesIO:
 @router.post("/download_bulk")
 async def get_files(
     req: BatchFileRequest,
-    file_store: FileStore = Depends(get_file_store),
+    file_store: AsyncFileStore = Depends(get_file_store),
     email: str = Depends(get_current_user),
 ) -> StreamingResponse:
     all_files = []
     for path in req.paths:
         try:
-            file = file_store.get(path)
+            file = await file_store.get(path)
         except ValueError:
             logger.warning(f"File not found: {path}")
             continue
         all_files.append(file)
-    zip_file = create_zip_from_files(all_files)
-    return Response(content=zip_file.read(), media_type="application/zip")
+    zip_file = await file_store.run(create_zip_from_files, all_files)
+    return Response(content=zip_file.getvalue(), media_type="application/zip")
@@ -0,0 +1,93 @@
+"""
+Request coalescing for read endpoints.
+
+When many clients poll at the same time, they ask the server for the same listings.
+`SingleFlight.do` runs a computation once per key: concurrent callers with the same key wait for
+the result of the first caller, and the result is kept for `ttl` seconds to absorb bursts.
+
+Keys should include everything the result depends on, like the datasite version and the requesting user,
+so a cached result is never served to a user who may not read it.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import Callable, Hashable, TypeVar
+
+from fastapi import Request
+
+T = TypeVar("T")
+
+
+@dataclass
+class SingleFlightStats:
+    hits: int = 0
+    misses: int = 0
+    coalesced: int = 0
+
+
+class SingleFlight:
+    def __init__(self, ttl: float, max_entries: int = 1024) -> None:
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.stats = SingleFlightStats()
+        self._results: OrderedDict[Hashable, tuple[float, object]] = OrderedDict()
+        self._in_flight: dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._results)
+
+    def do(self, key: Hashable, fn: Callable[[], T]) -> T:
+        """
+        Returns fn(), or the result of a concurrent or recent call with the same key.
+        Exceptions raised by fn are raised for all callers that waited for it, and are not cached.
+        """
+        now = time.monotonic()
+        with self._lock:
+            cached = self._results.get(key)
+            if cached is not None and cached[0] > now:
+                self.stats.hits += 1
+                return cached[1]  # type: ignore[return-value]
+
+            future = self._in_flight.get(key)
+            is_leader = future is None
+            if is_leader:
+                self.stats.misses += 1
+                future = self._in_flight[key] = Future()
+            else:
+                self.stats.coalesced += 1
+
+        if not is_leader:
+            return future.result()
+
+        try:
+            result = fn()
+        except BaseException as e:
+            with self._lock:
+                del self._in_flight[key]
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            if self.ttl > 0:
+                self._store(key, result, time.monotonic())
+            del self._in_flight[key]
+        future.set_result(result)
+        return result
+
+    def _store(self, key: Hashable, result: object, now: float) -> None:
+        self._results.pop(key, None)
+        self._results[key] = (now + self.ttl, result)
+        # entries are ordered by expiry time, since the ttl is the same for all entries
+        while self._results:
+            oldest_key, (expires_at, _) = next(iter(self._results.items()))
+            if expires_at > now and len(self._results) <= self.max_entries:
+                break
+            del self._results[oldest_key]
+
+
+async def get_single_flight(request: Request) -> SingleFlight:
+    return request.state.single_flight
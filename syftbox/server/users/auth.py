@@ -7,6 +7,7 @@ from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 import httpx
 import jwt
 from syftbox.server.settings import ServerSettings, get_server_settings
+from syftbox.server.users.token_cache import TokenCache, get_token_cache
 
 bearer_scheme = HTTPBearer()
 
@@ -94,9 +95,14 @@ def get_user_from_email_token(
     return payload["email"]
 
 
-def get_current_user(
+async def get_current_user(
     credentials: Annotated[HTTPAuthorizationCredentials, Security(bearer_scheme)],
     server_settings: Annotated[ServerSettings, Depends(get_server_settings)],
+    token_cache: Annotated[TokenCache, Depends(get_token_cache)],
 ) -> str:
-    payload = validate_access_token(server_settings, credentials.credentials)
+    # clients send the same token with every request, only the first request verifies its signature
+    payload = token_cache.get(credentials.credentials)
+    if payload is None:
+        payload = validate_access_token(server_settings, credentials.credentials)
+        token_cache.put(credentials.credentials, payload)
     return payload["email"]
\ No newline at end of file
@@ -3,7 +3,7 @@ from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel, EmailStr
 
 from syftbox.lib.email import send_token_email
-from syftbox.server.analytics import log_analytics_event
+from syftbox.server.analytics import AnalyticsQueue, get_analytics_queue
 from syftbox.server.settings import ServerSettings, get_server_settings
 from syftbox.server.users.auth import generate_access_token, generate_email_token, get_user_from_email_token, get_current_user
 
@@ -68,6 +68,7 @@ class WhoAmIResponse(BaseModel):
 @router.post("/whoami")
 def whoami(
     email: str = Depends(get_current_user),
+    analytics_queue: AnalyticsQueue = Depends(get_analytics_queue),
 ) -> WhoAmIResponse:
     """
     Get the current users email.
@@ -76,5 +77,5 @@ def whoami(
     Returns:
         str: email
     """
-    log_analytics_event("/auth/whoami", email=email)
+    analytics_queue.submit("/auth/whoami", email)
     return WhoAmIResponse(email=email)
\ No newline at end of file
@@ -0,0 +1,80 @@
+"""
+Cache of validated access tokens.
+
+Every authenticated request validates its access token, which verifies the HMAC signature of the JWT.
+Clients send the same token with every request, so validated tokens are cached and later requests with the
+same token skip the verification. Entries are keyed by a sha256 hash of the token, so the cache does not hold
+usable credentials, and expire with the `exp` claim of their token.
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+from fastapi import Request
+
+
+@dataclass
+class TokenCacheStats:
+    hits: int = 0
+    misses: int = 0
+    expired: int = 0
+    evictions: int = 0
+
+
+class TokenCache:
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self.stats = TokenCacheStats()
+        # token hash -> (payload, expiry as unix time or None)
+        self._tokens: OrderedDict[bytes, tuple[dict, Optional[float]]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._tokens)
+
+    @staticmethod
+    def _key(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token: str) -> Optional[dict]:
+        """The payload of a validated token, or None if it is not cached or has expired."""
+        key = self._key(token)
+        with self._lock:
+            entry = self._tokens.get(key)
+            if entry is None:
+                self.stats.misses += 1
+                return None
+            payload, expires_at = entry
+            if expires_at is not None and time.time() >= expires_at:
+                del self._tokens[key]
+                self.stats.expired += 1
+                self.stats.misses += 1
+                return None
+            self._tokens.move_to_end(key)
+            self.stats.hits += 1
+            return payload
+
+    def put(self, token: str, payload: dict) -> None:
+        """Cache the payload of a token that was validated."""
+        if self.max_size == 0:
+            return
+        key = self._key(token)
+        expires_at = payload.get("exp")
+        with self._lock:
+            self._tokens[key] = (payload, float(expires_at) if expires_at is not None else None)
+            self._tokens.move_to_end(key)
+            while len(self._tokens) > self.max_size:
+                self._tokens.popitem(last=False)
+                self.stats.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._tokens.clear()
+
+
+async def get_token_cache(request: Request) -> TokenCache:
+    return request.state.token_cache
@@ -0,0 +1,72 @@
+"""
+Benchmark for listings filtered by the ACL tables, with a growing number of permission files.
+
+Compares get_readable_metadata for the datasite owner, who can read all files, and for a user who can read
+1% of the files, against the unfiltered get_all_metadata_dicts.
+
+Usage: python -m tests.stress.benchmarks.acl_listing [n_files]
+"""
+
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from syftbox.lib.lib import SyftPermission
+from syftbox.server.sync import db
+from syftbox.server.sync.models import FileMetadata
+
+DATASITE = "user@openmined.org"
+OTHER = "other@openmined.org"
+N_SCOPES = [10, 1_000, 5_000]
+
+
+def build_db(path: Path, n_files: int, n_scopes: int):
+    conn = db.get_db(path)
+    cursor = conn.cursor()
+    db.save_acl(cursor, f"{DATASITE}/_.syftperm", SyftPermission.datasite_default(DATASITE))
+    for i in range(n_scopes):
+        # the first 1% of the scopes are readable by OTHER
+        if i < max(1, n_scopes // 100):
+            perm = SyftPermission.theirs_with_my_read(DATASITE, OTHER)
+        else:
+            perm = SyftPermission.datasite_default(DATASITE)
+        db.save_acl(cursor, f"{DATASITE}/dir{i:05}/_.syftperm", perm)
+    for i in range(n_files):
+        metadata = FileMetadata(
+            path=Path(f"{DATASITE}/dir{i % n_scopes:05}/sub/file{i}.txt"),
+            hash="hash",
+            signature=b"",
+            file_size=0,
+            last_modified=datetime.now(timezone.utc),
+        )
+        db.save_file_metadata(cursor, metadata)
+    conn.commit()
+    return conn
+
+
+def timed(fn, *args) -> tuple[float, list]:
+    start = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - start, result
+
+
+def main(n_files: int) -> None:
+    for n_scopes in N_SCOPES:
+        with tempfile.TemporaryDirectory() as tmp:
+            conn = build_db(Path(tmp) / "files.db", n_files, n_scopes)
+            all_time, all_files = timed(db.get_all_metadata_dicts, conn, DATASITE)
+            owner_time, owner_files = timed(db.get_readable_metadata_dicts, conn, DATASITE, DATASITE)
+            other_time, other_files = timed(db.get_readable_metadata_dicts, conn, OTHER, DATASITE)
+            assert len(owner_files) == len(all_files)
+            conn.close()
+
+        print(f"files: {n_files}, scopes: {n_scopes}")
+        print(f"  unfiltered:              {all_time * 1000:.1f} ms")
+        print(f"  owner, all readable:     {owner_time * 1000:.1f} ms")
+        print(f"  other, {len(other_files):>5} readable:   {other_time * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20_000)
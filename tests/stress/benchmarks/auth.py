@@ -0,0 +1,74 @@
+"""
+Benchmark for access token validation on the request hot path.
+
+Compares validating an access token with jwt.decode against a lookup in the TokenCache, and the end-to-end
+time of an unauthenticated request (/info) and an authenticated request (/auth/whoami) with and without the cache.
+
+Usage: python -m tests.stress.benchmarks.auth [n_requests]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+from fastapi.testclient import TestClient
+
+from syftbox.server.server import app
+from syftbox.server.settings import ServerSettings
+from syftbox.server.users.auth import generate_access_token, validate_access_token
+from syftbox.server.users.token_cache import TokenCache
+from tests.unit.server.conftest import get_access_token
+
+EMAIL = "user@openmined.org"
+N_VALIDATIONS = 100_000
+
+
+def per_call(fn, n: int) -> float:
+    start = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter() - start) / n
+
+
+def benchmark_validation(settings: ServerSettings) -> None:
+    token = generate_access_token(settings, EMAIL)
+    token_cache = TokenCache(max_size=10_000)
+    token_cache.put(token, validate_access_token(settings, token))
+
+    decode_time = per_call(lambda: validate_access_token(settings, token), N_VALIDATIONS)
+    cached_time = per_call(lambda: token_cache.get(token), N_VALIDATIONS)
+    print(f"jwt.decode:        {decode_time * 1e6:.1f} us")
+    print(f"token cache hit:   {cached_time * 1e6:.1f} us")
+
+
+def benchmark_requests(settings: ServerSettings, n_requests: int) -> None:
+    with TestClient(app) as client:
+        client.headers["Authorization"] = f"Bearer {get_access_token(client, EMAIL)}"
+        token_cache: TokenCache = client.app_state["token_cache"]
+
+        unauthenticated_time = per_call(lambda: client.get("/info"), n_requests)
+        cached_time = per_call(lambda: client.post("/auth/whoami"), n_requests)
+        token_cache.max_size = 0
+        token_cache.clear()
+        uncached_time = per_call(lambda: client.post("/auth/whoami"), n_requests)
+
+    print(f"requests:                       {n_requests}")
+    print(f"unauthenticated (/info):        {unauthenticated_time * 1e3:.3f} ms")
+    print(f"authenticated, cached token:    {cached_time * 1e3:.3f} ms")
+    print(f"authenticated, uncached token:  {uncached_time * 1e3:.3f} ms")
+
+
+def main(n_requests: int) -> None:
+    with tempfile.TemporaryDirectory() as data_folder:
+        settings = ServerSettings.from_data_folder(data_folder)
+        os.environ["SYFTBOX_DATA_FOLDER"] = str(settings.data_folder)
+        os.environ["SYFTBOX_SNAPSHOT_FOLDER"] = str(settings.snapshot_folder)
+        os.environ["SYFTBOX_USER_FILE_PATH"] = str(settings.user_file_path)
+
+        benchmark_validation(settings)
+        benchmark_requests(settings, n_requests)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2_000)
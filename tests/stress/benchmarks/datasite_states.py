@@ -0,0 +1,105 @@
+"""
+Benchmark for a large /sync/datasite_states response.
+
+Measures the end-to-end time of the fast serialization path (request, JSON decoding and FileMetadata
+decoding on the client), and compares it with the previous pipeline: building a FileMetadata per row,
+response_model validation and jsonable_encoder on the server, and a FileMetadata per entry on the client.
+
+Also compares the size and time of the columnar encoding, see `syftbox.server.sync.columnar`.
+
+Usage: python -m tests.stress.benchmarks.datasite_states [n_rows]
+"""
+
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Optional
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.testclient import TestClient
+from pydantic import TypeAdapter
+
+from syftbox.client.plugins.sync.endpoints import get_datasite_states, get_datasite_states_if_changed
+from syftbox.lib.lib import SyftPermission
+from syftbox.server.server import app
+from syftbox.server.settings import ServerSettings
+from syftbox.server.sync import db
+from syftbox.server.sync.file_store import FileStore
+from syftbox.server.sync.models import COLUMNAR_MEDIA_TYPE, FileMetadata
+from tests.unit.server.conftest import get_access_token
+
+DATASITE = "user@openmined.org"
+
+
+def create_rows(settings: ServerSettings, n_rows: int) -> None:
+    settings.snapshot_folder.mkdir(parents=True)
+    perm = SyftPermission.datasite_default(DATASITE)
+    FileStore(settings).put(Path(DATASITE) / "_.syftperm", json.dumps(perm.to_dict()).encode())
+
+    last_modified = datetime.now(timezone.utc).isoformat()
+    conn = db.get_db(settings.file_db_path)
+    conn.executemany(
+        "INSERT INTO file_metadata (path, hash, signature, file_size, last_modified) VALUES (?, ?, ?, ?, ?)",
+        ((f"{DATASITE}/dir{i % 1000}/file{i}.txt", f"{i:064x}", "signature", i, last_modified) for i in range(n_rows)),
+    )
+    conn.commit()
+    conn.close()
+
+
+def previous_server(settings: ServerSettings) -> bytes:
+    conn = db.get_db(settings.file_db_path)
+    states = {DATASITE: db.get_readable_metadata(conn, DATASITE, DATASITE)}
+    conn.close()
+    adapter = TypeAdapter(dict[str, Optional[list[FileMetadata]]])
+    return json.dumps(jsonable_encoder(adapter.validate_python(states))).encode()
+
+
+def previous_client(body: bytes) -> dict[str, list[FileMetadata]]:
+    data = json.loads(body)
+    return {datasite: [FileMetadata(**item) for item in metadata_list] for datasite, metadata_list in data.items()}
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def main(n_rows: int) -> None:
+    with tempfile.TemporaryDirectory() as data_folder:
+        settings = ServerSettings.from_data_folder(data_folder)
+        os.environ["SYFTBOX_DATA_FOLDER"] = str(settings.data_folder)
+        os.environ["SYFTBOX_SNAPSHOT_FOLDER"] = str(settings.snapshot_folder)
+        os.environ["SYFTBOX_USER_FILE_PATH"] = str(settings.user_file_path)
+        create_rows(settings, n_rows)
+
+        with TestClient(app) as client:
+            client.headers["Authorization"] = f"Bearer {get_access_token(client, DATASITE)}"
+            end_to_end_time, states = timed(get_datasite_states, client, DATASITE)
+            request_time, json_response = timed(client.post, "/sync/datasite_states")
+            columnar_end_to_end_time, _ = timed(get_datasite_states_if_changed, client, {})
+            columnar_request_time, columnar_response = timed(
+                client.post, "/sync/datasite_states", headers={"Accept": COLUMNAR_MEDIA_TYPE}
+            )
+
+        previous_server_time, body = timed(previous_server, settings)
+        previous_client_time, previous_states = timed(previous_client, body)
+
+    assert len(states[DATASITE]) == len(previous_states[DATASITE]) == n_rows + 1
+    print(f"rows: {n_rows}")
+    print(f"fast path, end-to-end:    {end_to_end_time:.2f} s")
+    print(f"fast path, request only:  {request_time:.2f} s")
+    print(f"previous server encoding: {previous_server_time:.2f} s")
+    print(f"previous client decoding: {previous_client_time:.2f} s")
+    print(f"columnar, end-to-end:     {columnar_end_to_end_time:.2f} s")
+    print(f"columnar, request only:   {columnar_request_time:.2f} s")
+    print(f"json size:                {len(json_response.content) / 1e6:.1f} MB")
+    print(f"columnar size:            {len(columnar_response.content) / 1e6:.1f} MB")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 500_000)
@@ -0,0 +1,79 @@
+"""
+Microbenchmark for filtering file metadata by read permission.
+
+Compares resolving the permission of every file with PermissionTree.permission_for_path
+against the PermissionTrie used by filter_metadata.
+
+Usage: python -m tests.stress.benchmarks.permissions [n_files]
+"""
+
+import sys
+import time
+from pathlib import Path
+
+from syftbox.lib.lib import PermissionTree, SyftPermission, can_read, filter_metadata, perm_file_path
+from syftbox.server.sync.models import FileMetadata
+
+SNAPSHOT_FOLDER = Path("/snapshot")
+DATASITE = "user@openmined.org"
+N_DIRS = 1_000
+DEPTH = 4
+
+
+def build_tree() -> PermissionTree:
+    parent_path = (SNAPSHOT_FOLDER / DATASITE).as_posix()
+    tree = {perm_file_path(parent_path): SyftPermission.datasite_default(DATASITE)}
+    for i in range(0, N_DIRS, 10):
+        tree[perm_file_path(f"{parent_path}/{dir_path(i)}")] = SyftPermission.mine_with_public_read(DATASITE)
+    return PermissionTree(tree=tree, parent_path=parent_path, root_perm=tree[perm_file_path(parent_path)])
+
+
+def dir_path(i: int) -> str:
+    return "/".join(f"dir{i % (j + 2)}" for j in range(DEPTH)) + f"/leaf{i}"
+
+
+def build_metadata(n_files: int) -> list[FileMetadata]:
+    return [
+        FileMetadata(
+            path=Path(f"{DATASITE}/{dir_path(i % N_DIRS)}/file{i}.txt"),
+            hash="hash",
+            signature=b"",
+            file_size=0,
+            last_modified=0,
+        )
+        for i in range(n_files)
+    ]
+
+
+def filter_per_file(user_email: str, metadata_list: list[FileMetadata], perm_tree: PermissionTree) -> list:
+    return [
+        metadata
+        for metadata in metadata_list
+        if can_read(user_email, perm_tree.permission_for_path((SNAPSHOT_FOLDER / metadata.path).as_posix()))
+    ]
+
+
+def timed(fn, *args) -> tuple[float, list]:
+    start = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - start, result
+
+
+def main(n_files: int) -> None:
+    perm_tree = build_tree()
+    metadata = build_metadata(n_files)
+    user = "other@openmined.org"
+
+    per_file_time, expected = timed(filter_per_file, user, metadata, perm_tree)
+    cold_time, result = timed(filter_metadata, user, metadata, perm_tree, SNAPSHOT_FOLDER)
+    warm_time, _ = timed(filter_metadata, user, metadata, perm_tree, SNAPSHOT_FOLDER)
+    assert result == expected
+
+    print(f"files: {n_files}, permission files: {len(perm_tree.tree)}, readable: {len(result)}")
+    print(f"permission_for_path per file: {per_file_time * 1000:.1f} ms")
+    print(f"trie (incl. build):           {cold_time * 1000:.1f} ms")
+    print(f"trie (cached):                {warm_time * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
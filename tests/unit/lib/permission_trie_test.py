@@ -0,0 +1,55 @@
+import random
+from pathlib import Path
+
+from syftbox.lib.lib import PermissionTree, SyftPermission, can_read, filter_metadata, perm_file_path
+from syftbox.server.sync.models import FileMetadata
+
+DATASITE = "user@openmined.org"
+OTHER = "other@openmined.org"
+
+
+def make_metadata(path: str) -> FileMetadata:
+    return FileMetadata(path=Path(path), hash="hash", signature=b"", file_size=0, last_modified=0)
+
+
+def make_tree(snapshot_folder: Path, perms: dict[str, SyftPermission]) -> PermissionTree:
+    parent_path = (snapshot_folder / DATASITE).as_posix()
+    tree = {perm_file_path(f"{parent_path}/{dir}".rstrip("/")): perm for dir, perm in perms.items()}
+    return PermissionTree(tree=tree, parent_path=parent_path, root_perm=tree.get(perm_file_path(parent_path)))
+
+
+def test_trie_matches_permission_for_path(tmp_path):
+    terminal = SyftPermission.mine_with_public_read(DATASITE)
+    terminal.terminal = True
+    perms = {
+        "": SyftPermission.datasite_default(DATASITE),
+        "public": SyftPermission.mine_with_public_read(DATASITE),
+        "public/private": SyftPermission.mine_no_permission(DATASITE),
+        "shared": SyftPermission(admin=[DATASITE], read=[OTHER], write=[], filepath=None),
+        "frozen": terminal,
+        "frozen/private": SyftPermission.mine_no_permission(DATASITE),
+    }
+    perm_tree = make_tree(tmp_path, perms)
+
+    rng = random.Random(0)
+    dirs = ["", "public", "public/private", "public/private/a", "shared/b", "frozen", "frozen/private", "other/c"]
+    paths = [f"{DATASITE}/{rng.choice(dirs)}/file{i}.txt".replace("//", "/") for i in range(200)]
+    paths.append("not_a_datasite/file.txt")
+    metadata = [make_metadata(path) for path in paths]
+
+    for email in [DATASITE, OTHER, "nobody@openmined.org"]:
+        expected = [
+            m for m in metadata if can_read(email, perm_tree.permission_for_path((tmp_path / m.path).as_posix()))
+        ]
+        assert filter_metadata(email, metadata, perm_tree, tmp_path) == expected
+
+
+def test_trie_terminal_root(tmp_path):
+    root_perm = SyftPermission.datasite_default(DATASITE)
+    root_perm.terminal = True
+    perm_tree = make_tree(tmp_path, {"": root_perm, "public": SyftPermission.mine_with_public_read(DATASITE)})
+
+    trie = perm_tree.get_trie(tmp_path)
+    assert trie is perm_tree.get_trie(tmp_path)
+    assert trie.can_read(DATASITE, f"{DATASITE}/public/file.txt")
+    assert not trie.can_read(OTHER, f"{DATASITE}/public/file.txt")
@@ -0,0 +1,199 @@
+import json
+import zipfile
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+from loguru import logger
+
+from syftbox.server.analytics import AnalyticsQueue, import_rotated_logs, iter_analytics_logs, parse_analytics_logs
+from syftbox.server.analytics_store import AnalyticsStore
+from syftbox.server.logger import ANALYTICS_EVENT
+from tests.unit.server.conftest import TEST_DATASITE_NAME
+
+
+@pytest.fixture
+def analytics_events():
+    events = []
+    sink_id = logger.add(
+        lambda message: events.append(message.record["extra"]),
+        filter=lambda record: record["extra"].get("event_type") == ANALYTICS_EVENT,
+    )
+    yield events
+    logger.remove(sink_id)
+
+
+def test_queue_writes_events_in_batches(analytics_events):
+    analytics_queue = AnalyticsQueue(batch_size=10)
+    for i in range(25):
+        assert analytics_queue.submit("/test", f"user{i}@openmined.org", value=i)
+
+    # the worker drains the queued events in batches
+    analytics_queue.start()
+    analytics_queue.stop()
+
+    assert [event["value"] for event in analytics_events] == list(range(25))
+    assert analytics_queue.stats.submitted == analytics_queue.stats.written == 25
+    assert all(event["endpoint"] == "/test" for event in analytics_events)
+
+
+def test_queue_drops_events_when_full():
+    analytics_queue = AnalyticsQueue(max_size=2)
+    results = [analytics_queue.submit("/test", None) for _ in range(3)]
+    assert results == [True, True, False]
+    assert analytics_queue.stats.dropped == 1
+
+
+def test_queue_samples_events(analytics_events):
+    analytics_queue = AnalyticsQueue(sample_rates={"/auth/whoami": 0.0, "/sampled": 0.5})
+    analytics_queue.start()
+    assert not analytics_queue.submit("/auth/whoami", None)
+    for _ in range(100):
+        analytics_queue.submit("/sampled", None)
+    analytics_queue.stop()
+
+    stats = analytics_queue.stats
+    assert stats.sampled_out + stats.submitted == 101
+    assert 0 < stats.submitted < 100
+    assert all(event["sample_rate"] == 0.5 for event in analytics_events)
+
+
+def test_log_event_with_reserved_fields(client: TestClient, analytics_events):
+    analytics_queue: AnalyticsQueue = client.app_state["analytics_queue"]
+    data = {"timestamp": "yesterday", "email": "other@openmined.org", "endpoint": "/other", "event_type": "x", "n": 1}
+    response = client.post("/log_event", json=data, headers={"email": TEST_DATASITE_NAME})
+    assert response.status_code == 200
+    analytics_queue.stop()
+
+    [event] = [event for event in analytics_events if event["endpoint"] == "/log_event"]
+    assert event["email"] == TEST_DATASITE_NAME
+    assert event["event_timestamp"] == "yesterday"
+    assert event["event_email"] == "other@openmined.org"
+    assert event["event_endpoint"] == "/other"
+    assert event["event_type"] == ANALYTICS_EVENT
+    assert event["n"] == 1
+    assert analytics_queue.stats.written == analytics_queue.stats.submitted
+
+
+def test_queue_worker_survives_write_errors(analytics_events):
+    analytics_queue = AnalyticsQueue(batch_size=1)
+    write = analytics_queue._write
+    failures = []
+
+    def fail_once(batch):
+        if not failures:
+            failures.append(batch)
+            raise RuntimeError("disk full")
+        write(batch)
+
+    analytics_queue._write = fail_once
+    for i in range(3):
+        analytics_queue.submit("/test", None, value=i)
+    analytics_queue.start()
+    analytics_queue.stop()
+
+    assert len(failures) == 1
+    assert [event["value"] for event in analytics_events] == [1, 2]
+
+
+def test_file_change_event_has_metadata(client: TestClient, analytics_events):
+    analytics_queue: AnalyticsQueue = client.app_state["analytics_queue"]
+    response = client.post("/sync/create", files={"file": (f"{TEST_DATASITE_NAME}/new.txt", b"new file", "text/plain")})
+    assert response.status_code == 200
+    response = client.post("/sync/delete", json={"path": f"{TEST_DATASITE_NAME}/new.txt"})
+    assert response.status_code == 200
+    analytics_queue.stop()
+
+    events = [event for event in analytics_events if event["endpoint"] in ("/sync/create", "/sync/delete")]
+    assert [event["endpoint"] for event in events] == ["/sync/create", "/sync/delete"]
+    for event in events:
+        assert event["email"] == TEST_DATASITE_NAME
+        assert event["file_metadata"]["path"] == f"{TEST_DATASITE_NAME}/new.txt"
+        assert event["file_metadata"]["file_size"] == len(b"new file")
+    json.dumps(events)
+
+
+def _event(timestamp: datetime, endpoint: str = "/sync/create", email: str = "a@openmined.org", **kwargs) -> dict:
+    return {"timestamp": timestamp.isoformat(), "endpoint": endpoint, "email": email, **kwargs}
+
+
+def _write_segment(path: Path, events: list[dict]) -> None:
+    lines = "".join(json.dumps(event) + "\n" for event in events)
+    if path.suffix == ".zip":
+        with zipfile.ZipFile(path, "w") as zf:
+            zf.writestr(path.stem, lines)
+    else:
+        path.write_text(lines)
+
+
+def test_store_queries_and_rollups(tmp_path: Path):
+    store = AnalyticsStore(tmp_path / "analytics.db")
+    day1 = datetime(2024, 10, 1, 12, tzinfo=timezone.utc)
+    day2 = day1 + timedelta(days=1)
+    store.add_events(
+        [
+            _event(day1, file_metadata={"file_size": 100}),
+            _event(day1 + timedelta(hours=1), endpoint="/sync/delete", file_metadata={"file_size": 100}),
+            _event(day1 + timedelta(hours=2), email="b@openmined.org", file_metadata={"file_size": 50}),
+            _event(day2, endpoint="/auth/whoami"),
+            _event(day2, endpoint="/sync/upload_bulk", file_metadata={"file_size": 10}),
+        ]
+    )
+
+    assert len(list(store.events())) == 5
+    assert [event["timestamp"] for event in store.events(start=day1 + timedelta(hours=1), end=day2)] == [
+        day1 + timedelta(hours=1),
+        day1 + timedelta(hours=2),
+    ]
+    assert {event["endpoint"] for event in store.events(email="a@openmined.org")} == {
+        "/sync/create",
+        "/sync/delete",
+        "/auth/whoami",
+        "/sync/upload_bulk",
+    }
+    assert len(list(store.events(endpoint="/sync/create", email="b@openmined.org"))) == 1
+
+    assert store.daily_active_users() == {"2024-10-01": 2, "2024-10-02": 1}
+    assert store.daily_active_users(start=day2.date()) == {"2024-10-02": 1}
+    usage = store.daily_usage()
+    # deleted files are not counted as synced bytes
+    assert usage["2024-10-01"] == {"/sync/create": (2, 150), "/sync/delete": (1, 0)}
+    assert usage["2024-10-02"] == {"/auth/whoami": (1, 0), "/sync/upload_bulk": (1, 10)}
+
+
+def test_queue_writes_to_store(tmp_path: Path):
+    store = AnalyticsStore(tmp_path / "analytics.db")
+    analytics_queue = AnalyticsQueue(store=store)
+    analytics_queue.start()
+    analytics_queue.submit("/register", "a@openmined.org")
+    analytics_queue.stop()
+
+    (event,) = store.events()
+    assert event["endpoint"] == "/register"
+    assert event["email"] == "a@openmined.org"
+
+
+def test_iter_analytics_logs_merges_segments(tmp_path: Path):
+    start = datetime(2024, 10, 1, tzinfo=timezone.utc)
+    timestamps = [start + timedelta(minutes=i) for i in range(9)]
+    _write_segment(tmp_path / "analytics.2024-10-01.log.zip", [_event(t) for t in timestamps[0::3]])
+    _write_segment(tmp_path / "analytics.2024-10-02.log.zip", [_event(t) for t in timestamps[1::3]])
+    _write_segment(tmp_path / "analytics.log", [_event(t) for t in timestamps[2::3]])
+
+    events = iter_analytics_logs(tmp_path)
+    assert not isinstance(events, list)
+    assert [event["timestamp"] for event in events] == timestamps
+    assert len(parse_analytics_logs(tmp_path)) == 9
+
+
+def test_import_rotated_logs(tmp_path: Path):
+    store = AnalyticsStore(tmp_path / "analytics.db")
+    before = datetime.fromtimestamp(store.live_since, tz=timezone.utc) - timedelta(hours=1)
+    after = datetime.fromtimestamp(store.live_since, tz=timezone.utc) + timedelta(hours=1)
+    # events after the store was created are already in the store
+    _write_segment(tmp_path / "analytics.2024-10-01.log.zip", [_event(before), _event(after)])
+
+    assert import_rotated_logs(tmp_path, store) == 1
+    assert import_rotated_logs(tmp_path, store) == 0
+    assert [event["timestamp"] for event in store.events()] == [before]
@@ -0,0 +1,65 @@
+from fastapi.testclient import TestClient
+
+from syftbox.server.browser import ListingCache
+from tests.unit.server.conftest import TEST_DATASITE_NAME
+
+
+def _create(client: TestClient, path: str, content: bytes) -> None:
+    response = client.post("/sync/create", files={"file": (path, content, "text/plain")})
+    assert response.status_code == 200
+
+
+def test_list_datasites_is_cached(client: TestClient):
+    listing_cache: ListingCache = client.app_state["listing_cache"]
+    response = client.get("/datasites")
+    assert response.status_code == 200
+    assert TEST_DATASITE_NAME in response.text
+    etag = response.headers["etag"]
+
+    response = client.get("/datasites")
+    assert response.headers["etag"] == etag
+    assert listing_cache.stats.hits == 1
+
+    response = client.get("/datasites", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+
+
+def test_folder_listing_changes_after_write(client: TestClient):
+    _create(client, f"{TEST_DATASITE_NAME}/public/a.txt", b"a")
+    response = client.get(f"/datasites/{TEST_DATASITE_NAME}/")
+    assert response.status_code == 200
+    assert "a.txt" in response.text
+    etag = response.headers["etag"]
+
+    _create(client, f"{TEST_DATASITE_NAME}/public/b.txt", b"b")
+    response = client.get(f"/datasites/{TEST_DATASITE_NAME}/", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+    assert "b.txt" in response.text
+
+
+def test_file_conditional_requests(client: TestClient):
+    _create(client, f"{TEST_DATASITE_NAME}/public/notes.md", b"# notes")
+    response = client.get(f"/datasites/{TEST_DATASITE_NAME}/notes.md")
+    assert response.status_code == 200
+    assert response.text == "# notes"
+    assert response.headers["content-type"].startswith("text/plain")
+
+    response_304 = client.get(
+        f"/datasites/{TEST_DATASITE_NAME}/notes.md", headers={"If-None-Match": response.headers["etag"]}
+    )
+    assert response_304.status_code == 304
+    response_304 = client.get(
+        f"/datasites/{TEST_DATASITE_NAME}/notes.md",
+        headers={"If-Modified-Since": response.headers["last-modified"]},
+    )
+    assert response_304.status_code == 304
+
+
+def test_browser_stays_in_public_folder(client: TestClient):
+    _create(client, f"{TEST_DATASITE_NAME}/public/a.txt", b"a")
+    response = client.get(f"/datasites/{TEST_DATASITE_NAME}/%2E%2E/public/a.txt")
+    assert response.status_code == 200
+    response = client.get(f"/datasites/{TEST_DATASITE_NAME}/%2E%2E/test_file.txt")
+    assert response.status_code == 404
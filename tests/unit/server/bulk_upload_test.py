@@ -0,0 +1,105 @@
+import io
+import json
+import zipfile
+from pathlib import Path
+
+from fastapi.testclient import TestClient
+
+from syftbox.server.settings import ServerSettings
+from syftbox.server.sync.file_store import FileStore
+from tests.unit.server.conftest import PERMFILE_DICT, TEST_DATASITE_NAME, TEST_FILE
+
+
+def _zip(files: dict[str, bytes]) -> bytes:
+    memory_file = io.BytesIO()
+    with zipfile.ZipFile(memory_file, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for path, data in files.items():
+            zf.writestr(path, data)
+    return memory_file.getvalue()
+
+
+def _upload(client: TestClient, datasite: str, data: bytes):
+    return client.post("/sync/upload_bulk", files={"file": (datasite, data, "application/zip")})
+
+
+def test_upload_bulk(client: TestClient):
+    server_settings: ServerSettings = client.app_state["server_settings"]
+    files = {f"{TEST_DATASITE_NAME}/seed/file_{i}.txt": f"content {i}".encode() for i in range(20)}
+    files[f"{TEST_DATASITE_NAME}/seed/_.syftperm"] = json.dumps(PERMFILE_DICT).encode()
+
+    response = _upload(client, TEST_DATASITE_NAME, _zip(files))
+    assert response.status_code == 200
+    result = response.json()
+    assert sorted(result["created"]) == sorted(files)
+    assert result["errors"] == {}
+
+    for path, data in files.items():
+        assert (server_settings.snapshot_folder / path).read_bytes() == data
+        response = client.post("/sync/get_metadata", json={"path_like": path})
+        assert response.status_code == 200
+
+
+def test_upload_bulk_skips_invalid_files(client: TestClient):
+    new_file = f"{TEST_DATASITE_NAME}/new.txt"
+    existing_file = f"{TEST_DATASITE_NAME}/{TEST_FILE}"
+    invalid_permission = f"{TEST_DATASITE_NAME}/folder/_.syftperm"
+    other_datasite = "other@openmined.org/file.txt"
+    files = {
+        new_file: b"new",
+        existing_file: b"overwritten",
+        invalid_permission: b"not a permission file",
+        other_datasite: b"other",
+        f"{TEST_DATASITE_NAME}/../escape.txt": b"escape",
+    }
+
+    response = _upload(client, TEST_DATASITE_NAME, _zip(files))
+    assert response.status_code == 200
+    result = response.json()
+    assert result["created"] == [new_file]
+    assert set(result["errors"]) == set(files) - {new_file}
+    assert result["errors"][existing_file] == "file already exists"
+    assert "syftpermission" in result["errors"][invalid_permission]
+
+    response = client.get(f"/sync/download/{existing_file}")
+    assert response.content != b"overwritten"
+
+
+def test_upload_bulk_rejects_invalid_uploads(client: TestClient):
+    response = _upload(client, TEST_DATASITE_NAME, b"not a zip file")
+    assert response.status_code == 400
+
+    response = _upload(client, f"{TEST_DATASITE_NAME}/folder", _zip({f"{TEST_DATASITE_NAME}/folder/a.txt": b"a"}))
+    assert response.status_code == 400
+
+
+def test_create_many_writes_files_before_locking(tmp_path: Path):
+    settings = ServerSettings.from_data_folder(tmp_path)
+    store = FileStore(settings)
+    paths = [Path(TEST_DATASITE_NAME) / f"file_{i}.txt" for i in range(3)]
+    staged = [store.write_temp(path, io.BytesIO(b"bulk")) for path in paths]
+    assert [metadata.path for _, metadata in staged] == paths
+
+    # the write lock is not held while files are staged, another request can create one of them
+    store.put(paths[1], b"created concurrently")
+    created = store.create_many(staged)
+
+    assert [metadata.path for metadata in created] == [paths[0], paths[2]]
+    assert (settings.snapshot_folder / paths[1]).read_bytes() == b"created concurrently"
+    assert store.get(paths[0]).data == b"bulk"
+    # no temporary files are left behind
+    assert sorted(p.name for p in (settings.snapshot_folder / TEST_DATASITE_NAME).iterdir()) == [
+        path.name for path in paths
+    ]
+
+
+def test_upload_bulk_removes_staged_files_of_corrupt_zip(client: TestClient):
+    server_settings: ServerSettings = client.app_state["server_settings"]
+    data = bytearray(_zip({f"{TEST_DATASITE_NAME}/bulk/a.txt": b"a", f"{TEST_DATASITE_NAME}/bulk/b.txt": b"b" * 1000}))
+    # corrupt the compressed data of the second file, after the first file is staged
+    offset = data.index(b"b.txt") + len(b"b.txt")
+    data[offset : offset + 4] = b"\xff\xff\xff\xff"
+
+    response = _upload(client, TEST_DATASITE_NAME, bytes(data))
+    assert response.status_code == 400
+    bulk_folder = server_settings.snapshot_folder / TEST_DATASITE_NAME / "bulk"
+    assert not bulk_folder.exists() or list(bulk_folder.iterdir()) == []
@@ -0,0 +1,45 @@
+import hashlib
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from syftbox.server.sync import columnar
+
+
+def make_row(path: str, file_size: int, last_modified: datetime) -> dict:
+    return {
+        "path": path,
+        "hash": hashlib.sha256(path.encode()).hexdigest(),
+        "signature": f"signature-{path}",
+        "file_size": file_size,
+        "last_modified": last_modified.isoformat(),
+    }
+
+
+def test_columnar_roundtrip():
+    now = datetime(2024, 11, 1, 12, 30, 15, 123456, tzinfo=timezone.utc)
+    rows = [
+        make_row("a@x.org/dir/sub/b.txt", 0, now),
+        make_row("a@x.org/dir/sub/a.txt", 2**40, now - timedelta(days=400)),
+        make_row("a@x.org/dir/ünïcode.txt", 5, now + timedelta(microseconds=1)),
+        make_row("a@x.org/file.txt", 300, now - timedelta(seconds=1)),
+    ]
+    states = {"a@x.org": rows, "b@x.org": None, "c@x.org": []}
+
+    decoded = columnar.decode_datasite_states(columnar.encode_datasite_states(states))
+    assert decoded.keys() == states.keys()
+    assert decoded["b@x.org"] is None
+    assert decoded["c@x.org"] == []
+
+    expected = sorted(rows, key=lambda row: row["path"])
+    assert len(decoded["a@x.org"]) == len(expected)
+    for expected_row, decoded_row in zip(expected, decoded["a@x.org"]):
+        assert decoded_row["last_modified"] == datetime.fromisoformat(expected_row["last_modified"])
+        assert {**decoded_row, "last_modified": expected_row["last_modified"]} == expected_row
+
+
+def test_columnar_requires_sha256_hashes():
+    row = make_row("a@x.org/file.txt", 0, datetime.now(timezone.utc))
+    row["hash"] = "not a hash"
+    with pytest.raises(columnar.ColumnarEncodeError):
+        columnar.encode_datasite_states({"a@x.org": [row]})
@@ -0,0 +1,96 @@
+import gzip
+import json
+from pathlib import Path
+
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+from syftbox.client.plugins.sync.endpoints import create, download, whoami
+from syftbox.lib import compression
+from syftbox.server import proxy
+from tests.unit.server.conftest import TEST_DATASITE_NAME, TEST_FILE
+
+
+def test_response_compression(client: TestClient):
+    client.post("/sync/create", files={"file": (f"{TEST_DATASITE_NAME}/large.txt", b"a" * 10_000)})
+
+    response = client.post("/sync/dir_state", params={"dir": TEST_DATASITE_NAME}, headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["vary"]
+    assert response.headers["server-timing"].startswith("compress;dur=")
+    assert len(response.json()) == 4
+
+    response = client.post("/sync/dir_state", params={"dir": TEST_DATASITE_NAME}, headers={"Accept-Encoding": "br"})
+    assert "content-encoding" not in response.headers
+
+    # zip archives are not compressed again
+    paths = [f"{TEST_DATASITE_NAME}/large.txt", f"{TEST_DATASITE_NAME}/{TEST_FILE}"]
+    response = client.post("/sync/download_bulk", json={"paths": paths}, headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-type"] == "application/zip"
+    assert "content-encoding" not in response.headers
+
+
+def test_request_decompression(client: TestClient):
+    data = b"compressible " * 1000
+
+    # request compression is enabled after the server advertises it
+    whoami(client)
+    assert client.request_encoding in compression.SUPPORTED_ENCODINGS
+    path = Path(TEST_DATASITE_NAME) / "compressed.txt"
+    create(client, path, data)
+    assert download(client, path) == data
+
+    response = client.post(
+        "/sync/create",
+        content=b"data",
+        headers={"Content-Encoding": "br", "Content-Type": "application/octet-stream"},
+    )
+    assert response.status_code == 415
+
+
+def test_choose_encoding():
+    assert compression.choose_encoding("gzip, deflate") == "gzip"
+    assert compression.choose_encoding("gzip;q=0, deflate") is None
+    assert compression.choose_encoding("*") == compression.SUPPORTED_ENCODINGS[0]
+    assert compression.choose_encoding(None) is None
+
+
+def test_zstd_roundtrip():
+    pytest.importorskip("zstandard")
+    data = b"zstd " * 1000
+    decompressor = compression.Decompressor("zstd")
+    assert decompressor.decompress(compression.compress(data, "zstd")) + decompressor.flush() == data
+    assert compression.choose_encoding("gzip, zstd") == "zstd"
+
+
+def test_gzip_is_standard():
+    assert gzip.decompress(compression.compress(b"data", "gzip")) == b"data"
+
+
+def test_request_decompression_limit(client: TestClient):
+    client.app_state["server_settings"].max_decompressed_request_size = 10_000
+    headers = {"Content-Encoding": "gzip", "Content-Type": "application/json"}
+
+    body = gzip.compress(json.dumps({"path_like": f"{TEST_DATASITE_NAME}/{TEST_FILE}"}).encode())
+    response = client.post("/sync/get_metadata", content=body, headers=headers)
+    assert response.status_code == 200
+
+    bomb = gzip.compress(b"\0" * 10_000_000)
+    response = client.post("/sync/get_metadata", content=bomb, headers=headers)
+    assert response.status_code == 413
+
+
+def test_decompressor_limit():
+    data = b"\0" * 100_000
+    decompressor = compression.Decompressor("gzip", max_size=len(data))
+    assert decompressor.decompress(compression.compress(data, "gzip")) + decompressor.flush() == data
+
+    decompressor = compression.Decompressor("gzip", max_size=len(data) - 1)
+    with pytest.raises(compression.DecompressedSizeExceeded):
+        decompressor.decompress(compression.compress(data, "gzip"))
+        decompressor.flush()
+
+    with pytest.raises(HTTPException) as e:
+        proxy.decode_body(compression.compress(data, "gzip"), "gzip", max_size=1000)
+    assert e.value.status_code == 413
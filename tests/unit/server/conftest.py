@@ -1,5 +1,7 @@
 import json
 
+import anyio.to_thread
+import httpx
 import pytest
 from fastapi.testclient import TestClient
 
@@ -16,6 +18,37 @@ PERMFILE_DICT = {
 }
 
 
+class AsyncBody(httpx.AsyncByteStream):
+    def __init__(self, content: bytes) -> None:
+        self.content = content
+
+    async def __aiter__(self):
+        yield self.content
+
+
+class InProcessTransport(httpx.AsyncBaseTransport):
+    """Async transport that sends requests to a server running in a TestClient, e.g. a shard or upstream server."""
+
+    def __init__(self, client: TestClient) -> None:
+        self.client = client
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        body = await request.aread()
+        response = await anyio.to_thread.run_sync(
+            lambda: self.client.request(
+                request.method,
+                request.url.path,
+                params=request.url.params,
+                headers=request.headers,
+                content=body,
+            )
+        )
+        # the TestClient already decoded the body
+        headers = [(k, v) for k, v in response.headers.items() if k not in ("content-encoding", "content-length")]
+        # streamed like a response of a real server
+        return httpx.Response(response.status_code, headers=headers, stream=AsyncBody(response.content))
+
+
 def get_access_token(client: TestClient, email: str) -> str:
     response = client.post("/auth/request_email_token", json={"email": email})
     email_token = response.json()["email_token"]
@@ -0,0 +1,88 @@
+from pathlib import Path
+
+from fastapi.testclient import TestClient
+
+from syftbox.server.settings import ServerSettings
+from syftbox.server.sync.content_cache import ContentCache
+from syftbox.server.sync.file_store import FileStore
+from tests.unit.server.conftest import TEST_DATASITE_NAME, TEST_FILE
+
+
+def test_content_cache_lru():
+    cache = ContentCache(max_bytes=10, max_object_size=8)
+    cache.put("a", b"12345")
+    cache.put("b", b"12345")
+    assert cache.get("a") == b"12345"
+    cache.put("c", b"12345")
+
+    assert cache.get("b") is None
+    assert cache.size == 10
+    assert cache.stats.evictions == 1
+    assert cache.stats.hits == 1
+    assert cache.stats.misses == 1
+    assert cache.stats.hit_ratio == 0.5
+
+    # objects larger than max_object_size are never cached
+    cache.put("d", b"123456789")
+    assert "d" not in cache
+
+    cache.invalidate("a")
+    assert cache.size == 5
+
+
+def test_file_store_content_cache(tmp_path: Path):
+    settings = ServerSettings.from_data_folder(tmp_path)
+    cache = ContentCache(max_bytes=1024, max_object_size=1024)
+    store = FileStore(settings, content_cache=cache)
+    path = Path(TEST_DATASITE_NAME) / TEST_FILE
+
+    store.put(path, b"version 1")
+    old_hash = store.get_metadata(path).hash
+    assert old_hash in cache
+
+    store.put(path, b"version 2")
+    new_hash = store.get_metadata(path).hash
+    assert old_hash not in cache
+
+    # served from memory
+    (settings.snapshot_folder / path).write_bytes(b"modified on disk")
+    assert store.get(path).data == b"version 2"
+    assert cache.stats.hits == 1
+
+    store.delete(path)
+    assert new_hash not in cache
+    assert len(cache) == 0
+
+
+def test_file_store_caches_only_matching_contents(tmp_path: Path):
+    settings = ServerSettings.from_data_folder(tmp_path)
+    store = FileStore(settings)
+    path = Path(TEST_DATASITE_NAME) / TEST_FILE
+    store.put(path, b"version 1")
+    metadata = store.get_metadata(path)
+
+    cache = ContentCache(max_bytes=1024, max_object_size=1024)
+    store.content_cache = cache
+    # the file is replaced between reading its metadata and its contents
+    (settings.snapshot_folder / path).write_bytes(b"version 2")
+    assert store.read_cached(metadata) == b"version 2"
+    assert metadata.hash not in cache
+
+    (settings.snapshot_folder / path).write_bytes(b"version 1")
+    assert store.read_cached(metadata) == b"version 1"
+    assert cache.get(metadata.hash) == b"version 1"
+
+
+def test_download_hits_content_cache(client: TestClient):
+    cache: ContentCache = client.app_state["content_cache"]
+    url = f"/sync/download/{TEST_DATASITE_NAME}/{TEST_FILE}"
+    for _ in range(3):
+        response = client.get(url)
+        response.raise_for_status()
+        assert response.content == b"Hello, World!"
+
+    response = client.get(url, headers={"Range": "bytes=7-"})
+    assert response.content == b"World!"
+
+    assert cache.stats.misses == 1
+    assert cache.stats.hits == 3
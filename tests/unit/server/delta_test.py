@@ -0,0 +1,136 @@
+import asyncio
+import hashlib
+import threading
+from pathlib import Path
+
+import py_fast_rsync
+import pytest
+from fastapi.testclient import TestClient
+
+from syftbox.client.exceptions import SyftNotFound
+from syftbox.client.plugins.sync.endpoints import apply_diff, get_delta
+from syftbox.server.settings import ServerSettings
+from syftbox.server.sync.delta import DeltaCache
+from syftbox.server.sync.file_store import FileStore
+from tests.unit.server.conftest import TEST_DATASITE_NAME, TEST_FILE
+
+OLD_DATA = b"Hello, World!"
+
+
+def _sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def test_file_store_retains_versions(tmp_path: Path):
+    settings = ServerSettings.from_data_folder(tmp_path)
+    settings.version_history_size = 2
+    store = FileStore(settings)
+    path = Path(TEST_DATASITE_NAME) / TEST_FILE
+
+    versions = [f"version {i}".encode() for i in range(4)]
+    for data in versions:
+        store.put(path, data)
+    # writing the same contents does not add a version
+    store.put(path, versions[-1])
+
+    assert store.get_version_path(path, _sha256(versions[0])) is None
+    assert store.get_version_path(path, _sha256(versions[1])).read_bytes() == versions[1]
+    assert store.get_version_path(path, _sha256(versions[2])).read_bytes() == versions[2]
+    assert store.get_version_path(path, _sha256(versions[3])) is None
+    assert len(list(settings.versions_folder.rglob("*/*"))) == 2
+
+    store.delete(path)
+    assert store.get_version_path(path, _sha256(versions[2])) is None
+    assert list(settings.versions_folder.rglob("*/*")) == []
+
+
+def test_file_store_replaces_files_atomically(tmp_path: Path):
+    settings = ServerSettings.from_data_folder(tmp_path)
+    settings.version_max_file_size = 100
+    store = FileStore(settings)
+    path = Path(TEST_DATASITE_NAME) / TEST_FILE
+    abs_path = settings.snapshot_folder / path
+    store.put(path, OLD_DATA)
+
+    missing = []
+    stop = threading.Event()
+
+    def read_file():
+        while not stop.is_set():
+            if not abs_path.exists():
+                missing.append(True)
+
+    reader = threading.Thread(target=read_file)
+    reader.start()
+    for i in range(100):
+        store.put(path, f"version {i}".encode())
+    stop.set()
+    reader.join()
+
+    # the current file is always present, and no temporary files are left behind
+    assert missing == []
+    assert [p.name for p in abs_path.parent.iterdir()] == [TEST_FILE]
+
+    # versions larger than version_max_file_size are not kept
+    store.put(path, b"a" * 101)
+    store.put(path, OLD_DATA)
+    assert store.get_version_path(path, _sha256(b"version 99")) is not None
+    assert store.get_version_path(path, _sha256(b"a" * 101)) is None
+
+
+def test_get_delta(client: TestClient):
+    path = Path(TEST_DATASITE_NAME) / TEST_FILE
+    new_data = b"Hello, World! Hello again."
+    diff = py_fast_rsync.diff(py_fast_rsync.signature.calculate(OLD_DATA), new_data)
+    apply_diff(client, path, diff, _sha256(new_data))
+
+    delta_cache: DeltaCache = client.app_state["delta_cache"]
+    for _ in range(2):
+        response = get_delta(client, path, _sha256(OLD_DATA))
+        assert response.hash == _sha256(new_data)
+        assert py_fast_rsync.apply(OLD_DATA, response.diff_bytes) == new_data
+
+    assert delta_cache.stats.misses == 1
+    assert delta_cache.stats.hits == 1
+
+    with pytest.raises(SyftNotFound):
+        get_delta(client, path, _sha256(b"unknown version"))
+    with pytest.raises(SyftNotFound):
+        get_delta(client, Path(TEST_DATASITE_NAME) / "unknown.txt", _sha256(OLD_DATA))
+
+
+def test_delta_cache_single_flight():
+    cache = DeltaCache(max_bytes=1024)
+    calls = 0
+
+    async def compute():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return b"diff", "b"
+
+    async def run():
+        return await asyncio.gather(*[cache.get_or_compute("a", "b", compute) for _ in range(5)])
+
+    results = asyncio.run(run())
+    assert results == [(b"diff", "b")] * 5
+    assert calls == 1
+    assert cache.stats.coalesced == 4
+    assert cache.get("a", "b") == b"diff"
+
+
+def test_delta_cache_eviction():
+    cache = DeltaCache(max_bytes=10)
+    cache.put("a", "b", b"12345")
+    cache.put("b", "c", b"12345")
+    cache.get("a", "b")
+    cache.put("c", "d", b"12345")
+
+    assert cache.get("b", "c") is None
+    assert cache.get("a", "b") == b"12345"
+    assert cache.size == 10
+    assert cache.stats.evictions == 1
+
+    # deltas larger than the cache are not stored
+    cache.put("d", "e", b"x" * 11)
+    assert cache.get("d", "e") is None
@@ -0,0 +1,113 @@
+from datetime import datetime, timezone
+from pathlib import Path
+
+from fastapi.testclient import TestClient
+
+from syftbox.client.plugins.sync.endpoints import get_dir_digest, get_remote_state
+from syftbox.client.plugins.sync.sync import patch_remote_state
+from syftbox.server.settings import ServerSettings
+from syftbox.server.sync import db, merkle
+from syftbox.server.sync.file_store import FileStore
+from syftbox.server.sync.merkle import DirIndex, compute_dir_digests, get_out_of_sync_paths
+from syftbox.server.sync.models import FileMetadata
+from tests.unit.server.conftest import TEST_DATASITE_NAME, TEST_FILE
+
+
+def test_dir_digests_follow_writes(tmpdir):
+    settings = ServerSettings.from_data_folder(tmpdir)
+    store = FileStore(settings)
+    store.put(Path("a@x.org/dir/file1.txt"), b"1")
+    store.put(Path("a@x.org/dir/sub/file2.txt"), b"2")
+    store.put(Path("a@x.org/file3.txt"), b"3")
+    store.put(Path("a@x.org/dir/file1.txt"), b"1 modified")
+    store.delete(Path("a@x.org/file3.txt"))
+
+    conn = db.get_db(settings.file_db_path)
+    expected = compute_dir_digests(db.get_all_metadata(conn))
+    stored = {
+        **db.get_child_dir_digests(conn, ""),
+        **db.get_child_dir_digests(conn, "a@x.org"),
+        **db.get_child_dir_digests(conn, "a@x.org/dir"),
+    }
+    assert stored == expected
+
+    store.delete(Path("a@x.org/dir/sub/file2.txt"))
+    assert db.get_child_dir_digests(conn, "a@x.org/dir") == {}
+
+
+def test_dir_digest_endpoint(client: TestClient):
+    remote_state = get_remote_state(client, Path(TEST_DATASITE_NAME))
+    expected_digests = compute_dir_digests(remote_state)
+
+    response = get_dir_digest(client, Path(TEST_DATASITE_NAME))
+    assert response.digest == expected_digests[TEST_DATASITE_NAME]
+    assert len(response.files) == 2
+    nested_dir = f"{TEST_DATASITE_NAME}/{TEST_DATASITE_NAME}"
+    assert response.dirs == {nested_dir: expected_digests[nested_dir]}
+
+
+def test_patch_remote_state(client: TestClient):
+    previous_state = get_remote_state(client, Path(TEST_DATASITE_NAME))
+
+    files = {"file": (f"{TEST_DATASITE_NAME}/new_dir/new.txt", b"new content")}
+    client.post("/sync/create", files=files).raise_for_status()
+    client.post("/sync/delete", json={"path": f"{TEST_DATASITE_NAME}/{TEST_DATASITE_NAME}/{TEST_FILE}"})
+
+    remote_index = patch_remote_state(client, TEST_DATASITE_NAME, DirIndex(previous_state))
+    current_state = get_remote_state(client, Path(TEST_DATASITE_NAME))
+    assert sorted(remote_index.files) == sorted(f.path.as_posix() for f in current_state)
+    expected_digests = compute_dir_digests(current_state)
+    assert {dir: remote_index.digest(dir) for dir in expected_digests} == expected_digests
+    assert remote_index.digest(f"{TEST_DATASITE_NAME}/{TEST_DATASITE_NAME}") is None
+
+
+def _file(path: str, file_hash: str) -> FileMetadata:
+    return FileMetadata(
+        path=Path(path), hash=file_hash, signature="", file_size=1, last_modified=datetime.now(timezone.utc)
+    )
+
+
+def test_dir_index_follows_changes(monkeypatch):
+    files = [_file(f"a@x.org/dir{i % 10}/sub/file{i}.txt", f"hash{i}") for i in range(100)]
+    index = DirIndex(files)
+    assert {dir: index.digest(dir) for dir in compute_dir_digests(files)} == compute_dir_digests(files)
+
+    # only the changed files are hashed
+    leaves = []
+    leaf_digest = merkle.leaf_digest
+    monkeypatch.setattr(
+        merkle, "leaf_digest", lambda path, file_hash: leaves.append(path) or leaf_digest(path, file_hash)
+    )
+    new_files = [*files[1:50], _file("a@x.org/dir0/sub/file50.txt", "new"), *files[51:], _file("a@x.org/new.txt", "x")]
+    index.update(new_files)
+    assert sorted(leaves) == sorted(
+        ["a@x.org/dir0/sub/file0.txt", "a@x.org/dir0/sub/file50.txt", "a@x.org/dir0/sub/file50.txt", "a@x.org/new.txt"]
+    )
+    assert {dir: index.digest(dir) for dir in compute_dir_digests(new_files)} == compute_dir_digests(new_files)
+
+    index.remove_dir("a@x.org/dir1")
+    assert "a@x.org/dir1" not in index.subdirs["a@x.org"]
+    assert index.digest("a@x.org/dir1/sub") is None
+    assert len(index) == len(new_files) - 10
+
+
+def test_out_of_sync_paths_visit_changed_dirs(monkeypatch):
+    files = [_file(f"a@x.org/dir{i % 10}/sub/file{i}.txt", f"hash{i}") for i in range(100)]
+    local = DirIndex(files)
+    remote = DirIndex(files)
+    assert get_out_of_sync_paths(local, remote, "a@x.org") == []
+
+    remote.put(_file("a@x.org/dir3/sub/file3.txt", "changed"))
+    remote.put(_file("a@x.org/dir4/new.txt", "new"))
+    local.remove("a@x.org/dir5/sub/file5.txt")
+
+    visited = []
+    digest = DirIndex.digest
+    monkeypatch.setattr(DirIndex, "digest", lambda self, dir: visited.append(dir) or digest(self, dir))
+    assert sorted(get_out_of_sync_paths(local, remote, "a@x.org")) == [
+        "a@x.org/dir3/sub/file3.txt",
+        "a@x.org/dir4/new.txt",
+        "a@x.org/dir5/sub/file5.txt",
+    ]
+    # the root, its 10 children, and the subdirectory of each of the 3 changed children
+    assert len(set(visited)) == 1 + 10 + 3
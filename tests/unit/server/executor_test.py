@@ -0,0 +1,68 @@
+import asyncio
+import base64
+import threading
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+from py_fast_rsync import signature
+
+from syftbox.server.sync.executor import CPUExecutor, CPUExecutorBusy, diff_file
+from tests.unit.server.conftest import TEST_DATASITE_NAME, TEST_FILE
+
+
+def test_cpu_executor_admission_control():
+    executor = CPUExecutor(max_workers=1, max_queue_size=1)
+    release = threading.Event()
+
+    async def run_tasks():
+        tasks = [asyncio.create_task(executor.run(release.wait)) for _ in range(2)]
+        await asyncio.sleep(0.05)
+        with pytest.raises(CPUExecutorBusy):
+            await executor.run(release.wait)
+        release.set()
+        return await asyncio.gather(*tasks)
+
+    results = asyncio.run(run_tasks())
+    # the second task waited for the first one
+    assert results[1][1].queue_time > 0
+    assert executor.stats.admitted == 2
+    assert executor.stats.rejected == 1
+    assert executor.stats.completed == 2
+
+
+def test_cpu_executor_stop():
+    executor = CPUExecutor(max_workers=2, max_queue_size=0)
+    asyncio.run(executor.run(sum, [1, 2]))
+    assert any(thread.name.startswith("syftbox-cpu") for thread in threading.enumerate())
+
+    executor.stop()
+    assert not any(thread.name.startswith("syftbox-cpu") for thread in threading.enumerate())
+    with pytest.raises(RuntimeError):
+        asyncio.run(executor.run(sum, [1, 2]))
+
+
+def test_cpu_executor_processes(tmp_path: Path):
+    executor = CPUExecutor(max_workers=1, max_queue_size=0, use_processes=True)
+    path = tmp_path / "file.txt"
+    path.write_bytes(b"Hello, World!")
+    diff, _ = asyncio.run(executor.run(diff_file, path, signature.calculate(b"Hello")))
+    assert diff
+
+
+def test_get_diff_busy(client: TestClient):
+    executor = CPUExecutor(max_workers=1, max_queue_size=0)
+    client.app_state["cpu_executor"] = executor
+    request = {
+        "path": f"{TEST_DATASITE_NAME}/{TEST_FILE}",
+        "signature": base64.b85encode(signature.calculate(b"Hello")).decode(),
+    }
+
+    response = client.post("/sync/get_diff", json=request)
+    response.raise_for_status()
+    assert "cpu-queue" in response.headers["server-timing"]
+
+    executor._admitted = executor.capacity
+    response = client.post("/sync/get_diff", json=request)
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "1"
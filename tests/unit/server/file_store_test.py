@@ -2,9 +2,14 @@ import uuid
 from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+import anyio
+
 from syftbox.server.settings import ServerSettings
-from syftbox.server.sync.file_store import FileStore
+from syftbox.server.sync.content_cache import ContentCache
+from syftbox.server.sync.db import get_all_datasites
+from syftbox.server.sync.file_store import AsyncFileStore, FileStore
 from syftbox.server.sync.hash import hash_file
+from tests.unit.server.conftest import TEST_DATASITE_NAME, TEST_FILE
 
 
 def test_put_atomic(tmpdir):
@@ -18,3 +23,32 @@ def test_put_atomic(tmpdir):
     assert system_path.exists()
     metadata = FileStore(settings).get_metadata(syft_path)
     assert metadata.hash_bytes == hash_file(system_path).hash_bytes
+
+
+def test_async_file_store(tmp_path: Path):
+    settings = ServerSettings.from_data_folder(tmp_path)
+    store = AsyncFileStore(FileStore(settings), limiter=anyio.CapacityLimiter(2))
+    syft_path = Path(TEST_DATASITE_NAME) / TEST_FILE
+    data = bytes(range(256)) * 10
+
+    async def run():
+        await store.put(syft_path, data)
+        metadata = await store.get_metadata(syft_path)
+        abs_path = settings.snapshot_folder / metadata.path
+        chunks = [chunk async for chunk in store.iter_bytes(abs_path, 10, 1000, chunk_size=100)]
+        datasites = await store.run_db(get_all_datasites)
+        return chunks, datasites
+
+    chunks, datasites = anyio.run(run)
+    assert [len(chunk) for chunk in chunks] == [100] * 9 + [90]
+    assert b"".join(chunks) == data[10:1000]
+    assert datasites == [TEST_DATASITE_NAME]
+
+
+def test_download_range_streamed(client):
+    # files that do not fit in the content cache are streamed from disk
+    client.app_state["content_cache"] = ContentCache(max_bytes=0, max_object_size=0)
+    response = client.get(f"/sync/download/{TEST_DATASITE_NAME}/{TEST_FILE}", headers={"Range": "bytes=7-"})
+    assert response.status_code == 206
+    assert response.content == b"World!"
+    assert response.headers["content-length"] == "6"
@@ -0,0 +1,114 @@
+import gzip
+import re
+from dataclasses import dataclass
+
+from fastapi.testclient import TestClient
+
+from syftbox.server.metrics import CONTENT_TYPE, MetricsRegistry, ServerMetrics
+from tests.unit.server.conftest import TEST_DATASITE_NAME, TEST_FILE
+
+
+def _samples(text: str) -> dict[str, float]:
+    samples = {}
+    for line in text.splitlines():
+        if line and not line.startswith("#"):
+            name, value = line.rsplit(" ", 1)
+            samples[name] = float(value)
+    return samples
+
+
+def test_histogram_rendering():
+    registry = MetricsRegistry()
+    histogram = registry.histogram("latency_seconds", "Latency", ("route",), buckets=(0.1, 1.0))
+    histogram.observe(0.05, ("/a",))
+    histogram.observe(0.5, ("/a",))
+    histogram.observe(5.0, ("/a",))
+
+    text = registry.render()
+    assert "# TYPE latency_seconds histogram" in text
+    samples = _samples(text)
+    # buckets are cumulative
+    assert samples['latency_seconds_bucket{route="/a",le="0.1"}'] == 1
+    assert samples['latency_seconds_bucket{route="/a",le="1"}'] == 2
+    assert samples['latency_seconds_bucket{route="/a",le="+Inf"}'] == 3
+    assert samples['latency_seconds_count{route="/a"}'] == 3
+    assert samples['latency_seconds_sum{route="/a"}'] == 5.55
+
+
+def test_labels_are_escaped():
+    registry = MetricsRegistry()
+    counter = registry.counter("events_total", "Events", ("name",))
+    counter.inc(2, ('say "hi"\n',))
+    assert 'events_total{name="say \\"hi\\"\\n"} 2' in registry.render()
+
+
+def test_stats_collector():
+    @dataclass
+    class Stats:
+        hits: int = 3
+        wait_time_max: float = 0.5
+
+    registry = MetricsRegistry()
+    registry.add_stats("cache", Stats, gauges={"entries": lambda: 7})
+    text = registry.render()
+    assert "# TYPE syftbox_cache_hits_total counter" in text
+    assert "# TYPE syftbox_cache_wait_time_max gauge" in text
+    assert _samples(text) == {
+        "syftbox_cache_hits_total": 3,
+        "syftbox_cache_wait_time_max": 0.5,
+        "syftbox_cache_entries": 7,
+    }
+
+
+def test_metrics_endpoint(client: TestClient):
+    for _ in range(3):
+        response = client.post("/sync/get_metadata", json={"path_like": f"{TEST_DATASITE_NAME}/{TEST_FILE}"})
+        assert response.status_code == 200
+    response = client.get(f"/sync/download/{TEST_DATASITE_NAME}/{TEST_FILE}")
+    assert response.status_code == 200
+    response = client.post("/sync/datasites")
+    assert response.status_code == 200
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == CONTENT_TYPE
+    samples = _samples(response.text)
+
+    # latency per route template, not per path
+    route_count = 'syftbox_http_request_duration_seconds_count{method="POST",route="/sync/get_metadata",status="200"}'
+    assert samples[route_count] == 3
+    download_routes = [name for name in samples if "/sync/download/" in name]
+    assert download_routes and all("{path:path}" in name for name in download_routes)
+    assert samples['syftbox_http_request_bytes_total{route="/sync/get_metadata"}'] > 0
+    assert samples['syftbox_http_requests_in_flight{method="POST"}'] == 0
+    # the scrape itself is in flight
+    assert samples['syftbox_http_requests_in_flight{method="GET"}'] == 1
+
+    assert samples['syftbox_file_store_duration_seconds_count{operation="get_metadata"}'] >= 3
+    assert samples['syftbox_db_duration_seconds_count{operation="get_all_datasites"}'] == 1
+    assert "syftbox_content_cache_hits_total" in samples
+    assert "syftbox_cpu_executor_admitted_total" in samples
+    assert "syftbox_analytics_queue_submitted_total" in samples
+
+
+def test_metrics_of_compressed_requests(client: TestClient):
+    metrics: ServerMetrics = client.app_state["metrics"]
+    body = gzip.compress(f'{{"path_like": "{TEST_DATASITE_NAME}/{TEST_FILE}"}}'.encode())
+    response = client.post(
+        "/sync/get_metadata",
+        content=body,
+        headers={"Content-Encoding": "gzip", "Content-Type": "application/json"},
+    )
+    assert response.status_code == 200
+
+    # decompressed requests keep their route
+    assert metrics.request_duration.count(("POST", "/sync/get_metadata", "200")) == 1
+    assert metrics.request_bytes.get(("/sync/get_metadata",)) == len(body)
+
+
+def test_unmatched_routes(client: TestClient):
+    response = client.get("/does/not/exist")
+    assert response.status_code == 404
+    text = client.get("/metrics").text
+    assert re.search(r'route="unmatched",status="404"', text)
+    assert "/does/not/exist" not in text
@@ -0,0 +1,165 @@
+import contextlib
+import io
+import json
+import zipfile
+from pathlib import Path
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+from syftbox.client.plugins.sync.endpoints import (
+    create,
+    download,
+    download_bulk,
+    get_remote_state,
+    upload_bulk,
+    whoami,
+)
+from syftbox.server import mirror as mirror_module
+from syftbox.server.mirror import Mirror
+from syftbox.server.rate_limit import RateLimiter
+from syftbox.server.server import app
+from syftbox.server.settings import ServerSettings
+from syftbox.server.sync.file_store import FileStore
+from tests.unit.server.conftest import InProcessTransport, get_access_token
+
+MIRROR_EMAIL = "mirror@openmined.org"
+ALICE = "alice@openmined.org"
+BOB = "bob@openmined.org"
+
+
+@pytest.fixture
+def mirrored(monkeypatch, tmp_path: Path):
+    with contextlib.ExitStack() as stack:
+        monkeypatch.setenv("SYFTBOX_MIRROR_EMAILS", json.dumps([MIRROR_EMAIL]))
+        monkeypatch.setenv("SYFTBOX_DATA_FOLDER", str(tmp_path / "upstream"))
+        upstream = stack.enter_context(TestClient(app))
+        upstream.headers["Authorization"] = f"Bearer {get_access_token(upstream, MIRROR_EMAIL)}"
+
+        mirror_settings = ServerSettings.from_data_folder(tmp_path / "mirror")
+        monkeypatch.setenv("SYFTBOX_DATA_FOLDER", str(mirror_settings.data_folder))
+        mirror_client = stack.enter_context(TestClient(app))
+        mirror = Mirror(
+            FileStore(mirror_settings),
+            upstream=upstream,
+            async_upstream=httpx.AsyncClient(base_url="http://upstream", transport=InProcessTransport(upstream)),
+        )
+        mirror_client.app_state["mirror"] = mirror
+        yield mirror, mirror_client, upstream, tmp_path
+
+
+def test_mirror(mirrored):
+    mirror, mirror_client, upstream, tmp_path = mirrored
+    alice_headers = {"Authorization": f"Bearer {get_access_token(upstream, ALICE)}"}
+    mirror_client.headers.update(alice_headers)
+
+    # writes are proxied, and copied back before the response
+    assert whoami(mirror_client) == ALICE
+    permission = {"admin": [ALICE], "read": [ALICE], "write": [ALICE]}
+    create(mirror_client, Path(ALICE) / "_.syftperm", json.dumps(permission).encode())
+    create(mirror_client, Path(ALICE) / "file.txt", b"hello")
+    for server in ("upstream", "mirror"):
+        assert (tmp_path / server / "snapshot" / ALICE / "file.txt").read_bytes() == b"hello"
+    assert len(get_remote_state(mirror_client, Path(ALICE))) == 2
+
+    # changes on the upstream are copied by the next sync, including files the mirror account cannot read
+    response = upstream.post(
+        "/sync/create", files={"file": (f"{ALICE}/other.txt", b"other", "text/plain")}, headers=alice_headers
+    )
+    assert response.status_code == 200
+    response = upstream.post("/sync/delete", json={"path": f"{ALICE}/file.txt"}, headers=alice_headers)
+    assert response.status_code == 200
+    assert not (tmp_path / "mirror" / "snapshot" / ALICE / "other.txt").exists()
+
+    mirror.sync()
+    assert mirror.stats.downloaded == 1
+    assert mirror.stats.deleted == 1
+    assert {file.path.name for file in get_remote_state(mirror_client, Path(ALICE))} == {"_.syftperm", "other.txt"}
+
+    # nothing changed
+    mirror.sync()
+    assert mirror.stats.downloaded == 1
+
+    # reads are served from the mirror
+    assert download(mirror_client, Path(ALICE) / "other.txt") == b"other"
+    data = download_bulk(mirror_client, [f"{ALICE}/other.txt"])
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        assert zf.read(f"{ALICE}/other.txt") == b"other"
+
+    # with the permissions of the upstream
+    mirror_client.headers["Authorization"] = f"Bearer {get_access_token(upstream, BOB)}"
+    assert get_remote_state(mirror_client, Path(ALICE)) == []
+
+
+def test_mirror_bulk_upload(mirrored):
+    mirror, mirror_client, upstream, tmp_path = mirrored
+    mirror_client.headers["Authorization"] = f"Bearer {get_access_token(upstream, ALICE)}"
+
+    # the files created by a bulk upload are copied back before the response
+    files = [(Path(ALICE) / f"bulk_{i}.txt", f"bulk {i}".encode()) for i in range(3)]
+    result = upload_bulk(mirror_client, ALICE, files)
+    assert sorted(result.created) == [path for path, _ in files]
+    for path, data in files:
+        assert (tmp_path / "mirror" / "snapshot" / path).read_bytes() == data
+
+
+def test_mirror_bulk_upload_downloads_in_batches(mirrored, monkeypatch):
+    mirror, mirror_client, upstream, tmp_path = mirrored
+    mirror_client.headers["Authorization"] = f"Bearer {get_access_token(upstream, ALICE)}"
+    monkeypatch.setattr(mirror_module, "MAX_BULK_FILES", 2)
+    requests = []
+    upstream.event_hooks["request"].append(lambda request: requests.append(request.url.path))
+
+    files = [(Path(ALICE) / "bulk" / f"file_{i}.txt", f"bulk {i}".encode()) for i in range(5)]
+    result = upload_bulk(mirror_client, ALICE, files)
+    assert len(result.created) == 5
+    for path, data in files:
+        assert (tmp_path / "mirror" / "snapshot" / path).read_bytes() == data
+
+    # the proxied upload, a listing of the datasite, and the created files in batches of MAX_BULK_FILES
+    assert requests == ["/sync/upload_bulk", "/sync/dir_state"] + ["/sync/download_bulk"] * 3
+    assert mirror.stats.downloaded == 5
+    assert mirror.stats.errors == 0
+
+
+def test_mirror_deletes_removed_datasites(mirrored):
+    mirror, mirror_client, upstream, tmp_path = mirrored
+    alice_headers = {"Authorization": f"Bearer {get_access_token(upstream, ALICE)}"}
+    response = upstream.post(
+        "/sync/create", files={"file": (f"{ALICE}/file.txt", b"hello", "text/plain")}, headers=alice_headers
+    )
+    assert response.status_code == 200
+
+    mirror.sync()
+    assert (tmp_path / "mirror" / "snapshot" / ALICE / "file.txt").exists()
+
+    upstream.post("/sync/delete", json={"path": f"{ALICE}/file.txt"}, headers=alice_headers)
+    mirror.sync()
+    assert not (tmp_path / "mirror" / "snapshot" / ALICE / "file.txt").exists()
+
+
+def test_mirror_is_not_rate_limited(mirrored):
+    mirror, mirror_client, upstream, tmp_path = mirrored
+    alice_headers = {"Authorization": f"Bearer {get_access_token(upstream, ALICE)}"}
+    upstream.app_state["rate_limiter"] = RateLimiter(
+        requests_per_second=0.1, request_burst=1, bytes_per_second=0, bytes_burst=1
+    )
+    response = upstream.post(
+        "/sync/create", files={"file": (f"{ALICE}/file.txt", b"hello", "text/plain")}, headers=alice_headers
+    )
+    assert response.status_code == 200
+    assert upstream.post("/sync/datasites", headers=alice_headers).status_code == 429
+
+    for _ in range(3):
+        mirror.sync()
+    assert mirror.stats.errors == 0
+    assert (tmp_path / "mirror" / "snapshot" / ALICE / "file.txt").read_bytes() == b"hello"
+
+    # a rate limited refresh is an error, and leaves the local copy as is
+    settings = upstream.app_state["server_settings"]
+    upstream.app_state["server_settings"] = settings.model_copy(update={"mirror_emails": []})
+    upstream.app_state["rate_limiter"].acquire(MIRROR_EMAIL)
+    mirror.refresh_all([f"{ALICE}/file.txt"])
+    assert mirror.stats.errors == 1
+    assert (tmp_path / "mirror" / "snapshot" / ALICE / "file.txt").exists()
@@ -0,0 +1,159 @@
+import json
+from pathlib import Path
+
+from syftbox.lib.lib import PermissionTree, SyftPermission, filter_metadata
+from syftbox.server.settings import ServerSettings
+from syftbox.server.sync import db
+from syftbox.server.sync.file_store import FileStore
+from syftbox.server.sync.permissions import PermissionCache
+
+DATASITE = "user@openmined.org"
+
+
+def perm_bytes(perm: SyftPermission) -> bytes:
+    return json.dumps(perm.to_dict()).encode()
+
+
+def test_permission_cache_matches_tree(tmpdir):
+    settings = ServerSettings.from_data_folder(tmpdir)
+    store = FileStore(settings)
+    store.put(Path(DATASITE) / "_.syftperm", perm_bytes(SyftPermission.datasite_default(DATASITE)))
+    store.put(Path(DATASITE) / "public/_.syftperm", perm_bytes(SyftPermission.mine_with_public_read(DATASITE)))
+    store.put(Path(DATASITE) / "public/file.txt", b"public")
+
+    cache = PermissionCache(settings.snapshot_folder)
+    conn = db.get_db(settings.file_db_path)
+    cached_tree = cache.get(conn, DATASITE)
+    walked_tree = PermissionTree.from_path(settings.snapshot_folder / DATASITE)
+    assert cached_tree.tree == walked_tree.tree
+    assert cached_tree.root_perm == walked_tree.root_perm
+
+    # cache hits do not rebuild the tree
+    assert cache.get(conn, DATASITE) is cached_tree
+    store.put(Path(DATASITE) / "public/file.txt", b"public modified")
+    assert cache.get(conn, DATASITE) is cached_tree
+
+    # permission changes through the FileStore invalidate the tree
+    store.delete(Path(DATASITE) / "public/_.syftperm")
+    new_tree = cache.get(conn, DATASITE)
+    assert new_tree is not cached_tree
+    public_file = (settings.snapshot_folder / DATASITE / "public/file.txt").as_posix()
+    assert not new_tree.permission_for_path(public_file).has_read_permission("other@openmined.org")
+
+
+def test_acl_listing_matches_tree(tmpdir):
+    settings = ServerSettings.from_data_folder(tmpdir)
+    store = FileStore(settings)
+    other = "other@openmined.org"
+    terminal_perm = SyftPermission.mine_no_permission(DATASITE)
+    terminal_perm.terminal = True
+
+    store.put(Path(DATASITE) / "_.syftperm", perm_bytes(SyftPermission.datasite_default(DATASITE)))
+    store.put(Path(DATASITE) / "public/_.syftperm", perm_bytes(SyftPermission.mine_with_public_read(DATASITE)))
+    store.put(Path(DATASITE) / "public/private/_.syftperm", perm_bytes(SyftPermission.mine_no_permission(DATASITE)))
+    store.put(Path(DATASITE) / "shared/_.syftperm", perm_bytes(SyftPermission.theirs_with_my_read(DATASITE, other)))
+    store.put(Path(DATASITE) / "locked/_.syftperm", perm_bytes(terminal_perm))
+    store.put(Path(DATASITE) / "locked/public/_.syftperm", perm_bytes(SyftPermission.mine_with_public_read(DATASITE)))
+    for dir in ["", "public/", "public/a/", "public/private/", "shared/", "shared/b/", "locked/", "locked/public/"]:
+        store.put(Path(f"{DATASITE}/{dir}file.txt"), b"data")
+    # files in a different datasite with a similar name are not listed
+    store.put(Path(f"{DATASITE}2/public/file.txt"), b"data")
+
+    def expected_listing(email: str, dir: str) -> list[str]:
+        perm_tree = PermissionTree.from_path((settings.snapshot_folder / DATASITE).as_posix())
+        metadata = [m for m in store.list(Path(dir)) if m.path.is_relative_to(dir)]
+        return sorted(m.path.as_posix() for m in filter_metadata(email, metadata, perm_tree, settings.snapshot_folder))
+
+    for email in [DATASITE, other, "nobody@openmined.org"]:
+        for dir in [DATASITE, f"{DATASITE}/public", f"{DATASITE}/shared"]:
+            listing = sorted(m.path.as_posix() for m in store.list(Path(dir), readable_by=email))
+            assert listing == expected_listing(email, dir)
+
+    assert len(store.list(Path(f"{DATASITE}/public"), readable_by=other)) == 3
+    assert not store.list(Path(f"{DATASITE}/locked"), readable_by=other)
+
+    # permission changes through the FileStore update the ACL
+    store.delete(Path(DATASITE) / "public/_.syftperm")
+    assert not store.list(Path(f"{DATASITE}/public"), readable_by=other)
+    store.put(Path(DATASITE) / "locked/_.syftperm", perm_bytes(SyftPermission.mine_with_public_read(DATASITE)))
+    assert len(store.list(Path(f"{DATASITE}/locked"), readable_by=other)) == 4
+
+
+def test_rebuild_acl(tmpdir):
+    settings = ServerSettings.from_data_folder(tmpdir)
+    store = FileStore(settings)
+    store.put(Path(DATASITE) / "_.syftperm", perm_bytes(SyftPermission.mine_with_public_read(DATASITE)))
+    store.put(Path(DATASITE) / "file.txt", b"data")
+    (settings.snapshot_folder / DATASITE / "_.syftperm").write_text("corrupted")
+
+    conn = db.get_db(settings.file_db_path)
+    assert db.get_corrupted_permission_files(conn, DATASITE) == []
+    db.rebuild_acl(conn, settings.snapshot_folder)
+    assert db.get_corrupted_permission_files(conn, DATASITE) == [f"{DATASITE}/_.syftperm"]
+    assert db.get_readable_metadata(conn, DATASITE, DATASITE) == []
+
+
+def test_acl_scope_tree_follows_permission_changes(tmpdir):
+    settings = ServerSettings.from_data_folder(tmpdir)
+    store = FileStore(settings)
+    other = "other@openmined.org"
+    terminal_perm = SyftPermission.mine_no_permission(DATASITE)
+    terminal_perm.terminal = True
+
+    store.put(Path(DATASITE) / "_.syftperm", perm_bytes(SyftPermission.datasite_default(DATASITE)))
+    # child scopes are created before their parent
+    store.put(Path(DATASITE) / "a/b/_.syftperm", perm_bytes(SyftPermission.mine_with_public_read(DATASITE)))
+    store.put(Path(DATASITE) / "a/c/_.syftperm", perm_bytes(SyftPermission.datasite_default(DATASITE)))
+    store.put(Path(DATASITE) / "a/_.syftperm", perm_bytes(SyftPermission.mine_with_public_read(DATASITE)))
+    for dir in ["", "a/", "a/b/", "a/b/x/", "a/c/", "a/d/"]:
+        store.put(Path(f"{DATASITE}/{dir}file.txt"), b"data")
+
+    def readable(email: str) -> list[str]:
+        return sorted(m.path.as_posix() for m in store.list(Path(DATASITE), readable_by=email))
+
+    def expected(email: str) -> list[str]:
+        perm_tree = PermissionTree.from_path((settings.snapshot_folder / DATASITE).as_posix())
+        metadata = store.list(Path(DATASITE))
+        return sorted(m.path.as_posix() for m in filter_metadata(email, metadata, perm_tree, settings.snapshot_folder))
+
+    conn = db.get_db(settings.file_db_path)
+    parents = dict(conn.execute("SELECT path, parent FROM acl_scope"))
+    assert parents[f"{DATASITE}/a/b/"] == f"{DATASITE}/a/"
+    assert parents[f"{DATASITE}/a/"] == f"{DATASITE}/"
+    assert readable(other) == expected(other)
+
+    # deleting a scope moves its child scopes to the enclosing scope
+    store.delete(Path(DATASITE) / "a/_.syftperm")
+    assert readable(other) == expected(other)
+
+    # a terminal scope shadows the scopes below it, until it is no longer terminal
+    store.put(Path(DATASITE) / "a/_.syftperm", perm_bytes(terminal_perm))
+    assert readable(other) == expected(other) == []
+    store.put(Path(DATASITE) / "a/_.syftperm", perm_bytes(SyftPermission.mine_with_public_read(DATASITE)))
+    assert readable(other) == expected(other)
+    assert len(readable(other)) == 6
+
+
+def test_acl_scope_tree_migration(tmpdir):
+    settings = ServerSettings.from_data_folder(tmpdir)
+    store = FileStore(settings)
+    store.put(Path(DATASITE) / "_.syftperm", perm_bytes(SyftPermission.datasite_default(DATASITE)))
+    store.put(Path(DATASITE) / "public/_.syftperm", perm_bytes(SyftPermission.mine_with_public_read(DATASITE)))
+    store.put(Path(DATASITE) / "public/file.txt", b"data")
+
+    # acl_scope as created before the scope tree columns existed
+    conn = db.get_db(settings.file_db_path)
+    conn.execute("DROP INDEX acl_scope_parent")
+    conn.execute("ALTER TABLE acl_scope DROP COLUMN parent")
+    conn.execute("ALTER TABLE acl_scope DROP COLUMN shadowed")
+    conn.commit()
+    conn.close()
+
+    conn = db.get_db(settings.file_db_path)
+    parents = dict(conn.execute("SELECT path, parent FROM acl_scope"))
+    assert parents == {f"{DATASITE}/": None, f"{DATASITE}/public/": f"{DATASITE}/"}
+    readable = db.get_readable_metadata(conn, "other@openmined.org", DATASITE)
+    assert sorted(m.path.as_posix() for m in readable) == [
+        f"{DATASITE}/public/_.syftperm",
+        f"{DATASITE}/public/file.txt",
+    ]
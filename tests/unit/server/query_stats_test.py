@@ -0,0 +1,106 @@
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+from loguru import logger
+
+from syftbox.server.sync import db
+from syftbox.server.sync.query_stats import QUERY_STATS, explain_query_plan, normalize_sql
+from tests.unit.server.conftest import TEST_DATASITE_NAME
+
+
+@pytest.fixture
+def query_stats():
+    QUERY_STATS.configure(enabled=True, slow_query_seconds=None)
+    QUERY_STATS.reset()
+    yield QUERY_STATS
+    QUERY_STATS.configure(enabled=False, slow_query_seconds=None)
+    QUERY_STATS.reset()
+
+
+def _stats_of(query_stats, sql: str):
+    return next(stats for stats in query_stats.statements() if stats.sql == sql)
+
+
+def test_normalize_sql():
+    assert normalize_sql("SELECT *\n  FROM t WHERE a IN (?, ?,?)  AND b = ?") == (
+        "SELECT * FROM t WHERE a IN (?, ...) AND b = ?"
+    )
+
+
+def test_statements_are_recorded(tmp_path: Path, query_stats):
+    conn = db.get_db(tmp_path / "test.db")
+    conn.executemany(
+        "INSERT INTO server_meta (key, value) VALUES (?, ?)",
+        [(f"key{i}", "value") for i in range(10)],
+    )
+    conn.commit()
+    for _ in range(2):
+        rows = list(conn.execute("SELECT key FROM server_meta WHERE key LIKE 'key%'"))
+        assert len(rows) == 10
+    # not fully fetched, recorded when the cursor is deleted
+    assert conn.execute("SELECT key FROM server_meta WHERE key IN (?, ?)", ("key1", "key2")).fetchone()
+    conn.cursor().execute("BEGIN IMMEDIATE;")
+    conn.commit()
+    conn.close()
+
+    insert = _stats_of(query_stats, "INSERT INTO server_meta (key, value) VALUES (?, ...)")
+    assert insert.calls == 1 and insert.rows == 10
+    select = _stats_of(query_stats, "SELECT key FROM server_meta WHERE key LIKE 'key%'")
+    assert select.calls == 2 and select.rows == 20
+    assert select.time_total > 0
+    assert _stats_of(query_stats, "SELECT key FROM server_meta WHERE key IN (?, ...)").rows == 1
+    begin = _stats_of(query_stats, "BEGIN IMMEDIATE;")
+    assert begin.lock_wait_total == begin.time_total > 0
+
+    totals = query_stats.totals()
+    assert totals.queries == sum(stats.calls for stats in query_stats.statements())
+
+
+def test_slow_query_log(tmp_path: Path, query_stats):
+    messages = []
+    sink_id = logger.add(lambda message: messages.append(message.record["message"]), level="WARNING")
+    query_stats.configure(enabled=True, slow_query_seconds=0)
+    try:
+        conn = db.get_db(tmp_path / "test.db")
+        conn.execute("SELECT COUNT(*) FROM file_metadata").fetchall()
+        conn.close()
+    finally:
+        logger.remove(sink_id)
+
+    assert any("Slow query" in message and "SELECT COUNT(*) FROM file_metadata" in message for message in messages)
+    assert _stats_of(query_stats, "SELECT COUNT(*) FROM file_metadata").slow_calls == 1
+
+
+def test_disabled(tmp_path: Path, query_stats):
+    query_stats.configure(enabled=False, slow_query_seconds=None)
+    conn = db.get_db(tmp_path / "test.db")
+    conn.execute("SELECT COUNT(*) FROM file_metadata").fetchall()
+    conn.close()
+    assert query_stats.statements() == []
+
+
+def test_explain_query_plan(tmp_path: Path):
+    conn = db.get_db(tmp_path / "test.db")
+    plan = explain_query_plan(conn, "SELECT hash FROM file_metadata WHERE path = ?")
+    conn.close()
+    assert len(plan) == 1
+    assert "USING INDEX" in plan[0]
+
+
+def test_admin_db_queries(client: TestClient, query_stats):
+    response = client.get("/admin/db/queries")
+    assert response.status_code == 403
+
+    client.app_state["server_settings"].admin_emails = [TEST_DATASITE_NAME]
+    response = client.post("/sync/datasites")
+    assert response.status_code == 200
+    response = client.get("/admin/db/queries", params={"limit": 1000})
+    assert response.status_code == 200
+
+    statements = {item["sql"]: item for item in response.json()}
+    datasites_query = next(item for sql, item in statements.items() if sql.startswith("SELECT datasite FROM"))
+    assert datasites_query["calls"] >= 1
+    assert datasites_query["query_plan"]
+    # statements without a plan
+    assert all(not item["query_plan"] for sql, item in statements.items() if sql.startswith("PRAGMA"))
@@ -0,0 +1,66 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from syftbox.client.exceptions import SyftRateLimited
+from syftbox.client.plugins.sync.endpoints import get_datasite_states, raise_for_rate_limit
+from syftbox.server.rate_limit import RateLimiter, RateLimitExceeded
+from tests.unit.server.conftest import TEST_DATASITE_NAME, TEST_FILE
+
+
+def test_request_limit():
+    rate_limiter = RateLimiter(requests_per_second=1, request_burst=2, bytes_per_second=0, bytes_burst=1)
+    rate_limiter.acquire("alice")
+    rate_limiter.acquire("alice")
+    with pytest.raises(RateLimitExceeded) as e:
+        rate_limiter.acquire("alice")
+    assert 0 < e.value.retry_after <= 1
+
+    # buckets are per user
+    rate_limiter.acquire("bob")
+    assert rate_limiter.rejected == 1
+
+
+def test_first_request_within_burst_of_one():
+    rate_limiter = RateLimiter(requests_per_second=0.1, request_burst=1, bytes_per_second=0, bytes_burst=1)
+    rate_limiter.acquire("alice")
+    with pytest.raises(RateLimitExceeded):
+        rate_limiter.acquire("alice")
+
+
+def test_byte_limit_allows_debt():
+    rate_limiter = RateLimiter(requests_per_second=0, request_burst=1, bytes_per_second=100, bytes_burst=100)
+    # larger than the burst, but the bucket is not in debt yet
+    bucket = rate_limiter.acquire("alice", n_bytes=150)
+    assert bucket.tokens < 0
+    with pytest.raises(RateLimitExceeded) as e:
+        rate_limiter.acquire("alice")
+    assert 0 < e.value.retry_after <= 0.5
+
+
+def test_rate_limited_endpoint(client: TestClient):
+    client.app_state["rate_limiter"] = RateLimiter(
+        requests_per_second=0.1, request_burst=2, bytes_per_second=0, bytes_burst=1
+    )
+    for _ in range(2):
+        client.post("/sync/datasites").raise_for_status()
+
+    response = client.post("/sync/datasites")
+    assert response.status_code == 429
+    assert int(response.headers["retry-after"]) == 10
+
+    client.event_hooks["response"].append(raise_for_rate_limit)
+    with pytest.raises(SyftRateLimited) as e:
+        get_datasite_states(client, TEST_DATASITE_NAME)
+    assert e.value.retry_after == 10
+
+
+def test_response_bytes_are_charged(client: TestClient):
+    rate_limiter = RateLimiter(requests_per_second=0, request_burst=1, bytes_per_second=1, bytes_burst=10)
+    client.app_state["rate_limiter"] = rate_limiter
+
+    response = client.get(f"/sync/download/{TEST_DATASITE_NAME}/{TEST_FILE}")
+    response.raise_for_status()
+    assert len(response.content) > 10
+
+    response = client.get(f"/sync/download/{TEST_DATASITE_NAME}/{TEST_FILE}")
+    assert response.status_code == 429
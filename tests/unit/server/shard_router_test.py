@@ -0,0 +1,90 @@
+import contextlib
+import io
+import json
+import zipfile
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+
+from syftbox.client.plugins.sync.endpoints import (
+    create,
+    download_bulk,
+    get_datasite_states_if_changed,
+    get_remote_state,
+)
+from syftbox.server.server import app
+from syftbox.server.settings import ServerSettings
+from syftbox.server.shard_router import HashRing, create_shard_router_app
+from tests.unit.server.conftest import InProcessTransport, get_access_token
+
+SHARDS = ["http://shard0", "http://shard1"]
+
+
+@pytest.fixture
+def sharded(monkeypatch, tmp_path: Path):
+    with contextlib.ExitStack() as stack:
+        transports = {}
+        for i, shard in enumerate(SHARDS):
+            settings = ServerSettings.from_data_folder(tmp_path / f"shard{i}")
+            monkeypatch.setenv("SYFTBOX_DATA_FOLDER", str(settings.data_folder))
+            transports[shard] = InProcessTransport(stack.enter_context(TestClient(app)))
+
+        router = stack.enter_context(TestClient(create_shard_router_app(SHARDS, transports=transports)))
+        yield router, tmp_path
+
+
+def _datasites_on_different_shards(ring: HashRing) -> list[str]:
+    by_shard = {}
+    for i in range(100):
+        datasite = f"user{i}@openmined.org"
+        by_shard.setdefault(ring.get_shard(datasite), datasite)
+    return [by_shard[shard] for shard in SHARDS]
+
+
+def test_hash_ring_is_consistent():
+    ring = HashRing(SHARDS)
+    keys = [f"user{i}@openmined.org" for i in range(1000)]
+    assignment = {key: ring.get_shard(key) for key in keys}
+    counts = [list(assignment.values()).count(shard) for shard in SHARDS]
+    assert min(counts) > 300
+
+    # adding a shard only moves keys to the new shard
+    bigger_ring = HashRing(SHARDS + ["http://shard2"])
+    for key in keys:
+        assert bigger_ring.get_shard(key) in (assignment[key], "http://shard2")
+
+
+def test_sharded_sync(sharded):
+    router, tmp_path = sharded
+    datasites = _datasites_on_different_shards(HashRing(SHARDS))
+    router.headers["Authorization"] = f"Bearer {get_access_token(router, datasites[0])}"
+
+    for datasite in datasites:
+        permission = {"admin": [datasite], "read": ["GLOBAL"], "write": [datasite]}
+        create(router, Path(datasite) / "_.syftperm", json.dumps(permission).encode())
+        create(router, Path(datasite) / "file.txt", datasite.encode())
+
+    # each datasite is only stored on its own shard
+    for i, datasite in enumerate(datasites):
+        assert (tmp_path / f"shard{i}" / "snapshot" / datasite / "file.txt").read_bytes() == datasite.encode()
+        assert not (tmp_path / f"shard{1 - i}" / "snapshot" / datasite).exists()
+        assert len(get_remote_state(router, Path(datasite))) == 2
+
+    states, etags = get_datasite_states_if_changed(router, {})
+    assert set(states) == set(datasites)
+    assert set(etags) == set(datasites)
+    assert all(len(state) == 2 for state in states.values())
+
+    # nothing changed on any shard
+    response = router.post("/sync/datasite_states", headers={"If-None-Match": ", ".join(etags.values())})
+    assert response.status_code == 304
+
+    assert router.post("/sync/datasites").json() == sorted(datasites)
+
+    data = download_bulk(router, [f"{datasite}/file.txt" for datasite in datasites])
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        assert sorted(zf.namelist()) == sorted(f"{datasite}/file.txt" for datasite in datasites)
+
+    response = router.get(f"/sync/download/{datasites[1]}/file.txt")
+    assert response.content == datasites[1].encode()
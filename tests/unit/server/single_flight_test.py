@@ -0,0 +1,80 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from fastapi.testclient import TestClient
+
+from syftbox.server.sync.single_flight import SingleFlight
+from tests.unit.server.conftest import TEST_DATASITE_NAME, TEST_FILE
+
+
+def test_single_flight_coalesces_concurrent_calls():
+    single_flight = SingleFlight(ttl=0)
+    started = threading.Event()
+    release = threading.Event()
+    calls = 0
+
+    def compute():
+        nonlocal calls
+        calls += 1
+        started.set()
+        release.wait()
+        return "result"
+
+    with ThreadPoolExecutor(max_workers=5) as executor:
+        leader = executor.submit(single_flight.do, "key", compute)
+        started.wait()
+        followers = [executor.submit(single_flight.do, "key", compute) for _ in range(4)]
+        while single_flight.stats.coalesced < 4:
+            time.sleep(0.001)
+        release.set()
+        results = [leader.result()] + [f.result() for f in followers]
+
+    assert results == ["result"] * 5
+    assert calls == 1
+    # ttl=0 does not keep results
+    assert len(single_flight) == 0
+
+
+def test_single_flight_micro_cache():
+    single_flight = SingleFlight(ttl=60, max_entries=2)
+    assert single_flight.do("a", lambda: 1) == 1
+    assert single_flight.do("a", lambda: 2) == 1
+    assert single_flight.stats.hits == 1
+
+    single_flight.do("b", lambda: 1)
+    single_flight.do("c", lambda: 1)
+    assert len(single_flight) == 2
+    assert single_flight.do("a", lambda: 3) == 3
+
+
+def test_single_flight_expiry_and_errors():
+    single_flight = SingleFlight(ttl=0.01)
+    single_flight.do("a", lambda: 1)
+    time.sleep(0.02)
+    assert single_flight.do("a", lambda: 2) == 2
+
+    def fail():
+        raise ValueError("failed")
+
+    with pytest.raises(ValueError):
+        single_flight.do("b", fail)
+    # errors are not cached
+    assert single_flight.do("b", lambda: 1) == 1
+
+
+def test_datasite_states_shared_between_requests(client: TestClient):
+    single_flight: SingleFlight = client.app_state["single_flight"]
+    single_flight.ttl = 60
+
+    first = client.post("/sync/datasite_states").json()
+    second = client.post("/sync/datasite_states").json()
+    assert first == second
+    assert len(first[TEST_DATASITE_NAME]) > 0
+    assert single_flight.stats.hits == 1
+
+    # a write bumps the datasite version, so the listing is computed again
+    client.post("/sync/delete", json={"path": f"{TEST_DATASITE_NAME}/{TEST_FILE}"}).raise_for_status()
+    third = client.post("/sync/datasite_states").json()
+    assert len(third[TEST_DATASITE_NAME]) == len(first[TEST_DATASITE_NAME]) - 1
@@ -0,0 +1,55 @@
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from syftbox.server.server import Users
+from syftbox.server.startup import RUN_ID_ENV, run_once
+
+
+def test_run_once_per_run_id(tmp_path: Path, monkeypatch):
+    monkeypatch.setenv(RUN_ID_ENV, "run-1")
+    calls = []
+
+    def startup():
+        # other workers should wait for the lock
+        time.sleep(0.05)
+        calls.append(1)
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(lambda _: run_once(tmp_path, startup), range(4)))
+
+    assert len(calls) == 1
+    assert sorted(results) == [False, False, False, True]
+
+    # a new run of the server runs the startup tasks again
+    monkeypatch.setenv(RUN_ID_ENV, "run-2")
+    assert run_once(tmp_path, startup)
+    assert len(calls) == 2
+
+
+def test_run_once_without_run_id(tmp_path: Path, monkeypatch):
+    monkeypatch.delenv(RUN_ID_ENV, raising=False)
+    calls = []
+    run_once(tmp_path, lambda: calls.append(1))
+    run_once(tmp_path, lambda: calls.append(1))
+    assert len(calls) == 2
+
+
+def test_users_migrate_from_json(tmp_path: Path):
+    json_path = tmp_path / "users.json"
+    json_path.write_text(json.dumps({"a@openmined.org": {"email": "a@openmined.org", "token": 123}}))
+
+    users = Users(tmp_path / "users.db")
+    assert users.migrate_from_json(json_path) == 1
+    assert not json_path.exists()
+    assert users.get_user("a@openmined.org").token == 123
+    # existing users keep their token
+    assert users.create_user("a@openmined.org") == 123
+
+    token = users.create_user("b@openmined.org")
+    # shared by all workers
+    other_worker_users = Users(tmp_path / "users.db")
+    assert other_worker_users.create_user("b@openmined.org") == token
+    assert len(other_worker_users) == 2
+    assert users.get_user("c@openmined.org") is None
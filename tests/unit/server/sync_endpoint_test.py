@@ -9,17 +9,19 @@ import pytest
 from fastapi.testclient import TestClient
 from py_fast_rsync import signature
 
-from syftbox.client.exceptions import SyftServerError
+from syftbox.client.exceptions import SyftNotFound, SyftServerError
 from syftbox.client.plugins.sync.endpoints import (
     apply_diff,
     download_bulk,
+    download_to_file,
     get_datasite_states,
+    get_datasite_states_if_changed,
     get_diff,
     get_metadata,
     get_remote_state,
 )
 from syftbox.lib.lib import FileMetadata
-from syftbox.server.sync.models import ApplyDiffResponse, DiffResponse
+from syftbox.server.sync.models import COLUMNAR_MEDIA_TYPE, ApplyDiffResponse, DiffResponse
 from tests.unit.server.conftest import PERMFILE_FILE, TEST_DATASITE_NAME, TEST_FILE
 
 
@@ -239,6 +241,41 @@ def test_get_all_datasite_states(client: TestClient):
     assert all(isinstance(m, FileMetadata) for m in metadatas)
 
 
+def test_datasite_states_etags(client: TestClient):
+    states, etags = get_datasite_states_if_changed(client, {})
+    assert len(states[TEST_DATASITE_NAME]) == 3
+    assert set(etags) == {TEST_DATASITE_NAME}
+
+    # nothing changed, server returns a 304
+    response = client.post("/sync/datasite_states", headers={"If-None-Match": etags[TEST_DATASITE_NAME]})
+    assert response.status_code == 304
+    states, new_etags = get_datasite_states_if_changed(client, etags)
+    assert states == {TEST_DATASITE_NAME: None}
+    assert new_etags == {}
+
+    # a write to the datasite invalidates the etag
+    files = {"file": (f"{TEST_DATASITE_NAME}/new.txt", b"new content")}
+    client.post("/sync/create", files=files).raise_for_status()
+    states, new_etags = get_datasite_states_if_changed(client, etags)
+    assert len(states[TEST_DATASITE_NAME]) == 4
+    assert new_etags[TEST_DATASITE_NAME] != etags[TEST_DATASITE_NAME]
+
+
+def test_dir_state_etag(client: TestClient):
+    response = client.post("/sync/dir_state", params={"dir": TEST_DATASITE_NAME})
+    response.raise_for_status()
+    etag = response.headers["etag"]
+
+    response = client.post("/sync/dir_state", params={"dir": TEST_DATASITE_NAME}, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+    client.post("/sync/delete", json={"path": f"{TEST_DATASITE_NAME}/{TEST_FILE}"}).raise_for_status()
+    response = client.post("/sync/dir_state", params={"dir": TEST_DATASITE_NAME}, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert len(response.json()) == 2
+    assert response.headers["etag"] != etag
+
+
 def test_download_snapshot(client: TestClient):
     metadata = get_remote_state(client, Path(TEST_DATASITE_NAME))
     paths = [m.path.as_posix() for m in metadata]
@@ -247,7 +284,90 @@ def test_download_snapshot(client: TestClient):
     assert len(zip_file.filelist) == 3
 
 
+def test_download_etag_and_range(client: TestClient):
+    url = f"/sync/download/{TEST_DATASITE_NAME}/{TEST_FILE}"
+    response = client.get(url)
+    response.raise_for_status()
+    assert response.content == b"Hello, World!"
+
+    etag = response.headers["etag"]
+    assert etag == f'"{hashlib.sha256(b"Hello, World!").hexdigest()}"'
+
+    response = client.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+    response = client.get(url, headers={"Range": "bytes=7-"})
+    assert response.status_code == 206
+    assert response.content == b"World!"
+    assert response.headers["content-range"] == "bytes 7-12/13"
+
+    response = client.get(url, headers={"Range": "bytes=-6"})
+    assert response.status_code == 206
+    assert response.content == b"World!"
+
+    # stale If-Range returns the full file
+    response = client.get(url, headers={"Range": "bytes=7-", "If-Range": '"outdated"'})
+    assert response.status_code == 200
+    assert response.content == b"Hello, World!"
+
+    response = client.get(url, headers={"Range": "bytes=100-"})
+    assert response.status_code == 416
+
+    response = client.get(f"/sync/download/{TEST_DATASITE_NAME}/nonexistent_file.txt")
+    assert response.status_code == 404
+
+
+def test_download_to_file_resumes(client: TestClient, tmp_path: Path):
+    path = Path(TEST_DATASITE_NAME) / TEST_FILE
+    metadata = get_metadata(client, path)
+
+    dest = tmp_path / "partial.part"
+    dest.write_bytes(b"Hello")
+    download_to_file(client, path, dest, etag=metadata.hash)
+    assert dest.read_bytes() == b"Hello, World!"
+
+    # partial file from an outdated version is overwritten
+    dest.write_bytes(b"Bye")
+    download_to_file(client, path, dest, etag="outdated")
+    assert dest.read_bytes() == b"Hello, World!"
+
+
+def test_download_to_file_complete_or_corrupted(client: TestClient, tmp_path: Path):
+    path = Path(TEST_DATASITE_NAME) / TEST_FILE
+    metadata = get_metadata(client, path)
+
+    # a complete partial file is not downloaded again
+    dest = tmp_path / "partial.part"
+    dest.write_bytes(b"Hello, World!")
+    download_to_file(client, path, dest, etag=metadata.hash)
+    assert dest.read_bytes() == b"Hello, World!"
+
+    # a corrupted partial file is discarded, the next attempt downloads the full file
+    dest.write_bytes(b"Hellx")
+    with pytest.raises(SyftNotFound):
+        download_to_file(client, path, dest, etag=metadata.hash)
+    assert not dest.exists()
+    download_to_file(client, path, dest, etag=metadata.hash)
+    assert dest.read_bytes() == b"Hello, World!"
+
+
 def test_whoami(client: TestClient):
     response = client.post("/auth/whoami")
     response.raise_for_status()
     assert response.json() == {"email": TEST_DATASITE_NAME}
+
+
+def test_datasite_states_columnar(client: TestClient):
+    json_states = get_datasite_states(client, TEST_DATASITE_NAME)
+
+    response = client.post("/sync/datasite_states", headers={"Accept": COLUMNAR_MEDIA_TYPE})
+    response.raise_for_status()
+    assert response.headers["content-type"] == COLUMNAR_MEDIA_TYPE
+
+    # get_datasite_states_if_changed negotiates the columnar encoding
+    states, _ = get_datasite_states_if_changed(client, {})
+    for expected, actual in zip(
+        sorted(json_states[TEST_DATASITE_NAME], key=lambda m: m.path),
+        sorted(states[TEST_DATASITE_NAME], key=lambda m: m.path),
+    ):
+        assert expected.model_dump() == actual.model_dump()
@@ -0,0 +1,53 @@
+import time
+
+from fastapi.testclient import TestClient
+
+from syftbox.server.users.token_cache import TokenCache
+from tests.unit.server.conftest import TEST_DATASITE_NAME
+
+
+def test_token_cache_lru():
+    cache = TokenCache(max_size=2)
+    cache.put("token1", {"email": "a"})
+    cache.put("token2", {"email": "b"})
+    assert cache.get("token1") == {"email": "a"}
+    cache.put("token3", {"email": "c"})
+
+    # token2 was least recently used
+    assert cache.get("token2") is None
+    assert cache.get("token1") is not None
+    assert cache.stats.evictions == 1
+    # tokens are only held as hashes
+    assert all(isinstance(key, bytes) and len(key) == 32 for key in cache._tokens)
+
+
+def test_token_cache_respects_exp():
+    cache = TokenCache(max_size=10)
+    cache.put("expired", {"email": "a", "exp": time.time() - 1})
+    cache.put("valid", {"email": "a", "exp": time.time() + 60})
+    assert cache.get("expired") is None
+    assert cache.get("valid") is not None
+    assert cache.stats.expired == 1
+    assert len(cache) == 1
+
+
+def test_disabled_token_cache():
+    cache = TokenCache(max_size=0)
+    cache.put("token", {"email": "a"})
+    assert cache.get("token") is None
+
+
+def test_requests_use_cached_token(client: TestClient):
+    token_cache: TokenCache = client.app_state["token_cache"]
+    for _ in range(3):
+        response = client.post("/auth/whoami")
+        assert response.status_code == 200
+        assert response.json()["email"] == TEST_DATASITE_NAME
+    assert token_cache.stats.hits >= 2
+
+    # invalid tokens are rejected, and not cached
+    response = client.post("/auth/whoami", headers={"Authorization": "Bearer invalid"})
+    assert response.status_code == 401
+    response = client.post("/auth/whoami", headers={"Authorization": "Bearer invalid"})
+    assert response.status_code == 401
+    assert len(token_cache) == 1
@@ -10,7 +10,7 @@ from fastapi.testclient import TestClient
 from loguru import logger
 
 from syftbox.client.base import SyftClientInterface
-from syftbox.client.plugins.sync.constants import MAX_FILE_SIZE_MB
+from syftbox.client.plugins.sync.constants import MAX_FILE_SIZE_MB, MIN_BULK_UPLOAD_FILES
 from syftbox.client.plugins.sync.exceptions import FatalSyncError
 from syftbox.client.plugins.sync.manager import DatasiteState, SyncManager, SyncQueueItem
 from syftbox.client.utils.dir_tree import DirTree, create_dir_tree
@@ -152,6 +152,33 @@ def test_create_file(server_client: TestClient, datasite_1: SyftClientInterface,
     assert_files_on_datasite(datasite_2, [Path(datasite_1.email) / "folder1" / "file.txt"])
 
 
+def test_create_many_files_in_batch(server_client: TestClient, datasite_1: SyftClientInterface):
+    server_settings: ServerSettings = server_client.app_state["server_settings"]
+    # each datasite has its own server lifespan
+    metrics = datasite_1.server_client.app_state["metrics"]
+    sync_service = SyncManager(datasite_1)
+
+    tree = {
+        "seed": {
+            "_.syftperm": SyftPermission.mine_with_public_read(datasite_1.email),
+            **{f"file_{i}.txt": fake.text(max_nb_chars=1000) for i in range(MIN_BULK_UPLOAD_FILES)},
+        },
+    }
+    create_dir_tree(Path(datasite_1.datasite), tree)
+    sync_service.run_single_thread()
+
+    assert metrics.request_duration.count(("POST", "/sync/upload_bulk", "200")) == 1
+    assert_dirtree_exists(server_settings.snapshot_folder / datasite_1.email, tree)
+    for datasite in sync_service.get_datasite_states():
+        out_of_sync_permissions, out_of_sync_files = datasite.get_out_of_sync_files()
+        assert not out_of_sync_files
+        assert not out_of_sync_permissions
+
+    # the uploaded files are in the previous state, syncing again does not upload them again
+    sync_service.run_single_thread()
+    assert metrics.request_duration.count(("POST", "/sync/upload_bulk", "200")) == 1
+
+
 def test_modify(server_client: TestClient, datasite_1: SyftClientInterface):
     server_settings: ServerSettings = server_client.app_state["server_settings"]
     sync_service_1 = SyncManager(datasite_1)